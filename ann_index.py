@@ -0,0 +1,258 @@
+"""
+Approximate nearest-neighbour search for large galleries (IVF, NumPy only).
+Embeddings are clustered into nlist coarse cells with spherical k-means; a query only
+scans the nprobe closest cells. Small indexes fall back to an exact scan.
+
+Benchmark against the exact cosine scan:
+    python ann_index.py --size 100000 --queries 500 --nprobe 4 8 16 32
+"""
+import argparse
+import copy
+import time
+import numpy as np
+from matching import normalize_rows
+
+
+def spherical_kmeans(vectors, k, iterations=10, seed=0, sample_size=None):
+    """Cosine k-means on L2-normalized vectors. Returns (k, dim) normalized centroids."""
+    rng = np.random.default_rng(seed)
+    if sample_size and len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=k)
+        # Re-seed empty cells with random points
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalized embeddings with integer ids.
+    Supports incremental add/remove, save/load, and an exact scan while the index
+    holds fewer than exact_threshold vectors (or has not been trained yet).
+    """
+
+    def __init__(self, dim=128, nlist=None, nprobe=8, exact_threshold=20000):
+        """
+        :param nlist: Number of coarse cells (default ~sqrt(N) at training time)
+        :param nprobe: Cells scanned per query
+        :param exact_threshold: Below this many vectors every query is an exact scan
+        """
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self.centroids = None
+        self._lists = []      # per cell: [vectors (n, dim), ids (n,)]
+        self._location = {}   # id -> cell
+        self._flat = None     # cached (ids, vectors) for the exact scan
+
+    def __len__(self):
+        return len(self._location)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors, iterations=10, seed=0):
+        """Learn the coarse cells. Existing vectors are redistributed."""
+        vectors = normalize_rows(vectors)
+        nlist = self.nlist or max(1, int(np.sqrt(len(vectors))))
+        centroids = spherical_kmeans(vectors, nlist, iterations, seed, sample_size=64 * nlist)
+        self.set_centroids(centroids)
+
+    def is_stale(self, size=None):
+        """
+        True when the cells were trained for a very different gallery size: with the default
+        nlist, the trained cell count is off from sqrt(size) by more than a factor of 2.
+        """
+        if self.centroids is None or self.nlist:
+            return False
+        target = max(1, int(np.sqrt(len(self) if size is None else size)))
+        return not target / 2 <= len(self.centroids) <= target * 2
+
+    def set_centroids(self, centroids):
+        """Use pre-trained cells (e.g. loaded from disk). Existing vectors are redistributed."""
+        ids, stored = self._all()
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.clear()
+        if len(ids):
+            self._add_normalized(ids, stored)
+
+    def copy(self):
+        """
+        Copy for copy-on-write updates. Cell arrays are shared: add/remove/clear replace
+        them instead of writing into them, so changing the copy leaves this index intact.
+        """
+        clone = copy.copy(self)
+        clone._lists = [list(cell) for cell in self._lists]
+        clone._location = dict(self._location)
+        return clone
+
+    def clear(self):
+        """Remove all vectors but keep the trained cells."""
+        cells = len(self.centroids) if self.centroids is not None else 1
+        self._lists = [[np.empty((0, self.dim), dtype=np.float32), np.empty(0, dtype=np.int64)]
+                       for _ in range(cells)]
+        self._location = {}
+        self._flat = None
+
+    def _all(self):
+        if self._flat is None:
+            if self._lists:
+                vectors = np.vstack([cell[0] for cell in self._lists])
+                ids = np.concatenate([cell[1] for cell in self._lists])
+            else:
+                vectors = np.empty((0, self.dim), dtype=np.float32)
+                ids = np.empty(0, dtype=np.int64)
+            self._flat = (ids, vectors)
+        return self._flat
+
+    def add(self, ids, vectors):
+        """Add vectors with the given integer ids (ids must not already be present)."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        self._add_normalized(ids, normalize_rows(vectors))
+
+    def _add_normalized(self, ids, vectors):
+        if not self._lists:
+            # Untrained: a single cell
+            self._lists = [[np.empty((0, self.dim), dtype=np.float32), np.empty(0, dtype=np.int64)]]
+        if self.centroids is not None:
+            cells = np.argmax(vectors @ self.centroids.T, axis=1)
+        else:
+            cells = np.zeros(len(ids), dtype=np.int64)
+
+        for cell in np.unique(cells):
+            mask = cells == cell
+            entry = self._lists[cell]
+            entry[0] = np.vstack([entry[0], vectors[mask]])
+            entry[1] = np.concatenate([entry[1], ids[mask]])
+        self._location.update(zip(ids.tolist(), cells.tolist()))
+        self._flat = None
+
+    def remove(self, ids):
+        """Remove vectors by id. Unknown ids are ignored."""
+        by_cell = {}
+        for i in np.asarray(ids, dtype=np.int64).reshape(-1):
+            cell = self._location.pop(int(i), None)
+            if cell is not None:
+                by_cell.setdefault(cell, []).append(int(i))
+        for cell, cell_ids in by_cell.items():
+            entry = self._lists[cell]
+            keep = ~np.isin(entry[1], cell_ids)
+            entry[0] = entry[0][keep]
+            entry[1] = entry[1][keep]
+        if by_cell:
+            self._flat = None
+
+    def search(self, queries, k=10):
+        """
+        Top-k cosine search.
+        :return: (scores, ids), both (num_queries, k); missing results have id -1 and score -inf
+        """
+        queries = normalize_rows(queries)
+        scores_out = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids_out = np.full((len(queries), k), -1, dtype=np.int64)
+
+        if not self.is_trained or len(self) < self.exact_threshold:
+            ids, vectors = self._all()
+            if len(ids):
+                scores = queries @ vectors.T
+                for q in range(len(queries)):
+                    self._fill_top(scores[q], ids, k, scores_out[q], ids_out[q])
+            return scores_out, ids_out
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        cells = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        for q in range(len(queries)):
+            candidates = [self._lists[c] for c in cells[q] if len(self._lists[c][1])]
+            if not candidates: continue
+            vectors = np.vstack([c[0] for c in candidates])
+            ids = np.concatenate([c[1] for c in candidates])
+            self._fill_top(vectors @ queries[q], ids, k, scores_out[q], ids_out[q])
+        return scores_out, ids_out
+
+    @staticmethod
+    def _fill_top(scores, ids, k, scores_out, ids_out):
+        n = min(k, len(scores))
+        top = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        scores_out[:n] = scores[top]
+        ids_out[:n] = ids[top]
+
+    def save(self, path):
+        ids, vectors = self._all()
+        np.savez(path, dim=self.dim, nprobe=self.nprobe, exact_threshold=self.exact_threshold,
+                 nlist=self.nlist or 0,
+                 centroids=self.centroids if self.centroids is not None else np.empty((0, self.dim), np.float32),
+                 ids=ids, vectors=vectors)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        index = cls(dim=int(data["dim"]), nlist=int(data["nlist"]) or None,
+                    nprobe=int(data["nprobe"]), exact_threshold=int(data["exact_threshold"]))
+        if len(data["centroids"]):
+            index.set_centroids(data["centroids"])
+        if len(data["ids"]):
+            index._add_normalized(data["ids"].astype(np.int64), data["vectors"].astype(np.float32))
+        return index
+
+
+def synthetic_gallery(size, dim=128, identities=None, seed=0):
+    """Clustered random embeddings: a few noisy samples around each identity centre."""
+    rng = np.random.default_rng(seed)
+    identities = identities or max(1, size // 5)
+    centres = rng.normal(size=(identities, dim)).astype(np.float32)
+    labels = rng.integers(0, identities, size)
+    vectors = centres[labels] + 0.35 * rng.normal(size=(size, dim)).astype(np.float32)
+    return normalize_rows(vectors), labels, centres
+
+
+def run_benchmark(size, queries, k, nprobes, nlist=None, seed=0):
+    gallery, _, centres = synthetic_gallery(size, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    query_vectors = normalize_rows(centres[rng.integers(0, len(centres), queries)]
+                                   + 0.35 * rng.normal(size=(queries, gallery.shape[1])).astype(np.float32))
+
+    start = time.perf_counter()
+    exact_scores = query_vectors @ gallery.T
+    truth = np.argpartition(-exact_scores, k - 1, axis=1)[:, :k]
+    exact_time = time.perf_counter() - start
+    print(f"[*] Gallery {size}, {queries} queries, k={k}")
+    print(f"    exact scan: {queries / exact_time:10.1f} QPS")
+
+    index = IVFIndex(dim=gallery.shape[1], nlist=nlist, exact_threshold=0)
+    start = time.perf_counter()
+    index.train(gallery, seed=seed)
+    index.add(np.arange(size), gallery)
+    print(f"    IVF build ({len(index.centroids)} cells): {time.perf_counter() - start:.2f} s")
+
+    for nprobe in nprobes:
+        index.nprobe = nprobe
+        start = time.perf_counter()
+        _, ids = index.search(query_vectors, k)
+        elapsed = time.perf_counter() - start
+        recall = np.mean([len(set(ids[q]) & set(truth[q])) / k for q in range(queries)])
+        top1 = np.mean(ids[:, 0] == np.argmax(exact_scores, axis=1))
+        print(f"    IVF nprobe={nprobe:<4} {queries / elapsed:10.1f} QPS   recall@{k}={recall:.3f}   recall@1={top1:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF index recall@k / QPS against the exact cosine scan")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    args = parser.parse_args()
+    run_benchmark(args.size, args.queries, args.k, args.nprobe, args.nlist)
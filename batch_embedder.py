@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+from inference import create_net
+
+SFACE_INPUT_SIZE = (112, 112)
+FEATURE_DIM = 128
+
+
+class BatchEmbedder:
+    """
+    Batched SFace inference.
+    Runs the same ONNX model as FaceRecognizerSF through an OpenCV DNN net, with the
+    same preprocessing as FaceRecognizerSF.feature (blobFromImage, scale 1, no mean,
+    swapRB), but stacks many aligned crops into one input blob so a crowded frame
+    costs one forward pass instead of one per face.
+    """
+
+    def __init__(self, sface_path, recognizer, batch_size=16, profile=None):
+        """
+        :param sface_path: SFace ONNX model file
+        :param recognizer: FaceRecognizerSF used for alignCrop (and the reference feature check)
+        :param batch_size: Max crops per forward pass (1 = no batching)
+        :param profile: inference.InferenceProfile (OpenCV DNN backend / target or onnxruntime)
+        """
+        self.recognizer = recognizer
+        self.batch_size = max(1, int(batch_size))
+        self.profile = profile
+        self.net = create_net(sface_path, profile)
+        # None = not verified yet, False = model cannot run batches, use one crop per pass
+        self.batching_supported = None
+
+    def _forward(self, crops):
+        blob = cv2.dnn.blobFromImages(crops, 1.0, SFACE_INPUT_SIZE, (0, 0, 0), swapRB=True, crop=False)
+        self.net.setInput(blob)
+        return np.asarray(self.net.forward(), dtype=np.float32).reshape(len(crops), -1)
+
+    def _verify_batching(self, crops):
+        """One-time check that a batched pass matches FaceRecognizerSF.feature."""
+        try:
+            batched = self._forward(crops[:2])
+            reference = np.vstack([self.recognizer.feature(crop).reshape(1, -1) for crop in crops[:2]])
+            self.batching_supported = (batched.shape == reference.shape
+                                       and np.allclose(batched, reference, rtol=1e-4, atol=1e-4))
+        except Exception:
+            # cv2.error, or an onnxruntime error for a model with a fixed batch size of 1
+            self.batching_supported = False
+        if not self.batching_supported:
+            print("[!] SFace model does not support batched inference, falling back to one face per pass.")
+
+    def embed_crops(self, crops):
+        """SFace features of aligned 112x112 crops, shape (len(crops), 128)."""
+        if not len(crops):
+            return np.empty((0, FEATURE_DIM), dtype=np.float32)
+        if self.batching_supported is None and self.batch_size > 1 and len(crops) > 1:
+            self._verify_batching(crops)
+
+        step = self.batch_size if self.batching_supported else 1
+        features = [self._forward(crops[i:i + step]) for i in range(0, len(crops), step)]
+        return np.vstack(features)
+
+    def align(self, frame, faces):
+        return [self.recognizer.alignCrop(frame, face) for face in faces]
+
+    def embed_faces(self, frame, faces):
+        """Align every YuNet face of a frame and embed them together."""
+        if faces is None or not len(faces):
+            return np.empty((0, FEATURE_DIM), dtype=np.float32)
+        return self.embed_crops(self.align(frame, faces))
+
+    def embed_frames(self, frames, faces_per_frame):
+        """
+        Embed the faces of several queued frames in shared batches.
+        :return: list with one (num_faces, 128) array per frame
+        """
+        crops = []
+        counts = []
+        for frame, faces in zip(frames, faces_per_frame):
+            aligned = self.align(frame, faces) if faces is not None else []
+            crops.extend(aligned)
+            counts.append(len(aligned))
+
+        features = self.embed_crops(crops)
+        return np.split(features, np.cumsum(counts)[:-1]) if counts else []
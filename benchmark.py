@@ -0,0 +1,299 @@
+"""
+Offline benchmark suite for the recognition hot path.
+
+Times every stage separately and writes machine-readable JSON:
+    - match.loop        legacy per-pair FaceRecognizerSF.match loop (capped by --loop-max)
+    - match.vectorized  GalleryMatcher over synthetic galleries (10 .. 1M embeddings)
+    - match.float16 / match.int8   same, with the gallery stored as float16 / int8
+    - detect            YuNet at several frame resolutions
+    - align_crop, feature, feature.batched   SFace per face / per batch
+    - recognize_faces   end-to-end, several faces per frame
+    - process_image     gallery encoding of one image file
+    - startup.cold / startup.warm   FaceRecognitionSystem construction without / with embedding cache
+
+Stages that need models are skipped if they are missing. Face frames are generated by tiling
+face photos from --images. Without --images (or where YuNet finds no face in a tiled frame)
+alignment, embedding and recognition run on synthetic face positions in noise frames, which
+costs the same per face; those results carry "synthetic_faces": true and a warning is printed.
+
+Usage:
+    python benchmark.py run --out baseline.json --images known_faces
+    python benchmark.py run --out new.json --images known_faces
+    python benchmark.py compare baseline.json new.json --threshold 0.10
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from matching import GalleryMatcher
+from pipeline import image_dir_source
+
+GALLERY_SIZES = [10, 100, 1000, 10000, 100000, 1000000]
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+FACES_PER_FRAME = [1, 4, 8]
+
+
+def time_it(fn, repeat=20, warmup=2):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return {
+        "n": int(repeat),
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "min_ms": float(timings.min()),
+    }
+
+
+class BenchmarkRun:
+    def __init__(self):
+        self.results = []
+
+    def add(self, name, params, stats):
+        self.results.append({"name": name, "params": params, **stats})
+        param_text = " ".join(f"{k}={v}" for k, v in params.items())
+        print(f"    {name:<18} {param_text:<28} p50 {stats['p50_ms']:10.3f} ms   p95 {stats['p95_ms']:10.3f} ms")
+
+    def to_json(self, path):
+        payload = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": sys.version.split()[0],
+                "opencv": cv2.__version__,
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "results": self.results,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2)
+
+
+def synthetic_features(n, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def tiled_frame(face_img, size, count):
+    """Frame of the given (w, h) with `count` copies of a face photo on a grid."""
+    w, h = size
+    frame = np.full((h, w, 3), 90, dtype=np.uint8)
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / cols))
+    cell_w, cell_h = w // cols, h // rows
+    scale = min(cell_w / face_img.shape[1], cell_h / face_img.shape[0]) * 0.9
+    tile = cv2.resize(face_img, (max(1, int(face_img.shape[1] * scale)), max(1, int(face_img.shape[0] * scale))))
+    for i in range(count):
+        r, c = divmod(i, cols)
+        y, x = r * cell_h, c * cell_w
+        frame[y:y + tile.shape[0], x:x + tile.shape[1]] = tile
+    return frame
+
+
+# Five SFace reference landmarks (eyes, nose, mouth corners) in a 112x112 aligned crop
+REFERENCE_LANDMARKS = np.array([[38.29, 51.70], [73.53, 51.50], [56.03, 71.74], [41.55, 92.37], [70.73, 92.20]],
+                               dtype=np.float32)
+
+
+def synthetic_faces(size, count):
+    """YuNet rows (x, y, w, h, 5 landmarks, score) of `count` upright faces on the tiled_frame grid."""
+    w, h = size
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / cols))
+    cell_w, cell_h = w // cols, h // rows
+    side = 0.9 * min(cell_w, cell_h)
+    faces = np.zeros((count, 15), dtype=np.float32)
+    for i in range(count):
+        r, c = divmod(i, cols)
+        x, y = c * cell_w, r * cell_h
+        faces[i, :4] = (x, y, side, side)
+        faces[i, 4:14] = (REFERENCE_LANDMARKS * side / 112 + (x, y)).ravel()
+        faces[i, 14] = 1.0
+    return faces
+
+
+def bench_matching(run, sizes, faces, repeat, loop_max, recognizer=None):
+    print("[*] Matching")
+    queries = synthetic_features(faces, seed=1)
+    for size in sizes:
+        gallery = synthetic_features(size)
+        names = [f"person{i // 5}" for i in range(size)]
+        matcher = GalleryMatcher()
+        matcher.build(list(gallery), names)
+        reps = max(3, min(repeat, int(repeat * 1000 / max(size, 1000))))
+        run.add("match.vectorized", {"gallery": size, "faces": faces}, time_it(lambda: matcher.match(queries, 0.36), reps, 1))
+        for precision in ("float16", "int8"):
+            compact = GalleryMatcher(precision=precision)
+            compact.build(list(gallery), names)
+            run.add(f"match.{precision}", {"gallery": size, "faces": faces},
+                    time_it(lambda: compact.match(queries, 0.36), reps, 1))
+
+        if recognizer is not None and size <= loop_max:
+            rows = [g.reshape(1, -1) for g in gallery]
+            query_rows = [q.reshape(1, -1) for q in queries]
+
+            def legacy_loop():
+                for q in query_rows:
+                    for known in rows:
+                        recognizer.match(q, known, cv2.FaceRecognizerSF_FR_COSINE)
+            run.add("match.loop", {"gallery": size, "faces": faces}, time_it(legacy_loop, max(1, reps // 5), 0))
+
+
+def bench_models(run, system, face_images, repeat):
+    print("[*] Detection / embedding")
+    rng = np.random.default_rng(0)
+    synthetic = []
+    for size in RESOLUTIONS:
+        for count in FACES_PER_FRAME:
+            if face_images:
+                frame = tiled_frame(face_images[0], size, count)
+            else:
+                frame = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+            params = {"resolution": f"{size[0]}x{size[1]}", "faces": count}
+            run.add("detect", params, time_it(lambda: system.detect_faces(frame), repeat))
+            faces = system.detect_faces(frame)
+            params = dict(params)  # run.add keeps the dict of the detect result
+            if faces is None:
+                # Alignment and SFace cost the same per face on any pixels; timing them on
+                # made-up positions beats silently leaving the stages out of the results
+                faces = synthetic_faces(size, count)
+                params["synthetic_faces"] = True
+                synthetic.append(params["resolution"] + f" x{count}")
+            params["detected"] = len(faces)
+            run.add("align_crop", params, time_it(lambda: [system.recognizer.alignCrop(frame, f) for f in faces], repeat))
+            crops = [system.recognizer.alignCrop(frame, f) for f in faces]
+            run.add("feature", params, time_it(lambda: [system.recognizer.feature(c) for c in crops], repeat))
+            run.add("feature.batched", params, time_it(lambda: system.embedder.embed_crops(crops), repeat))
+            # Detection on the frame plus embedding and matching of the faces, as in recognize_faces
+            run.add("recognize_faces", params,
+                    time_it(lambda: (system.detect_faces(frame), system.recognize_detected(frame, faces)), repeat))
+    if synthetic:
+        print(f"[!] No face detected in {len(synthetic)} frames ({', '.join(synthetic)}): alignment, embedding and "
+              f"recognition were timed on synthetic face positions" + ("" if face_images else " (pass --images)"))
+
+
+def bench_gallery(run, images_dir, gallery_images, repeat):
+    """Per-image encoding and startup with a generated gallery folder."""
+    from main import FaceRecognitionSystem
+    print("[*] Gallery encoding / startup")
+    sources = sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(images_dir) for name in files
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    if not sources:
+        return
+    workdir = tempfile.mkdtemp(prefix="face_bench_")
+    try:
+        known = os.path.join(workdir, "known_faces")
+        for i in range(gallery_images):
+            person = os.path.join(known, f"person{i // 5}")
+            os.makedirs(person, exist_ok=True)
+            shutil.copy(sources[i % len(sources)], os.path.join(person, f"{i}{os.path.splitext(sources[i % len(sources)])[1]}"))
+
+        cache = os.path.join(workdir, "cache")
+        start = time.perf_counter()
+        system = FaceRecognitionSystem(known_faces_dir=known, cache_dir=cache, progress=None)
+        cold = (time.perf_counter() - start) * 1000
+        run.add("startup.cold", {"images": gallery_images}, {"n": 1, "mean_ms": cold, "p50_ms": cold, "p95_ms": cold, "min_ms": cold})
+        run.add("startup.warm", {"images": gallery_images},
+                time_it(lambda: FaceRecognitionSystem(known_faces_dir=known, cache_dir=cache, progress=None), 3, 0))
+        run.add("process_image", {}, time_it(lambda: system._process_image(sources[0]), repeat))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_suite(args):
+    run = BenchmarkRun()
+    system = None
+    empty = tempfile.mkdtemp(prefix="face_bench_empty_")
+    try:
+        from main import FaceRecognitionSystem
+        system = FaceRecognitionSystem(known_faces_dir=empty, cache_dir=None, progress=None)
+    except FileNotFoundError as e:
+        print(f"[!] {e} Model stages are skipped.")
+    finally:
+        shutil.rmtree(empty, ignore_errors=True)
+
+    sizes = [s for s in GALLERY_SIZES if s <= args.max_gallery]
+    bench_matching(run, sizes, args.faces, args.repeat, args.loop_max, system.recognizer if system else None)
+
+    if system is not None:
+        face_image = next(iter(image_dir_source(args.images)), None) if args.images else None
+        bench_models(run, system, [face_image] if face_image is not None else [], args.repeat)
+        if args.images:
+            bench_gallery(run, args.images, args.gallery_images, args.repeat)
+
+    run.to_json(args.out)
+    print(f"[*] Results written to {args.out}")
+
+
+def compare_runs(base_path, new_path, threshold=0.10, metric="p50_ms", min_delta_ms=0.05):
+    """
+    Print per-benchmark changes; returns the list of regressions
+    (slower by more than threshold and by more than min_delta_ms, to ignore timer noise).
+    """
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    def key(result):
+        return result["name"], json.dumps(result["params"], sort_keys=True)
+
+    base_results = {key(r): r for r in base["results"]}
+    regressions = []
+    print(f"{'benchmark':<18} {'params':<40} {'base':>10} {'new':>10} {'change':>8}")
+    for result in new["results"]:
+        old = base_results.get(key(result))
+        if old is None or not old[metric]:
+            continue
+        change = result[metric] / old[metric] - 1.0
+        flag = ""
+        if change > threshold and result[metric] - old[metric] > min_delta_ms:
+            flag = "  REGRESSION"
+            regressions.append((result["name"], result["params"], change))
+        params = " ".join(f"{k}={v}" for k, v in result["params"].items())
+        print(f"{result['name']:<18} {params:<40} {old[metric]:10.3f} {result[metric]:10.3f} {change:+8.1%}{flag}")
+    print(f"[*] {len(regressions)} regression(s) above {threshold:.0%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognition hot path benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run the benchmark suite")
+    run_parser.add_argument("--out", default="benchmark.json")
+    run_parser.add_argument("--images", help="Folder with face photos for detection / gallery benchmarks")
+    run_parser.add_argument("--repeat", type=int, default=20)
+    run_parser.add_argument("--faces", type=int, default=4, help="Query faces per match call")
+    run_parser.add_argument("--max-gallery", type=int, default=1000000)
+    run_parser.add_argument("--loop-max", type=int, default=10000, help="Largest gallery for the legacy match loop")
+    run_parser.add_argument("--gallery-images", type=int, default=200, help="Images in the generated startup gallery")
+
+    compare_parser = sub.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown flagged as regression")
+    compare_parser.add_argument("--metric", default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "min_ms"])
+    compare_parser.add_argument("--min-delta-ms", type=float, default=0.05, help="Ignore smaller absolute slowdowns")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_suite(args)
+    else:
+        sys.exit(1 if compare_runs(args.base, args.new, args.threshold, args.metric, args.min_delta_ms) else 0)
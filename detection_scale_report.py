@@ -0,0 +1,116 @@
+"""
+Latency / recall report for YuNet at several detection scales.
+Full-resolution detections are used as the reference; a face counts as recalled at a
+given scale if a rescaled detection overlaps it with IoU >= --iou.
+
+Usage:
+    python detection_scale_report.py --images known_faces --scales 320 480 640 960
+    python detection_scale_report.py --video entrance.mp4 --max-frames 300
+"""
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+from face_models import FaceDetector, create_detector, model_paths
+from tracking import box_iou
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def iter_images(path):
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                img = cv2.imread(os.path.join(root, name))
+                if img is not None:
+                    yield img
+
+
+def iter_video(path, max_frames, stride):
+    cap = cv2.VideoCapture(path)
+    index = 0
+    count = 0
+    while count < max_frames:
+        ret, frame = cap.read()
+        if not ret: break
+        if index % stride == 0:
+            count += 1
+            yield frame
+        index += 1
+    cap.release()
+
+
+def count_recalled(reference, faces, iou_threshold):
+    if reference is None or faces is None:
+        return 0
+    used = set()
+    recalled = 0
+    for ref in reference:
+        best, best_j = 0.0, -1
+        for j, face in enumerate(faces):
+            if j in used: continue
+            iou = box_iou(ref[:4], face[:4])
+            if iou > best:
+                best, best_j = iou, j
+        if best >= iou_threshold:
+            used.add(best_j)
+            recalled += 1
+    return recalled
+
+
+def timed_detect(detector, frame, scaled=True):
+    start = time.perf_counter()
+    faces = detector.detect(frame, scaled=scaled)
+    return faces, (time.perf_counter() - start) * 1000
+
+
+def run_report(frames, scales, iou_threshold=0.5, models_dir="models"):
+    yunet_path, _ = model_paths(models_dir)
+    reference_detector = FaceDetector(create_detector(yunet_path))
+    scaled_detectors = {scale: FaceDetector(create_detector(yunet_path), max_side=scale) for scale in scales}
+
+    rows = {"full": {"latency": [], "recalled": 0}}
+    rows.update({scale: {"latency": [], "recalled": 0} for scale in scales})
+    total_faces = 0
+
+    for frame in frames:
+        reference, ms = timed_detect(reference_detector, frame, scaled=False)
+        rows["full"]["latency"].append(ms)
+        n_ref = 0 if reference is None else len(reference)
+        total_faces += n_ref
+        rows["full"]["recalled"] += n_ref
+
+        for scale, detector in scaled_detectors.items():
+            faces, ms = timed_detect(detector, frame)
+            rows[scale]["latency"].append(ms)
+            rows[scale]["recalled"] += count_recalled(reference, faces, iou_threshold)
+
+    print(f"[*] Frames: {len(rows['full']['latency'])}, reference faces: {total_faces}")
+    print(f"{'max side':>10} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'recall':>8}")
+    for key, row in rows.items():
+        if not row["latency"]: continue
+        latency = np.array(row["latency"])
+        recall = row["recalled"] / total_faces if total_faces else float("nan")
+        print(f"{str(key):>10} {latency.mean():9.2f} {np.percentile(latency, 50):8.2f} "
+              f"{np.percentile(latency, 95):8.2f} {recall:8.3f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="YuNet latency / recall at several detection scales")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="Folder of images (searched recursively)")
+    source.add_argument("--video", help="Video file")
+    parser.add_argument("--scales", type=int, nargs="+", default=[320, 480, 640, 960], help="Max side values to test")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU needed to count a face as recalled")
+    parser.add_argument("--max-frames", type=int, default=200)
+    parser.add_argument("--stride", type=int, default=5, help="Use every n-th video frame")
+    parser.add_argument("--models-dir", default="models")
+    args = parser.parse_args()
+
+    if args.images:
+        frames = iter_images(args.images)
+    else:
+        frames = iter_video(args.video, args.max_frames, args.stride)
+    run_report(frames, args.scales, args.iou, args.models_dir)
@@ -0,0 +1,348 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+INDEX_VERSION = 2
+NO_FACE = -1  # Row value for images where no face was detected
+COMPACT_DEAD_RATIO = 0.5  # Rewrite the matrix once this share of its rows is no longer referenced
+COMPACT_MIN_DEAD = 1024   # ... and at least this many rows are dead
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Persistent on-disk cache of gallery embeddings.
+    - embeddings-<generation>.f32 : raw (rows, dim) float32 matrix, opened memory-mapped;
+      new embeddings are appended to it
+    - index.json : image path -> (size, mtime_ns, row), the model hash and the generation,
+      as of the last compaction
+    - journal-<generation>.jsonl : entry changes since then, one JSON line each
+    A save only appends the new rows and journal lines, so an enroll or delete costs the
+    change, not the gallery. compact() rewrites matrix + index without dead rows; save() does
+    that by itself once enough rows are dead.
+    An entry is valid only if the image size/mtime and the model files hash are unchanged,
+    so only new or modified images have to go through YuNet + SFace again.
+    """
+
+    def __init__(self, cache_dir, root_dir, model_paths, dim=128, read_only=False):
+        """
+        :param cache_dir: Folder for the embeddings matrix and index.json
+        :param root_dir: Gallery folder, cached paths are stored relative to it
+        :param model_paths: Model files whose content hash invalidates the cache
+        :param read_only: Never write the cache (another process owns it); new embeddings stay in memory
+        """
+        self.cache_dir = cache_dir
+        self.root_dir = root_dir
+        self.model_paths = list(model_paths)
+        self.dim = dim
+        self.read_only = read_only
+        self.index_path = os.path.join(cache_dir, "index.json")
+
+        self.model_hash = None
+        self._model_stats = {}
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._entries = {}   # rel path -> {"size", "mtime_ns", "row"}
+        self._pending = {}   # rel path -> (size, mtime_ns, feature or None), not yet saved
+        self._changed = set()  # rel paths whose entry was removed / moved since the last save
+        self._generation = 0
+        self._journal_lines = 0
+        self._journal_size = 0
+        self._dead_rows = 0  # matrix rows no entry refers to any more
+        self._compact_needed = False  # files missing or invalid: the next save writes them all
+        self._dirty = False
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.root_dir)).replace(os.sep, "/")
+
+    def _matrix_path(self, generation):
+        return os.path.join(self.cache_dir, f"embeddings-{generation}.f32")
+
+    def _journal_path(self, generation):
+        return os.path.join(self.cache_dir, f"journal-{generation}.jsonl")
+
+    def _map_matrix(self, path):
+        """Memory-map the complete rows of a matrix file (a torn last row is ignored)."""
+        rows = os.path.getsize(path) // (4 * self.dim)
+        if not rows:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    def _compute_model_hash(self, cached_stats):
+        """Hash of all model files. Re-hashing is skipped while a file's size/mtime are unchanged."""
+        h = hashlib.sha256()
+        stats = {}
+        for path in self.model_paths:
+            st = os.stat(path)
+            name = os.path.basename(path)
+            cached = cached_stats.get(name)
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                digest = cached[2]
+            else:
+                digest = file_sha256(path)
+            stats[name] = [st.st_size, st.st_mtime_ns, digest]
+            h.update(digest.encode())
+        return h.hexdigest(), stats
+
+    def load(self):
+        """Load the index, replay the journal and memory-map the matrix. Returns the number of cached entries."""
+        index = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[!] Ignoring unreadable embedding cache: {e}")
+                index = {}
+
+        self.model_hash, self._model_stats = self._compute_model_hash(index.get("models", {}))
+        self._entries = {}
+        self._pending = {}
+        self._changed = set()
+        self._matrix = np.empty((0, self.dim), dtype=np.float32)
+        self._generation = index.get("generation", 0)
+        self._journal_lines = 0
+        self._journal_size = 0  # bytes of whole journal lines, a torn tail is overwritten
+        self._dead_rows = 0
+        self._compact_needed = True
+        self._dirty = False
+
+        valid = (index.get("version") == INDEX_VERSION
+                 and index.get("dim") == self.dim
+                 and index.get("model_hash") == self.model_hash)
+        if not valid:
+            self._dirty = bool(index)
+            return 0
+
+        try:
+            self._matrix = self._map_matrix(self._matrix_path(self._generation))
+        except (OSError, ValueError) as e:
+            print(f"[!] Ignoring unreadable embedding cache: {e}")
+            self._dirty = True
+            return 0
+        entries = index.get("entries", {})
+        journal_path = self._journal_path(self._generation)
+        if os.path.exists(journal_path):
+            with open(journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("incomplete line")
+                        change = json.loads(line)
+                    except ValueError:
+                        break  # torn last line of an interrupted save
+                    self._journal_lines += 1
+                    self._journal_size += len(line)
+                    if change["entry"] is None:
+                        entries.pop(change["key"], None)
+                    else:
+                        entries[change["key"]] = change["entry"]
+        rows = len(self._matrix)
+        self._entries = {k: v for k, v in entries.items() if v["row"] < rows}
+        self._dead_rows = rows - sum(1 for e in self._entries.values() if e["row"] != NO_FACE)
+        self._compact_needed = False
+        return len(self._entries)
+
+    def get(self, path, st=None):
+        """
+        Look up a cached embedding.
+        :return: (hit, feature). feature is a (1, dim) array, or None if the image had no face.
+        """
+        st = st or os.stat(path)
+        key = self._key(path)
+        pending = self._pending.get(key)
+        if pending is not None and pending[0] == st.st_size and pending[1] == st.st_mtime_ns:
+            return True, pending[2]
+
+        entry = self._entries.get(key)
+        if entry is None or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            return False, None
+        if entry["row"] == NO_FACE:
+            return True, None
+        row = entry["row"]
+        return True, np.array(self._matrix[row:row + 1], dtype=np.float32)
+
+    def rows(self, paths):
+        """
+        (memory-mapped matrix, row per path) of the saved embeddings of these images, so callers
+        can read float32 rows back on demand instead of keeping a copy; None when any of them
+        is not in the saved matrix (pending, no face or unknown).
+        """
+        ids = np.empty(len(paths), dtype=np.int64)
+        for i, path in enumerate(paths):
+            key = self._key(path)
+            entry = self._entries.get(key)
+            if key in self._pending or entry is None or entry["row"] == NO_FACE:
+                return None
+            ids[i] = entry["row"]
+        return self._matrix, ids
+
+    def put(self, path, feature, st=None):
+        """Record the embedding (or None for 'no face') of an image file."""
+        st = st or os.stat(path)
+        if feature is not None:
+            feature = np.asarray(feature, dtype=np.float32).reshape(1, self.dim)
+        self._pending[self._key(path)] = (st.st_size, st.st_mtime_ns, feature)
+        self._dirty = True
+
+    def prune(self, valid_paths):
+        """Forget entries for images that are no longer in the gallery."""
+        keep = {self._key(p) for p in valid_paths}
+        for store in (self._entries, self._pending):
+            for key in [k for k in store if k not in keep]:
+                self._forget(store, key)
+
+    def _forget(self, store, key):
+        entry = store.pop(key)
+        if store is self._entries and entry["row"] != NO_FACE:
+            self._dead_rows += 1
+        self._changed.add(key)
+        self._dirty = True
+
+    def _matching_keys(self, store, path):
+        """Keys of an image path, or of every image below a folder path."""
+        key = self._key(path)
+        return [k for k in store if k == key or k.startswith(key + "/")]
+
+    def remove(self, paths):
+        """Forget entries for the given image files or folders."""
+        for path in paths:
+            for store in (self._entries, self._pending):
+                for key in self._matching_keys(store, path):
+                    self._forget(store, key)
+
+    def move(self, old_path, new_path):
+        """Re-key entries after an image or folder was renamed (size and mtime survive a rename)."""
+        old_key, new_key = self._key(old_path), self._key(new_path)
+        for store in (self._entries, self._pending):
+            for key in self._matching_keys(store, old_path):
+                moved = new_key + key[len(old_key):]
+                if moved in store:
+                    self._forget(store, moved)
+                store[moved] = store.pop(key)
+                self._changed.update((key, moved))
+                self._dirty = True
+
+    def save(self):
+        """
+        Append new embeddings to the matrix and the entry changes to the journal, if anything
+        changed. Rows go first, so a crash in between only leaves unreferenced rows behind.
+        Compacts instead when the files have to be (re)written or too many rows are dead.
+        """
+        if not self._dirty or self.read_only:
+            return
+        if self._compact_needed:
+            self.compact()
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        matrix_path = self._matrix_path(self._generation)
+        first_row = len(self._matrix)
+        new_rows = []
+        changes = {key: self._entries.get(key) for key in self._changed if key not in self._pending}
+        for key, (size, mtime_ns, feature) in self._pending.items():
+            row = NO_FACE
+            if feature is not None:
+                row = first_row + len(new_rows)
+                new_rows.append(feature[0])
+            replaced = self._entries.get(key)
+            if replaced is not None and replaced["row"] != NO_FACE:
+                self._dead_rows += 1
+            changes[key] = self._entries[key] = {"size": size, "mtime_ns": mtime_ns, "row": row}
+        if new_rows:
+            with open(matrix_path, "ab") as f:
+                # Start at a whole row even if an interrupted save left a partial one
+                f.truncate(first_row * 4 * self.dim)
+                np.asarray(new_rows, dtype=np.float32).tofile(f)
+            self._matrix = self._map_matrix(matrix_path)
+        if changes:
+            lines = "".join(json.dumps({"key": key, "entry": entry}) + "\n" for key, entry in changes.items())
+            data = lines.encode("utf-8")
+            with open(self._journal_path(self._generation), "ab") as f:
+                f.truncate(self._journal_size)
+                f.write(data)
+            self._journal_lines += len(changes)
+            self._journal_size += len(data)
+
+        self._pending = {}
+        self._changed = set()
+        self._dirty = False
+        dead = self._dead_rows
+        if dead >= COMPACT_MIN_DEAD and dead > COMPACT_DEAD_RATIO * len(self._matrix):
+            self.compact()
+
+    def compact(self):
+        """
+        Write a new generation: a matrix of the live rows only and an index.json with every
+        entry (empty journal). index.json is replaced atomically after the matrix is written,
+        so a crash never pairs an index with the wrong matrix. Nothing to do without changes.
+        """
+        if self.read_only or not (self._dirty or self._journal_lines or self._compact_needed):
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        rows = []
+        entries = {}
+        for key, entry in self._entries.items():
+            if key in self._pending:
+                continue
+            if entry["row"] == NO_FACE:
+                entries[key] = dict(entry)
+            else:
+                entries[key] = {"size": entry["size"], "mtime_ns": entry["mtime_ns"], "row": len(rows)}
+                rows.append(np.asarray(self._matrix[entry["row"]], dtype=np.float32))
+        for key, (size, mtime_ns, feature) in self._pending.items():
+            if feature is None:
+                entries[key] = {"size": size, "mtime_ns": mtime_ns, "row": NO_FACE}
+            else:
+                entries[key] = {"size": size, "mtime_ns": mtime_ns, "row": len(rows)}
+                rows.append(feature[0])
+        matrix = np.vstack(rows).astype(np.float32) if rows else np.empty((0, self.dim), dtype=np.float32)
+
+        old_files = [self._matrix_path(self._generation), self._journal_path(self._generation),
+                     os.path.join(self.cache_dir, f"embeddings-{self._generation}.npy")]  # version 1 cache
+        self._generation += 1
+        matrix_path = self._matrix_path(self._generation)
+        matrix.tofile(matrix_path)
+        if os.path.exists(self._journal_path(self._generation)):
+            os.remove(self._journal_path(self._generation))  # left over from an unreadable index
+
+        index = {
+            "version": INDEX_VERSION,
+            "generation": self._generation,
+            "dim": self.dim,
+            "model_hash": self.model_hash,
+            "models": self._model_stats,
+            "entries": entries,
+        }
+        tmp_index = self.index_path + ".tmp"
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_index, self.index_path)
+
+        # Release the memory map before removing the old matrix (required on Windows); the rows
+        # are served from the new file's memory map rather than kept in RAM
+        self._matrix = self._map_matrix(matrix_path)
+        del matrix
+        for path in old_files:
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        self._entries = entries
+        self._pending = {}
+        self._changed = set()
+        self._journal_lines = 0
+        self._journal_size = 0
+        self._dead_rows = 0
+        self._compact_needed = False
+        self._dirty = False
@@ -0,0 +1,304 @@
+"""
+Bulk enrollment from folders or archives of photos.
+
+Every photo is scored in parallel worker processes: YuNet detection score, face size,
+sharpness (Laplacian variance of the aligned crop) and frontal pose from the five
+landmarks. Low-quality faces are rejected. The remaining faces are taken best first and
+dropped when they are nearly identical to an embedding already stored for that person.
+Only the 112x112 aligned crops are written to known_faces/<name>/.
+
+Input layout: <folder or archive>/<person>/<photos>, or any photos with --name.
+Archives: .zip, .tar, .tar.gz, .tgz
+
+Usage:
+    python enroll.py photos/ --workers 8
+    python enroll.py alice_shots.zip --name alice --dry-run
+"""
+import argparse
+import math
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import cv2
+import numpy as np
+from face_models import ALIGNED_CROP_SUFFIX
+from main import IMAGE_EXTENSIONS
+from matching import normalize_rows
+import parallel_ingest
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+# Default quality gates
+MIN_SCORE = 0.92        # YuNet detection score
+MIN_FACE_SIZE = 80      # pixels, shorter side of the face box
+MIN_SHARPNESS = 60.0    # Laplacian variance of the grayscale aligned crop
+MAX_YAW = 0.25          # nose offset from the eye midpoint, relative to the eye distance
+MAX_ROLL = 20.0         # degrees between the eyes
+MAX_PITCH = 0.25        # deviation of the nose position between eyes and mouth from 0.5
+DUPLICATE_THRESHOLD = 0.92  # cosine; more similar embeddings of the same person are pruned
+
+def face_quality(face, crop):
+    """
+    Quality measures of one YuNet face.
+    :param face: YuNet row (x, y, w, h, 5 landmarks, score)
+    :param crop: Aligned 112x112 crop of the face
+    """
+    right_eye, left_eye, nose = face[4:6], face[6:8], face[8:10]
+    mouth = (face[10:12] + face[12:14]) / 2
+    eye_mid = (right_eye + left_eye) / 2
+    eye_dist = max(float(np.linalg.norm(left_eye - right_eye)), 1e-6)
+    dx, dy = abs(left_eye[0] - right_eye[0]), abs(left_eye[1] - right_eye[1])
+    mouth_drop = mouth[1] - eye_mid[1]
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return {
+        "score": float(face[14]),
+        "size": float(min(face[2], face[3])),
+        "sharpness": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "yaw": float(abs(nose[0] - eye_mid[0]) / eye_dist),
+        "roll": float(math.degrees(math.atan2(dy, dx))),
+        "pitch": float(abs((nose[1] - eye_mid[1]) / mouth_drop - 0.5)) if mouth_drop > 0 else 1.0,
+    }
+
+
+def rejection_reason(quality, min_score=MIN_SCORE, min_size=MIN_FACE_SIZE, min_sharpness=MIN_SHARPNESS,
+                     max_yaw=MAX_YAW, max_roll=MAX_ROLL, max_pitch=MAX_PITCH):
+    """First failed quality gate ("score", "size", "blur", "pose") or None."""
+    if quality["score"] < min_score:
+        return "score"
+    if quality["size"] < min_size:
+        return "size"
+    if quality["sharpness"] < min_sharpness:
+        return "blur"
+    if quality["yaw"] > max_yaw or quality["roll"] > max_roll or quality["pitch"] > max_pitch:
+        return "pose"
+    return None
+
+
+def quality_rank(quality):
+    """Higher is better; used to keep the best photo of a group of near-duplicates."""
+    return quality["score"] * math.log1p(quality["sharpness"]) * (1.0 - quality["yaw"])
+
+
+def _assess_file(task):
+    """
+    Worker task: (image_path, name) -> dict with quality, crop and feature (or a rejection reason).
+    Runs on the models of parallel_ingest's pool initializer. A failing file is rejected as
+    "error" instead of aborting the whole run.
+    """
+    image_path, name = task
+    result = {"path": image_path, "name": name, "bytes": 0}
+    try:
+        result["bytes"] = os.path.getsize(image_path)
+        img = cv2.imread(image_path)
+        if img is None:
+            result["rejected"] = "unreadable"
+            return result
+        faces = parallel_ingest._detector.detect(img, scaled=False)
+        if faces is None:
+            result["rejected"] = "no_face"
+            return result
+
+        # The largest face is the person being enrolled
+        face = faces[np.argmax(faces[:, 2] * faces[:, 3])]
+        crop = parallel_ingest._recognizer.alignCrop(img, face)
+        result["quality"] = face_quality(face, crop)
+        result["crop"] = crop
+        result["feature"] = parallel_ingest._recognizer.feature(crop)
+    except Exception as e:
+        print(f"[!] Error assessing {image_path}: {e}")
+        result = {"path": image_path, "name": name, "bytes": result["bytes"], "rejected": "error"}
+    return result
+
+
+def collect_photos(inputs, name=None, workdir=None):
+    """
+    Return (image_path, person_name) pairs from folders and archives.
+    Archives are extracted into workdir. Without name, photos must sit in <root>/<person>/.
+    """
+    photos = []
+    skipped = 0
+    for i, source in enumerate(inputs):
+        root = source
+        if os.path.isfile(source) and source.lower().endswith(ARCHIVE_EXTENSIONS):
+            root = os.path.join(workdir, f"archive_{i}")
+            os.makedirs(root)
+            if source.lower().endswith(".zip"):
+                with zipfile.ZipFile(source) as archive:
+                    archive.extractall(root)
+            else:
+                with tarfile.open(source) as archive:
+                    if hasattr(tarfile, "data_filter"):
+                        archive.extractall(root, filter="data")
+                    else:
+                        archive.extractall(root)
+        elif os.path.isfile(source):
+            if name:
+                photos.append((source, name))
+            continue
+
+        for dirpath, _, files in sorted(os.walk(root)):
+            rel = os.path.relpath(dirpath, root)
+            person = name or (rel.split(os.sep)[0] if rel != "." else None)
+            for file_name in sorted(files):
+                if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if person is None:
+                    skipped += 1
+                else:
+                    photos.append((os.path.join(dirpath, file_name), person))
+    if skipped:
+        print(f"[!] Skipped {skipped} photos outside a person folder (use --name)")
+    return photos
+
+
+def select_faces(results, existing, duplicate_threshold=DUPLICATE_THRESHOLD, **gates):
+    """
+    Apply the quality gates, then keep faces best first unless they are near-duplicates of an
+    embedding already kept or stored for the same person.
+    :param existing: dict name -> list of stored (1, 128) features
+    :return: (accepted results, Counter of rejection reasons)
+    """
+    reasons = Counter()
+    candidates = []
+    for result in results:
+        reason = result.get("rejected") or rejection_reason(result["quality"], **gates)
+        if reason:
+            reasons[reason] += 1
+        else:
+            candidates.append(result)
+
+    kept = {name: list(features) for name, features in existing.items()}
+    accepted = []
+    for result in sorted(candidates, key=lambda r: -quality_rank(r["quality"])):
+        stored = kept.setdefault(result["name"], [])
+        if stored:
+            similarity = normalize_rows(np.vstack(stored)) @ normalize_rows(result["feature"])[0]
+            if float(similarity.max()) > duplicate_threshold:
+                reasons["duplicate"] += 1
+                continue
+        stored.append(result["feature"])
+        accepted.append(result)
+    return accepted, reasons
+
+
+def claim_path(person_dir, stem):
+    """
+    Create an empty aligned crop file named after stem that did not exist yet (a numbered suffix
+    is added when needed), so runs within the same second never overwrite each other's crops.
+    """
+    for n in range(1000):
+        path = os.path.join(person_dir, f"{stem}_{n}{ALIGNED_CROP_SUFFIX}" if n else f"{stem}{ALIGNED_CROP_SUFFIX}")
+        try:
+            with open(path, "xb"):
+                return path
+        except FileExistsError:
+            continue
+    raise FileExistsError(f"No free file name for '{stem}' in '{person_dir}'")
+
+
+def enroll(system, inputs, name=None, workers=None, dry_run=False, duplicate_threshold=DUPLICATE_THRESHOLD,
+           **gates):
+    """
+    Bulk-enroll photos into system.known_faces_dir and its gallery. Returns a summary dict.
+    :param gates: Overrides of the quality gates (see rejection_reason)
+    """
+    workdir = tempfile.mkdtemp(prefix="face_enroll_")
+    try:
+        photos = collect_photos(inputs, name, workdir)
+        if not photos:
+            print("[!] No photos found.")
+            return {}
+        workers = max(1, min(workers or parallel_ingest.default_workers(), len(photos)))
+        print(f"[*] Scoring {len(photos)} photos with {workers} worker processes...")
+
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=parallel_ingest._init_worker,
+                                 initargs=(system.yunet_path, system.sface_path)) as pool:
+            for done, result in enumerate(pool.map(_assess_file, photos, chunksize=4), 1):
+                results.append(result)
+                parallel_ingest.print_progress(done, len(photos))
+
+        person_dirs = {}
+        for result in results:
+            person = result["name"]
+            if person not in person_dirs:
+                try:
+                    person_dirs[person] = system._person_dir(person)
+                except ValueError as e:
+                    print(f"[!] Skipping photos of '{person}': {e}")
+                    person_dirs[person] = None
+            if person_dirs[person] is None:
+                result["rejected"] = "invalid_name"
+
+        existing = {}
+        for feature, person in zip(system.known_encodings, system.known_names):
+            existing.setdefault(person, []).append(feature)
+        accepted, reasons = select_faces(results, existing, duplicate_threshold, **gates)
+
+        stored_paths = []
+        if not dry_run:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            for i, result in enumerate(accepted):
+                person_dir = person_dirs[result["name"]]
+                os.makedirs(person_dir, exist_ok=True)
+                path = claim_path(person_dir, f"{result['name']}_{timestamp}_{i:04d}")
+                cv2.imwrite(path, result["crop"])
+                stored_paths.append(path)
+            system.add_images(stored_paths)
+
+        summary = {
+            "photos": len(photos),
+            "input_bytes": sum(r["bytes"] for r in results),
+            "accepted": len(accepted),
+            "stored_bytes": sum(os.path.getsize(p) for p in stored_paths),
+            "rejected": dict(reasons),
+            "identities": len({r["name"] for r in accepted}),
+        }
+        print_summary(summary, dry_run)
+        return summary
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_summary(summary, dry_run=False):
+    photos, accepted = summary["photos"], summary["accepted"]
+    reduction = 1.0 - accepted / photos if photos else 0.0
+    print(f"[*] {photos} photos -> {accepted} faces for {summary['identities']} people "
+          f"({reduction:.0%} fewer gallery embeddings)")
+    if summary["rejected"]:
+        print("    rejected: " + ", ".join(f"{k} {v}" for k, v in sorted(summary["rejected"].items())))
+    if dry_run:
+        print("    dry run, nothing was stored")
+    else:
+        input_mb, stored_mb = summary["input_bytes"] / 1e6, summary["stored_bytes"] / 1e6
+        saved = 1.0 - stored_mb / input_mb if input_mb else 0.0
+        print(f"    storage: {input_mb:.2f} MB of photos -> {stored_mb:.2f} MB of aligned crops ({saved:.0%} smaller)")
+
+
+if __name__ == "__main__":
+    from main import FaceRecognitionSystem
+
+    parser = argparse.ArgumentParser(description="Bulk enrollment with quality gating and duplicate pruning")
+    parser.add_argument("inputs", nargs="+", help="Folders (<person>/<photos>) or archives")
+    parser.add_argument("--name", help="Enroll every photo as this person")
+    parser.add_argument("--known-faces", default="known_faces")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="Score and prune only, store nothing")
+    parser.add_argument("--duplicate-threshold", type=float, default=DUPLICATE_THRESHOLD)
+    parser.add_argument("--min-score", type=float, default=MIN_SCORE)
+    parser.add_argument("--min-size", type=float, default=MIN_FACE_SIZE)
+    parser.add_argument("--min-sharpness", type=float, default=MIN_SHARPNESS)
+    parser.add_argument("--max-yaw", type=float, default=MAX_YAW)
+    parser.add_argument("--max-roll", type=float, default=MAX_ROLL)
+    parser.add_argument("--max-pitch", type=float, default=MAX_PITCH)
+    args = parser.parse_args()
+
+    system = FaceRecognitionSystem(known_faces_dir=args.known_faces)
+    enroll(system, args.inputs, args.name, args.workers, args.dry_run, args.duplicate_threshold,
+           min_score=args.min_score, min_size=args.min_size, min_sharpness=args.min_sharpness,
+           max_yaw=args.max_yaw, max_roll=args.max_roll, max_pitch=args.max_pitch)
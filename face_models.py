@@ -0,0 +1,127 @@
+import cv2
+import os
+from inference import dnn_ids
+
+YUNET_FILE = "face_detection_yunet_2023mar.onnx"
+SFACE_FILE = "face_recognition_sface_2021dec.onnx"
+ALIGNED_CROP_SIZE = 112  # SFace input, output of FaceRecognizerSF.alignCrop
+ALIGNED_CROP_SUFFIX = ".aligned.png"  # File name ending of the aligned crops written by enroll.py
+
+
+def model_paths(models_dir="models"):
+    """Return (yunet_path, sface_path) inside models_dir (relative to this project)."""
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    yunet_path = os.path.join(base_path, models_dir, YUNET_FILE)
+    sface_path = os.path.join(base_path, models_dir, SFACE_FILE)
+
+    if not os.path.exists(yunet_path) or not os.path.exists(sface_path):
+        raise FileNotFoundError("Model files not found. Please run download_models.py first.")
+    return yunet_path, sface_path
+
+
+def create_detector(yunet_path, profile=None):
+    """YuNet Face Detector (profile: inference.InferenceProfile for the DNN backend / target)"""
+    backend_id, target_id = dnn_ids(profile)
+    return cv2.FaceDetectorYN.create(
+        model=yunet_path,
+        config="",
+        input_size=(320, 320),
+        score_threshold=0.9,
+        nms_threshold=0.3,
+        top_k=5000,
+        backend_id=backend_id,
+        target_id=target_id
+    )
+
+
+def create_recognizer(sface_path, profile=None):
+    """SFace Face Recognizer (profile: inference.InferenceProfile for the DNN backend / target)"""
+    backend_id, target_id = dnn_ids(profile)
+    return cv2.FaceRecognizerSF.create(
+        model=sface_path,
+        config="",
+        backend_id=backend_id,
+        target_id=target_id
+    )
+
+
+def detection_size(width, height, max_side=None, input_size=None):
+    """Size (w, h) YuNet should run at for a frame of width x height."""
+    if input_size:
+        return tuple(int(v) for v in input_size)
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    return width, height
+
+
+class FaceDetector:
+    """
+    YuNet wrapper used for every detection.
+    - Optional downscaling: a fixed max side or a fixed input size, resized once per frame
+    - setInputSize is only called when the detection size actually changes
+    - Boxes and landmarks are mapped back to full-resolution coordinates,
+      so alignCrop can still run on the original image
+    """
+
+    def __init__(self, detector, max_side=None, input_size=None):
+        """
+        :param detector: cv2.FaceDetectorYN
+        :param max_side: Downscale frames so their longest side is at most this many pixels
+        :param input_size: Fixed (w, h) detection size (takes precedence over max_side)
+        """
+        self.detector = detector
+        self.max_side = max_side
+        self.input_size = input_size
+        self._current_size = None
+
+    def _set_input_size(self, size):
+        if size != self._current_size:
+            self.detector.setInputSize(size)
+            self._current_size = size
+
+    def detect(self, img, scaled=True):
+        """
+        Run YuNet and return the (N, 15) face array in img coordinates, or None.
+        :param scaled: Apply the configured detection scale (False = full resolution)
+        """
+        height, width = img.shape[:2]
+        if scaled:
+            size = detection_size(width, height, self.max_side, self.input_size)
+        else:
+            size = (width, height)
+
+        small = img
+        if size != (width, height):
+            small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        self._set_input_size(size)
+        _, faces = self.detector.detect(small)
+
+        if faces is not None and size != (width, height):
+            faces = faces.copy()
+            # Columns 0..13 are x, y, w, h followed by 5 (x, y) landmarks
+            faces[:, 0:14:2] *= width / size[0]
+            faces[:, 1:14:2] *= height / size[1]
+        return faces
+
+
+def is_aligned_crop_path(path):
+    """Gallery files stored by enroll.py as aligned crops (marked by their name, not their size)."""
+    return path.lower().endswith(ALIGNED_CROP_SUFFIX)
+
+
+def encode_image(detector, recognizer, img, aligned=False):
+    """
+    Detect faces in an image and return the SFace feature of the first one (None if no face).
+    :param detector: FaceDetector (gallery images are always detected at full resolution)
+    :param aligned: img is an aligned crop (see is_aligned_crop_path) and is embedded directly,
+        YuNet does not reliably find a face filling the whole image
+    """
+    if aligned and img.shape[:2] == (ALIGNED_CROP_SIZE, ALIGNED_CROP_SIZE):
+        return recognizer.feature(img)
+    faces = detector.detect(img, scaled=False)
+
+    if faces is None:
+        return None
+    # Use the first face detected
+    return recognizer.feature(recognizer.alignCrop(img, faces[0]))
@@ -0,0 +1,421 @@
+"""
+Shared-memory frame ring buffer and a multi-process capture / recognition pipeline.
+
+    capture process --(FrameRing in shared memory)--> recognition process(es)
+                                                  \\-> GUI (display)
+    recognition process(es) --(small FrameRecord per frame)--> GUI
+
+The capture process writes every frame into the next slot of a fixed ring of `slots` frames
+in multiprocessing.shared_memory and publishes its sequence number. Readers never receive
+frame arrays through a pipe: they ask for the latest sequence number and copy that slot
+straight out of shared memory. Each slot carries the sequence number of the frame it
+holds (0 while it is being written), checked before and after a read, so a frame the
+writer lapped during the copy is detected and dropped instead of returned torn.
+
+Recognition processes claim the latest unclaimed frame (latest-frame semantics: frames
+that arrived while every worker was busy are skipped, never queued), so the workers scale
+across cores without contending for one GIL. Only boxes and names go back to the GUI.
+
+Usage (headless, throughput of the process pipeline):
+    python frame_ring.py --source 0 --workers 2 --seconds 30
+    python frame_ring.py --transport          # ring vs multiprocessing.Queue per frame
+"""
+import argparse
+import multiprocessing
+import queue
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+# Header (int64): latest written seq, latest claimed seq, capture finished flag, then one seq per slot
+_WRITE, _CLAIM, _FINISHED, _SLOTS = 0, 1, 2, 3
+_ALIGN = 64
+
+# Result of one frame, sent back from a recognition process
+FrameRecord = namedtuple("FrameRecord", ["seq", "timestamp", "worker", "locations", "names", "recognize_ms"])
+
+
+class FrameRing:
+    """
+    Fixed-size ring of equally shaped uint8 frames in shared memory.
+    One writer; any number of readers in any process (open with the writer's spec).
+    """
+
+    def __init__(self, shape, slots=8, name=None, lock=None):
+        """
+        :param shape: Frame shape, e.g. (480, 640, 3)
+        :param slots: Frames kept; a reader must finish copying a frame before `slots` newer ones arrive
+        :param name: Attach to an existing ring (see spec) instead of creating one
+        :param lock: multiprocessing.Lock shared by all processes that call claim_latest()
+        """
+        self.shape = tuple(int(v) for v in shape)
+        self.slots = int(slots)
+        self.lock = lock
+        self.frame_bytes = int(np.prod(self.shape))
+        header_bytes = 8 * (_SLOTS + self.slots)
+        times_offset = -(-header_bytes // _ALIGN) * _ALIGN
+        frames_offset = -(-(times_offset + 8 * self.slots) // _ALIGN) * _ALIGN
+        self.stride = -(-self.frame_bytes // _ALIGN) * _ALIGN
+        size = frames_offset + self.stride * self.slots
+
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        buf = self.shm.buf
+        self._header = np.ndarray((_SLOTS + self.slots,), dtype=np.int64, buffer=buf)
+        self._times = np.ndarray((self.slots,), dtype=np.float64, buffer=buf, offset=times_offset)
+        self._frames = [np.ndarray(self.shape, dtype=np.uint8, buffer=buf, offset=frames_offset + i * self.stride)
+                        for i in range(self.slots)]
+        if self.owner:
+            self._header[:] = 0
+
+    @property
+    def spec(self):
+        """(shape, slots, name): arguments to open this ring in another process."""
+        return self.shape, self.slots, self.shm.name
+
+    def write(self, frame, timestamp=None):
+        """Copy a frame into the next slot and publish it. Returns its sequence number."""
+        seq = int(self._header[_WRITE]) + 1
+        slot = seq % self.slots
+        self._header[_SLOTS + slot] = 0  # readers of the previous frame in this slot see it is gone
+        np.copyto(self._frames[slot], frame)
+        self._times[slot] = time.time() if timestamp is None else timestamp
+        self._header[_SLOTS + slot] = seq
+        self._header[_WRITE] = seq
+        return seq
+
+    def finish(self):
+        """Mark the end of the stream (readers stop once they have seen the last frame)."""
+        self._header[_FINISHED] = 1
+
+    @property
+    def finished(self):
+        return bool(self._header[_FINISHED])
+
+    def latest_seq(self):
+        return int(self._header[_WRITE])
+
+    def claim_latest(self):
+        """
+        Sequence number of the newest frame no other reader has claimed, or 0.
+        Recognition workers use this so each frame is processed at most once.
+        """
+        with self.lock:
+            seq = int(self._header[_WRITE])
+            if seq <= self._header[_CLAIM]:
+                return 0
+            self._header[_CLAIM] = seq
+            return seq
+
+    def claimed_seq(self):
+        return int(self._header[_CLAIM])
+
+    def read(self, seq, out=None):
+        """
+        Copy frame `seq` out of its slot (into `out` when given).
+        :return: (frame, timestamp), or None when the frame was already overwritten
+        """
+        slot = seq % self.slots
+        if self._header[_SLOTS + slot] != seq:
+            return None
+        if out is None:
+            out = np.empty(self.shape, dtype=np.uint8)
+        np.copyto(out, self._frames[slot])
+        timestamp = float(self._times[slot])
+        if self._header[_SLOTS + slot] != seq:
+            return None  # lapped by the writer while copying
+        return out, timestamp
+
+    def read_latest(self, after=0, out=None):
+        """(seq, frame, timestamp) of the newest frame if it is newer than `after`, else None."""
+        seq = self.latest_seq()
+        if seq <= after:
+            return None
+        result = self.read(seq, out)
+        return None if result is None else (seq,) + result
+
+    def close(self):
+        # Views into the buffer must go before the mapping can be closed
+        self._header = self._times = self._frames = None
+        self.shm.close()
+
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _capture_main(source, slots, fps, lock, control, stop):
+    """Capture process: reads the source into a new ring and sends its spec on `control`."""
+    from pipeline import open_source
+    ring = None
+    try:
+        interval = 1.0 / fps if fps else 0.0
+        for frame in open_source(source):
+            start = time.perf_counter()
+            if ring is None:
+                ring = FrameRing(frame.shape, slots, lock=lock)
+                control.put(ring.spec)
+            if stop.is_set(): break
+            if frame.shape != ring.shape:
+                frame = cv2.resize(frame, (ring.shape[1], ring.shape[0]))
+            ring.write(frame)
+            # Pace files and folders like a live camera (a camera already blocks in read)
+            time.sleep(max(0.0, interval - (time.perf_counter() - start)))
+        if ring is None:
+            control.put(IOError(f"No frames from source '{source}'"))
+    except Exception as e:
+        control.put(e)
+    finally:
+        if ring is not None:
+            ring.finish()
+            ring.close()
+
+
+def _recognition_main(spec, lock, results, stop, worker, system_kwargs, tracking, motion_gate):
+    """Recognition process: own FaceRecognitionSystem, claims the latest frame and returns small records."""
+    from main import FaceRecognitionSystem
+    from gallery_watcher import GalleryWatcher
+    from tracking import FaceTracker
+
+    # The owning process (the GUI) is the only writer of the embedding cache; N workers saving
+    # the same generation files would truncate and delete them under each other's memory maps
+    system = FaceRecognitionSystem(progress=None, **dict(system_kwargs or {}, cache_read_only=True))
+    # Enrollments made by the GUI land in known_faces/, the watcher applies them here (in memory)
+    watcher = GalleryWatcher(system).start()
+    tracker = FaceTracker() if tracking else None
+    ring = FrameRing(*spec, lock=lock)
+    frame = np.empty(ring.shape, dtype=np.uint8)
+    try:
+        while not stop.is_set():
+            seq = ring.claim_latest()
+            if not seq:
+                if ring.finished and ring.claimed_seq() >= ring.latest_seq(): break
+                time.sleep(0.002)
+                continue
+            read = ring.read(seq, frame)
+            if read is None:
+                continue  # overwritten before it could be copied
+            _, timestamp = read
+            start = time.perf_counter()
+            if motion_gate is not None:
+                locations, names = system.recognize_gated(frame, motion_gate, tracker)
+            elif tracker is not None:
+                locations, names = system.recognize_tracked(frame, tracker)
+            else:
+                locations, names = system.recognize_faces(frame)
+            elapsed = (time.perf_counter() - start) * 1000
+            locations = [tuple(int(v) for v in location) for location in locations]
+            results.put(FrameRecord(seq, timestamp, worker, locations, list(names), elapsed))
+    finally:
+        watcher.stop()
+        ring.close()
+        system.close()
+
+
+class ProcessPipeline:
+    """
+    Capture and recognition in separate processes around a FrameRing. The owning process
+    (e.g. the GUI) reads frames for display with latest_frame() and results with poll_results().
+    """
+
+    def __init__(self, source=0, workers=1, slots=8, fps=None, system_kwargs=None, tracking=True, motion_gate=None):
+        """
+        :param source: Camera index, video file or image folder (see pipeline.open_source)
+        :param workers: Recognition processes
+        :param slots: Frames in the ring
+        :param fps: Pace files / folders at this rate (None = as fast as they decode)
+        :param system_kwargs: FaceRecognitionSystem arguments of the recognition processes
+            (they always open the embedding cache read-only, the owning process writes it)
+        :param tracking: Track faces between the frames a worker processes
+        :param motion_gate: Optional motion_gate.MotionGate; each worker gets its own copy
+        """
+        self.source = source
+        self.workers = max(1, workers)
+        self.slots = slots
+        self.fps = fps
+        self.system_kwargs = system_kwargs
+        self.tracking = tracking
+        self.motion_gate = motion_gate
+        self.ring = None
+        self.results_received = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        self._results = self._context.Queue()
+        self._processes = []
+
+    def start(self, timeout=30.0):
+        """Start capture, wait for its first frame, then start the recognition processes."""
+        lock = self._context.Lock()
+        control = self._context.Queue()
+        capture = self._context.Process(target=_capture_main, name="frame-capture", daemon=True,
+                                        args=(self.source, self.slots, self.fps, lock, control, self._stop))
+        capture.start()
+        self._processes.append(capture)
+        try:
+            spec = control.get(timeout=timeout)
+        except queue.Empty:
+            self.stop()
+            raise IOError(f"No frame from source '{self.source}' within {timeout:.0f} s")
+        if isinstance(spec, Exception):
+            self.stop()
+            raise spec
+        # The ring lives until stop() unlinks it, whichever process exits first
+        self.ring = FrameRing(*spec, lock=lock)
+        for worker in range(self.workers):
+            process = self._context.Process(
+                target=_recognition_main, name=f"frame-recognition-{worker}", daemon=True,
+                args=(spec, lock, self._results, self._stop, worker, self.system_kwargs, self.tracking, self.motion_gate))
+            process.start()
+            self._processes.append(process)
+        return self
+
+    def latest_frame(self, after=0):
+        """(seq, frame, timestamp) of the newest frame after `after` (a private copy), or None."""
+        return self.ring.read_latest(after) if self.ring is not None else None
+
+    def poll_results(self):
+        """All records received since the last call, oldest first."""
+        records = []
+        while True:
+            try:
+                records.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        self.results_received += len(records)
+        return records
+
+    @property
+    def alive(self):
+        """True while any recognition process runs (capture may already have finished)."""
+        return any(p.is_alive() for p in self._processes[1:])
+
+    def stats(self):
+        written = self.ring.latest_seq() if self.ring is not None else 0
+        return {"frames_written": written, "results": self.results_received,
+                "frames_skipped": max(0, written - self.results_received)}
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.unlink()
+            self.ring = None
+
+
+def _queue_consumer(frames, done):
+    """Receive every frame through a Queue (pickled, one copy out of the pipe)."""
+    count = checksum = 0
+    while True:
+        frame = frames.get()
+        if frame is None: break
+        checksum += int(frame[0, 0, 0])
+        count += 1
+    done.put((count, checksum))
+
+
+def _ring_consumer(spec, acked, total, done):
+    """Read every frame through a FrameRing (one copy out of shared memory), acknowledging each."""
+    ring = FrameRing(*spec)
+    frame = np.empty(ring.shape, dtype=np.uint8)
+    count = checksum = 0
+    while count < total:
+        if ring.latest_seq() <= count:
+            time.sleep(0)
+            continue
+        if ring.read(count + 1, frame) is None:
+            break  # lapped, cannot happen while the writer waits for acknowledgements
+        checksum += int(frame[0, 0, 0])
+        count += 1
+        acked.value = count
+    ring.close()
+    done.put((count, checksum))
+
+
+def compare_transport(frames=300, shape=(480, 640, 3), slots=8):
+    """
+    End-to-end time to deliver every frame to another process: multiprocessing.Queue vs FrameRing.
+    Both consumers receive all frames in order and copy each one out; the ring writer waits for
+    acknowledgements so it never laps the reader. Timed from the first frame to the consumer's report.
+    """
+    context = multiprocessing.get_context("spawn")
+    rng = np.random.default_rng(0)
+    source = [rng.integers(0, 255, shape, dtype=np.uint8) for _ in range(4)]
+    expected = sum(int(source[i % len(source)][0, 0, 0]) for i in range(frames))
+    done = context.Queue()
+
+    q = context.Queue(maxsize=slots)
+    consumer = context.Process(target=_queue_consumer, args=(q, done))
+    consumer.start()
+    time.sleep(1.0)  # consumer start-up is not part of the transport
+    start = time.perf_counter()
+    for i in range(frames):
+        q.put(source[i % len(source)])
+    q.put(None)
+    queue_count, queue_sum = done.get()
+    queue_time = time.perf_counter() - start
+    consumer.join()
+
+    ring = FrameRing(shape, slots)
+    acked = context.Value("q", 0, lock=False)
+    consumer = context.Process(target=_ring_consumer, args=(ring.spec, acked, frames, done))
+    consumer.start()
+    time.sleep(1.0)  # consumer start-up is not part of the transport
+    start = time.perf_counter()
+    for i in range(frames):
+        while i - acked.value >= slots - 1:
+            time.sleep(0)
+        ring.write(source[i % len(source)])
+    ring_count, ring_sum = done.get()
+    ring_time = time.perf_counter() - start
+    consumer.join()
+    ring.close()
+    ring.unlink()
+
+    print(f"[*] {frames} frames of {shape}, every frame delivered and copied out by the consumer")
+    for label, elapsed, count, checksum in (("Queue", queue_time, queue_count, queue_sum),
+                                            ("FrameRing", ring_time, ring_count, ring_sum)):
+        print(f"    {label:<9} {elapsed / frames * 1000:6.3f} ms/frame end to end, {count} received, "
+              f"content {'ok' if checksum == expected else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture and recognition in separate processes over a shared-memory ring")
+    parser.add_argument("--source", default="0", help="Camera index, video file or image folder")
+    parser.add_argument("--workers", type=int, default=2, help="Recognition processes")
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--fps", type=float, default=30.0, help="Pace files / folders at this rate (0 = unpaced)")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Stop after this long")
+    parser.add_argument("--transport", action="store_true", help="Only compare the frame transport against a Queue")
+    args = parser.parse_args()
+
+    if args.transport:
+        compare_transport()
+    else:
+        pipeline = ProcessPipeline(args.source, args.workers, args.slots, args.fps or None).start()
+        started = time.perf_counter()
+        latency = []
+        try:
+            while pipeline.alive and time.perf_counter() - started < args.seconds:
+                for record in pipeline.poll_results():
+                    latency.append((time.time() - record.timestamp) * 1000)
+                    if record.names:
+                        print(f"[*] #{record.seq} worker {record.worker}: {', '.join(record.names)}")
+                time.sleep(0.02)
+        except KeyboardInterrupt:
+            pass
+        elapsed = time.perf_counter() - started
+        stats = pipeline.stats()
+        pipeline.stop()
+        print(f"[*] {stats['frames_written']} frames captured, {stats['results']} recognized "
+              f"({stats['results'] / elapsed:.1f}/s), {stats['frames_skipped']} skipped")
+        if latency:
+            print(f"    capture-to-result p50 {np.percentile(latency, 50):.1f} ms, p95 {np.percentile(latency, 95):.1f} ms")
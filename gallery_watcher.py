@@ -0,0 +1,123 @@
+"""
+Keeps a running FaceRecognitionSystem in sync with its known faces folder.
+
+The folder is polled (portable, no extra dependency) and only the differences are applied:
+new photos are encoded and added, deleted photos are dropped and modified photos are
+re-encoded, while recognition keeps running on the current gallery snapshot.
+A file is only picked up once its size and modification time are unchanged between two
+scans, so photos that are still being copied in are not read half-written.
+
+Usage:
+    python gallery_watcher.py --known-faces known_faces --interval 2
+"""
+import argparse
+import os
+import threading
+import time
+
+
+class GalleryWatcher:
+    def __init__(self, system, interval=2.0, encoder=None):
+        """
+        :param system: FaceRecognitionSystem to update
+        :param interval: Seconds between scans
+        :param encoder: System whose models encode new photos (default: a worker_clone of system,
+            so encoding does not share YuNet/SFace with the recognition thread)
+        """
+        self.system = system
+        self.interval = interval
+        self.encoder = encoder
+        self._applied = {}    # path -> (size, mtime_ns) as loaded into the gallery
+        self._last_scan = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.added = 0
+        self.removed = 0
+
+        for path in system.known_paths:
+            stat = self._stat(path)
+            if stat is not None:
+                self._applied[path] = stat
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _scan(self):
+        if not os.path.isdir(self.system.known_faces_dir):
+            return {}
+        current = {}
+        for path, _ in self.system.list_gallery_images():
+            stat = self._stat(path)
+            if stat is not None:
+                current[path] = stat
+        return current
+
+    def poll(self):
+        """Scan once and apply the changes. Returns (faces added, faces removed)."""
+        current = self._scan()
+        removed = [p for p in self._applied if p not in current]
+        # Stable: same size / mtime as in the previous scan, so no longer being written
+        changed = [p for p, stat in current.items()
+                   if self._last_scan.get(p) == stat and self._applied.get(p) != stat]
+        modified = [p for p in changed if p in self._applied]
+        self._last_scan = current
+
+        removed_faces = added_faces = 0
+        if removed or modified:
+            removed_faces = self.system.remove_images(removed + modified)
+            for path in removed + modified:
+                self._applied.pop(path, None)
+        if changed:
+            if self.encoder is None:
+                self.encoder = self.system.worker_clone()
+            added_faces = self.system.add_images(changed, encoder=self.encoder)
+            for path in changed:
+                self._applied[path] = current[path]
+
+        self.added += added_faces
+        self.removed += removed_faces
+        if added_faces or removed_faces:
+            print(f"[*] Gallery updated: +{added_faces} / -{removed_faces} faces "
+                  f"({len(self.system.known_names)} total)")
+        return added_faces, removed_faces
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"[!] Gallery watcher: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="gallery-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == "__main__":
+    from main import FaceRecognitionSystem
+
+    parser = argparse.ArgumentParser(description="Apply known_faces folder changes to a running gallery")
+    parser.add_argument("--known-faces", default="known_faces")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between scans")
+    args = parser.parse_args()
+
+    system = FaceRecognitionSystem(known_faces_dir=args.known_faces)
+    watcher = GalleryWatcher(system, args.interval).start()
+    print(f"[*] Watching '{args.known_faces}' every {args.interval:.1f} s (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
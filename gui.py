@@ -1,17 +1,23 @@
+import argparse
 import sys
 import cv2
 import numpy as np
-import requests
 import threading
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QPushButton, QListWidget, 
                              QLineEdit, QFileDialog, QMessageBox, QFrame, 
-                             QGridLayout, QScrollArea, QDialog)
+                             QGridLayout, QScrollArea, QDialog, QInputDialog)
 from PyQt6.QtCore import Qt, pyqtSignal, QThread, QObject, pyqtSlot, QTimer
 from PyQt6.QtGui import QImage, QPixmap, QFont, QAction
 
 # Import backend
 from main import FaceRecognitionSystem
+from tracking import FaceTracker
+from metrics import FpsCounter, start_metrics_server
+from gallery_watcher import GalleryWatcher
+from iot_dispatcher import IoTDispatcher
+from motion_gate import MotionGate, parse_roi
+from frame_ring import ProcessPipeline
 import os
 import time
 from datetime import datetime
@@ -20,40 +26,179 @@ from datetime import datetime
 class RecognitionWorker(QObject):
     result_signal = pyqtSignal(object, object, object) # frame, locations, names
 
-    def __init__(self, system):
+    def __init__(self, system, tracking=True, motion_gate=None):
         super().__init__()
         self.system = system
         self.running = True
+        # Track faces between frames so a person at the door is not re-embedded every frame
+        self.tracker = FaceTracker() if tracking else None
+        # Optional motion_gate.MotionGate: no YuNet run while the scene is static
+        self.motion_gate = motion_gate
 
     @pyqtSlot(np.ndarray)
     def process_frame(self, frame):
         if not self.running: return
         
         # Run recognition
-        locations, names = self.system.recognize_faces(frame)
+        with self.system.metrics.timer("recognize"):
+            if self.motion_gate is not None:
+                locations, names = self.system.recognize_gated(frame, self.motion_gate, self.tracker)
+            elif self.tracker is not None:
+                locations, names = self.system.recognize_tracked(frame, self.tracker)
+            else:
+                locations, names = self.system.recognize_faces(frame)
+        self.system.metrics.inc("frames_processed")
         self.result_signal.emit(frame, locations, names)
 
 # --- Thread for Video Capture ---
 class VideoThread(QThread):
     change_pixmap_signal = pyqtSignal(np.ndarray)
 
-    def __init__(self):
+    def __init__(self, fps=30):
         super().__init__()
         self._run_flag = True
+        self.frame_interval = 1.0 / fps
 
     def run(self):
         cap = cv2.VideoCapture(0)
         while self._run_flag:
+            start = time.perf_counter()
             ret, frame = cap.read()
             if ret:
                 self.change_pixmap_signal.emit(frame)
-            time.sleep(0.033) 
+            # Only sleep for what is left of the frame interval
+            time.sleep(max(0.0, self.frame_interval - (time.perf_counter() - start)))
         cap.release()
 
     def stop(self):
         self._run_flag = False
         self.wait()
 
+# --- Process mode: capture and recognition run in other processes (frame_ring.py) ---
+class ProcessFeedThread(QThread):
+    """
+    Hands frames from the shared-memory ring to the UI like VideoThread, and the small result
+    records of the recognition processes like RecognitionWorker (older records are dropped).
+    """
+    change_pixmap_signal = pyqtSignal(np.ndarray)
+    result_signal = pyqtSignal(object, object, object) # frame (None), locations, names
+
+    def __init__(self, pipeline, metrics):
+        super().__init__()
+        self.pipeline = pipeline
+        self.metrics = metrics
+        self._run_flag = True
+
+    def run(self):
+        try:
+            self.pipeline.start()
+        except Exception as e:
+            print(f"[!] Could not start capture / recognition processes: {e}")
+            return
+        last_frame = last_result = 0
+        while self._run_flag:
+            latest = self.pipeline.latest_frame(last_frame)
+            if latest is not None:
+                last_frame, frame, _ = latest
+                self.change_pixmap_signal.emit(frame)
+            for record in self.pipeline.poll_results():
+                self.metrics.observe("recognize", record.recognize_ms)
+                self.metrics.inc("frames_processed")
+                if record.seq > last_result:
+                    last_result = record.seq
+                    self.result_signal.emit(None, record.locations, record.names)
+            time.sleep(0.005)
+
+    def stop(self):
+        self._run_flag = False
+        self.wait()
+        self.pipeline.stop()
+
+# --- Thread for overlay drawing, colour conversion and scaling ---
+class FrameRenderer(QThread):
+    """
+    Renders the latest submitted frame off the UI thread: scale to the label size, convert
+    to RGB and draw boxes into reused buffers. One image is in flight at a time; the UI thread
+    calls done() after swapping it in, and identical submissions are skipped.
+    """
+    image_ready = pyqtSignal(QImage)
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._pending = None
+        self._in_flight = False
+        self._run_flag = True
+        self._last = None  # (frame, locations, names, size, overlay) of the last render
+        self._scaled = None
+        self._rgb = None
+
+    def submit(self, frame, locations, names, size, overlay=None):
+        """Queue the latest frame (by reference) with its results; older pending work is replaced."""
+        with self._cond:
+            self._pending = (frame, locations, names, size, overlay)
+            self._cond.notify()
+
+    def done(self):
+        with self._cond:
+            self._in_flight = False
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._run_flag or (self._pending is not None and not self._in_flight))
+                if not self._run_flag: break
+                pending = self._pending
+                self._pending = None
+                # Compare by identity while holding the references: an id() of a released frame
+                # can be reused by the next captured one
+                last = self._last
+                if (last is not None and all(a is b for a, b in zip(pending[:3], last[:3]))
+                        and pending[3:] == last[3:]):
+                    self.metrics.inc("renders_skipped")
+                    continue
+                self._last = pending
+                frame, locations, names, size, overlay = pending
+                self._in_flight = True
+
+            with self.metrics.timer("render"):
+                image = self.render(frame, locations, names, size, overlay)
+            self.image_ready.emit(image)
+
+    def render(self, frame, locations, names, size, overlay):
+        h, w = frame.shape[:2]
+        scale = min(size[0] / w, size[1] / h)
+        out_w, out_h = max(1, int(w * scale)), max(1, int(h * scale))
+        if self._rgb is None or self._rgb.shape[:2] != (out_h, out_w):
+            self._scaled = np.empty((out_h, out_w, 3), dtype=np.uint8)
+            self._rgb = np.empty((out_h, out_w, 3), dtype=np.uint8)
+
+        # Scale first so conversion and drawing only touch the displayed pixels
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        cv2.resize(frame, (out_w, out_h), dst=self._scaled, interpolation=interpolation)
+        cv2.cvtColor(self._scaled, cv2.COLOR_BGR2RGB, dst=self._rgb)
+
+        rgb = self._rgb
+        for (top, right, bottom, left), name in zip(locations, names):
+            top, right, bottom, left = (int(v * scale) for v in (top, right, bottom, left))
+            color = (0, 255, 0) if name != "Unknown" else (255, 0, 0)
+            cv2.rectangle(rgb, (left, top), (right, bottom), color, 2)
+            cv2.rectangle(rgb, (left, bottom - 30), (right, bottom), color, cv2.FILLED)
+            cv2.putText(rgb, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 1)
+        for i, line in enumerate(overlay or ()):
+            cv2.putText(rgb, line, (10, 24 + 22 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 1)
+
+        # Wraps the buffer without copying; it is not rewritten until done() is called
+        return QImage(rgb.data, out_w, out_h, 3 * out_w, QImage.Format.Format_RGB888)
+
+    def stop(self):
+        with self._cond:
+            self._run_flag = False
+            self._cond.notify()
+        self.wait()
+
 # --- Separate Window based on User Request ---
 class DatabaseWindow(QMainWindow):
     def __init__(self, system):
@@ -98,6 +243,10 @@ class DatabaseWindow(QMainWindow):
         btn_add.clicked.connect(self.upload_photo)
         d_layout.addWidget(btn_add)
 
+        btn_rename = QPushButton("Rename User")
+        btn_rename.clicked.connect(self.rename_user)
+        d_layout.addWidget(btn_rename)
+
         btn_del = QPushButton("Delete User")
         btn_del.setStyleSheet("background-color: #d32f2f;")
         btn_del.clicked.connect(self.delete_user)
@@ -145,12 +294,27 @@ class DatabaseWindow(QMainWindow):
             else:
                 QMessageBox.warning(self, "Error", "Could not read image.")
 
+    def rename_user(self):
+        name = self.lbl_name.text()
+        if name == "Select User": return
+
+        new_name, ok = QInputDialog.getText(self, "Rename", f"New name for {name}:", text=name)
+        new_name = new_name.strip()
+        if ok and new_name and new_name != name:
+            success, msg = self.system.rename_user(name, new_name)
+            if success:
+                self.refresh_list()
+                self.lbl_name.setText(new_name)
+            else:
+                QMessageBox.warning(self, "Error", msg)
+
     def delete_user(self):
         name = self.lbl_name.text()
         if name == "Select User": return
         
         if QMessageBox.question(self, "Confirm", f"Delete {name}?") == QMessageBox.StandardButton.Yes:
-            self.system.delete_user(name)
+            if not self.system.delete_user(name):
+                QMessageBox.warning(self, "Error", f"Could not delete {name}.")
             self.refresh_list()
             self.lbl_name.setText("Select User")
             self.lbl_info.setText("Images: -")
@@ -160,36 +324,75 @@ class DatabaseWindow(QMainWindow):
 class DetectionWindow(QMainWindow):
     # Signals to worker
     frame_for_processing = pyqtSignal(np.ndarray)
-
-    def __init__(self):
+    # IoT results arrive on dispatcher threads; the signal hands them to the UI thread
+    iot_result_signal = pyqtSignal(object)
+
+    def __init__(self, metrics_port=None, motion_gate=None, recognition_processes=0):
+        """
+        :param metrics_port: Serve Prometheus metrics on this port
+        :param motion_gate: Optional motion_gate.MotionGate in front of detection
+        :param recognition_processes: Capture in its own process and recognize in this many processes
+            (frames shared through frame_ring.FrameRing); 0 = capture and recognition threads in this process
+        """
         super().__init__()
         self.setWindowTitle("CORTEX Face Detection & IoT Control")
         self.setGeometry(100, 100, 1100, 750)
         
-        # System Core
-        self.system = FaceRecognitionSystem()
+        # System Core: models and gallery load in the background so the window and camera start at once
+        self.system = FaceRecognitionSystem(background=True)
         self.db_window = None
+        self.watcher = None  # picks up photos added to known_faces/ by other tools
+
+        # Instrumentation: FPS / latency overlay and optional Prometheus endpoint
+        self.metrics = self.system.metrics
+        self.fps = FpsCounter()
+        self.show_overlay = False
+        self.metrics.set_gauge("recognition_in_flight", lambda: int(self.processing))
+        self.metrics.set_gauge("display_fps", lambda: self.fps.fps)
+        if metrics_port:
+            start_metrics_server(self.metrics, metrics_port)
+            print(f"[*] Metrics at http://127.0.0.1:{metrics_port}/metrics")
 
         # IoT Control Variables
         self.esp32_ip = "192.168.1.100" # Default IP
-        self.iot_cooldown = 10 # Seconds
-        self.last_iot_trigger = 0
+        self.iot_cooldown = 10 # Seconds, per identity
         self.iot_enabled = False
+        self.motion_gate = motion_gate
+        self.recognition_processes = recognition_processes
+        self.iot_result_signal.connect(self.handle_iot_result)
+        self.dispatcher = IoTDispatcher([self.esp32_ip], identity_cooldown=self.iot_cooldown,
+                                        on_result=self.iot_result_signal.emit, metrics=self.metrics)
+        self.metrics.set_gauge("iot_queued", lambda: self.dispatcher.queue.qsize())
 
         self.setup_threads()
         self.setup_ui()
 
+        self.startup_timer = QTimer(self)
+        self.startup_timer.timeout.connect(self.update_startup_status)
+        self.startup_timer.start(200)
+
     def setup_threads(self):
-        self.video_thread = VideoThread()
+        self.worker = self.worker_thread = None
+        if self.recognition_processes:
+            # Recognition processes load their own system; this one serves enrollment and the database
+            pipeline = ProcessPipeline(0, self.recognition_processes, motion_gate=self.motion_gate)
+            self.motion_gate = None  # its statistics live in the worker processes
+            self.video_thread = ProcessFeedThread(pipeline, self.metrics)
+            self.video_thread.result_signal.connect(self.handle_recognition_results)
+        else:
+            self.video_thread = VideoThread()
+            self.worker_thread = QThread()
+            self.worker = RecognitionWorker(self.system, motion_gate=self.motion_gate)
+            self.worker.moveToThread(self.worker_thread)
+            self.frame_for_processing.connect(self.worker.process_frame)
+            self.worker.result_signal.connect(self.handle_recognition_results)
+            self.worker_thread.start()
         self.video_thread.change_pixmap_signal.connect(self.update_feed_and_process)
         self.video_thread.start()
 
-        self.worker_thread = QThread()
-        self.worker = RecognitionWorker(self.system)
-        self.worker.moveToThread(self.worker_thread)
-        self.frame_for_processing.connect(self.worker.process_frame)
-        self.worker.result_signal.connect(self.handle_recognition_results)
-        self.worker_thread.start()
+        self.renderer = FrameRenderer(self.system.metrics)
+        self.renderer.image_ready.connect(self.show_rendered)
+        self.renderer.start()
 
         self.last_results = ([], []) 
         self.processing = False 
@@ -210,6 +413,12 @@ class DetectionWindow(QMainWindow):
         title.setStyleSheet("color: #03dac6;")
         top_bar.addWidget(title)
         top_bar.addStretch()
+
+        btn_stats = QPushButton("STATS")
+        btn_stats.setCheckable(True)
+        btn_stats.setStyleSheet("background-color: #3d3d3d; color: white; padding: 5px 15px;")
+        btn_stats.clicked.connect(lambda checked: setattr(self, "show_overlay", checked))
+        top_bar.addWidget(btn_stats)
         
         btn_db = QPushButton("Open Database")
         btn_db.setStyleSheet("background-color: #3d3d3d; color: white; padding: 5px 15px;")
@@ -237,10 +446,14 @@ class DetectionWindow(QMainWindow):
         reg_layout.addWidget(btn_snap)
         left_col.addWidget(reg_panel)
 
-        self.status = QLabel("System Ready")
+        self.status = QLabel("Starting...")
         self.status.setStyleSheet("color: #777; margin-top: 5px;")
         left_col.addWidget(self.status)
 
+        self.startup_label = QLabel("Loading models...")
+        self.startup_label.setStyleSheet("color: #bb86fc;")
+        left_col.addWidget(self.startup_label)
+
         main_layout.addLayout(left_col, 3)
 
         # Right Column (IoT & Settings)
@@ -267,7 +480,7 @@ class DetectionWindow(QMainWindow):
 
         iot_layout.addSpacing(10)
         btn_test = QPushButton("TEST UNLOCK")
-        btn_test.clicked.connect(self.trigger_iot_action)
+        btn_test.clicked.connect(lambda: self.trigger_iot_action("test", force=True))
         iot_layout.addWidget(btn_test)
 
         self.iot_log = QListWidget()
@@ -279,9 +492,29 @@ class DetectionWindow(QMainWindow):
         right_col.addStretch()
         main_layout.addLayout(right_col, 1)
 
+    def update_startup_status(self):
+        """Shows background startup progress until the system is ready."""
+        state = self.system.state
+        if state == "ready":
+            self.startup_label.hide()
+            self.status.setText("System Ready")
+            self.startup_timer.stop()
+            self.watcher = GalleryWatcher(self.system).start()
+        elif state == "error":
+            self.startup_label.setText(f"Startup failed: {self.system.startup_error}")
+            self.startup_label.setStyleSheet("color: #d32f2f;")
+            self.startup_timer.stop()
+        elif state == "loading_gallery":
+            done, total = self.system.startup_progress
+            progress = f" {done}/{total}" if total else ""
+            self.startup_label.setText(f"Loading faces{progress}... ({len(self.system.known_names)} searchable)")
+        else:
+            self.startup_label.setText("Loading models..." if state == "loading_models" else "Warming up models...")
+
     def toggle_iot(self):
         self.iot_enabled = self.btn_iot_toggle.isChecked()
         self.esp32_ip = self.txt_ip.text().strip()
+        self.dispatcher.set_devices([self.esp32_ip])
         if self.iot_enabled:
             self.btn_iot_toggle.setStyleSheet("background-color: #bb86fc; color: black; padding: 10px; font-weight: bold;")
             self.log_iot("IoT Trigger Enabled")
@@ -293,46 +526,64 @@ class DetectionWindow(QMainWindow):
         timestamp = datetime.now().strftime("%H:%M:%S")
         self.iot_log.insertItem(0, f"[{timestamp}] {msg}")
 
-    def trigger_iot_action(self):
-        """Sends a request to the ESP32 in a separate thread to avoid UI freezing."""
-        ip = self.txt_ip.text().strip()
-        url = f"http://{ip}/unlock" # Assumes ESP32 has an /unlock endpoint
-        
-        def send_request():
-            try:
-                self.log_iot(f"Sending trigger to {ip}...")
-                response = requests.get(url, timeout=3)
-                if response.status_code == 200:
-                    self.log_iot("Success: Unlock command sent.")
-                else:
-                    self.log_iot(f"Failed: HTTP {response.status_code}")
-            except Exception as e:
-                self.log_iot(f"Error: {str(e)}")
-
-        threading.Thread(target=send_request, daemon=True).start()
+    def trigger_iot_action(self, identity, force=False):
+        """Queues an unlock on the dispatcher; the request itself never runs on the UI thread."""
+        if force:
+            # Manual test uses whatever IP is currently typed in
+            self.esp32_ip = self.txt_ip.text().strip()
+            self.dispatcher.set_devices([self.esp32_ip])
+        for device, state in self.dispatcher.trigger(identity, force=force):
+            if state == "queued":
+                self.log_iot(f"Sending trigger for {identity} to {device}...")
+            elif state == "queue_full":
+                self.log_iot(f"Dropped: {device} queue full")
+
+    @pyqtSlot(object)
+    def handle_iot_result(self, result):
+        if result.ok:
+            self.log_iot(f"Success: Unlock command sent ({result.latency_ms:.0f} ms).")
+        elif result.status is not None:
+            self.log_iot(f"Failed: HTTP {result.status} after {result.attempts} attempts")
+        else:
+            self.log_iot(f"Error: {result.error}")
 
     def update_feed_and_process(self, cv_img):
-        self.current_frame = cv_img.copy()
-        if not self.processing:
-            self.processing = True
-            self.frame_for_processing.emit(cv_img)
+        paint_start = time.perf_counter()
+        self.fps.tick()
+        self.metrics.inc("frames_captured")
+        # Frames from VideoThread are never written to, so keep references instead of copies
+        self.current_frame = cv_img
+        # In process mode the recognition processes take the latest frame from the ring themselves
+        if self.worker is not None:
+            if not self.processing:
+                self.processing = True
+                self.frame_for_processing.emit(cv_img)
+            else:
+                # Worker still busy with an earlier frame
+                self.metrics.inc("frames_dropped")
 
         locations, names = self.last_results
-        display_frame = cv_img.copy()
-        for (top, right, bottom, left), name in zip(locations, names):
-            color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
-            cv2.rectangle(display_frame, (left, top), (right, bottom), color, 2)
-            cv2.rectangle(display_frame, (left, bottom - 30), (right, bottom), color, cv2.FILLED)
-            cv2.putText(display_frame, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 1)
-
-        rgb_image = cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_image.shape
-        bytes_per_line = ch * w
-        qt_img = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-        self.image_label.setPixmap(QPixmap.fromImage(qt_img).scaled(
-            self.image_label.width(), self.image_label.height(), 
-            Qt.AspectRatioMode.KeepAspectRatio
-        ))
+        overlay = self.stats_overlay_lines() if self.show_overlay else None
+        size = (self.image_label.width(), self.image_label.height())
+        self.renderer.submit(cv_img, locations, names, size, overlay)
+        self.metrics.observe("gui_paint", (time.perf_counter() - paint_start) * 1000)
+
+    @pyqtSlot(QImage)
+    def show_rendered(self, image):
+        """UI thread only swaps in the image rendered by FrameRenderer."""
+        self.image_label.setPixmap(QPixmap.fromImage(image))
+        self.renderer.done()
+
+    def stats_overlay_lines(self):
+        stages = self.metrics.snapshot()["stages"]
+        lines = [f"FPS {self.fps.fps:.1f}"]
+        for stage in ("detect", "embed", "match", "recognize", "render"):
+            if stage in stages:
+                lines.append(f"{stage} {stages[stage]['p50_ms']:.1f} ms")
+        if self.motion_gate is not None:
+            stats = self.motion_gate.stats()
+            lines.append(f"motion {stats['motion']:.1%}, skipped {stats['skip_rate']:.0%}")
+        return tuple(lines)
 
     @pyqtSlot(object, object, object)
     def handle_recognition_results(self, frame, locations, names):
@@ -344,13 +595,10 @@ class DetectionWindow(QMainWindow):
             if detected_known:
                 self.status.setText(f"Welcome, {', '.join(set(detected_known))}!")
                 
-                # Check for IoT Trigger
+                # Check for IoT Trigger (cooldowns are per identity, in the dispatcher)
                 if self.iot_enabled:
-                    current_time = time.time()
-                    if current_time - self.last_iot_trigger > self.iot_cooldown:
-                        self.last_iot_trigger = current_time
-                        self.log_iot(f"Match found: {detected_known[0]}")
-                        self.trigger_iot_action()
+                    for name in dict.fromkeys(detected_known):
+                        self.trigger_iot_action(name)
             else:
                 self.status.setText("Scanning (Unknown face detected)")
         else:
@@ -379,13 +627,33 @@ class DetectionWindow(QMainWindow):
 
     def closeEvent(self, event):
         self.video_thread.stop()
-        self.worker.running = False
-        self.worker_thread.quit()
-        self.worker_thread.wait()
+        self.renderer.stop()
+        self.dispatcher.stop()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.worker is not None:
+            self.worker.running = False
+            self.worker_thread.quit()
+            self.worker_thread.wait()
+        self.system.close()
         event.accept()
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = DetectionWindow()
+    parser = argparse.ArgumentParser(description="Face detection & IoT control GUI")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--motion-gate", action="store_true", help="Skip detection while the scene is static")
+    parser.add_argument("--motion-sensitivity", type=float, default=0.01, help="Changed pixel fraction that counts as motion")
+    parser.add_argument("--max-skip", type=float, default=2.0, help="Max seconds between detections (0 = no limit)")
+    parser.add_argument("--roi", action="append", type=parse_roi, default=[], help="Motion region x,y,w,h (repeatable)")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Capture in its own process and recognize in this many processes (0 = threads)")
+    args, qt_args = parser.parse_known_args()
+
+    gate = None
+    if args.motion_gate:
+        gate = MotionGate(args.motion_sensitivity, max_skip=args.max_skip or None, rois=args.roi)
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = DetectionWindow(metrics_port=args.metrics_port, motion_gate=gate, recognition_processes=args.processes)
     window.show()
     sys.exit(app.exec())
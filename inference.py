@@ -0,0 +1,248 @@
+"""
+Inference backends for the YuNet / SFace ONNX models.
+
+An InferenceProfile selects
+- the OpenCV DNN backend and target used by YuNet (cv2.FaceDetectorYN) and SFace,
+- the engine of the batched SFace forward pass: OpenCV DNN, or onnxruntime (CPU) when installed,
+- the number of inference threads (cv2.setNumThreads / onnxruntime intra-op threads, 0 = library default).
+
+YuNet always runs through cv2.FaceDetectorYN, which owns its prior decoding and NMS.
+
+The auto-tuner times every combination available on this machine and saves the fastest
+to models/inference_profile.json, which FaceRecognitionSystem picks up on start:
+    python inference.py --tune --image known_faces/alice/alice_1.jpg
+    python inference.py --show
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from collections import namedtuple
+import cv2
+import numpy as np
+from matching import normalize_rows
+
+# engine: "opencv" or "onnxruntime" (batched SFace forward pass)
+# backend / target: OpenCV DNN backend and target names (see DNN_BACKENDS / DNN_TARGETS)
+# threads: inference threads, 0 = leave the library default
+InferenceProfile = namedtuple("InferenceProfile", ["engine", "backend", "target", "threads"])
+DEFAULT_PROFILE = InferenceProfile("opencv", "default", "cpu", 0)
+PROFILE_FILE = "inference_profile.json"
+
+DNN_BACKENDS = {
+    "default": cv2.dnn.DNN_BACKEND_DEFAULT,
+    "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+    "openvino": cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+    "cuda": cv2.dnn.DNN_BACKEND_CUDA,
+}
+DNN_TARGETS = {
+    "cpu": cv2.dnn.DNN_TARGET_CPU,
+    "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+    "opencl_fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+    "cuda": cv2.dnn.DNN_TARGET_CUDA,
+    "cuda_fp16": cv2.dnn.DNN_TARGET_CUDA_FP16,
+}
+# Embeddings of a tuned profile must stay this close (cosine) to the default profile
+MIN_FEATURE_SIMILARITY = 0.99
+
+
+def onnxruntime_available():
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def dnn_ids(profile):
+    """(backend_id, target_id) for cv2.FaceDetectorYN / FaceRecognizerSF / dnn.Net."""
+    profile = profile or DEFAULT_PROFILE
+    return DNN_BACKENDS[profile.backend], DNN_TARGETS[profile.target]
+
+
+def apply_threads(profile):
+    """Set the OpenCV inference threads of this process (no-op for threads=0)."""
+    if profile is not None and profile.threads:
+        cv2.setNumThreads(profile.threads)
+
+
+class OnnxRuntimeNet:
+    """onnxruntime CPU session with the setInput / forward interface of cv2.dnn.Net used by BatchEmbedder."""
+
+    def __init__(self, model_path, threads=0):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self._blob = None
+
+    def setInput(self, blob):
+        self._blob = np.ascontiguousarray(blob, dtype=np.float32)
+
+    def forward(self):
+        return self.session.run(None, {self.input_name: self._blob})[0]
+
+
+def create_net(model_path, profile=None):
+    """Network for batched SFace inference according to the profile."""
+    profile = profile or DEFAULT_PROFILE
+    if profile.engine == "onnxruntime":
+        return OnnxRuntimeNet(model_path, profile.threads)
+    net = cv2.dnn.readNet(model_path)
+    backend, target = dnn_ids(profile)
+    net.setPreferableBackend(backend)
+    net.setPreferableTarget(target)
+    return net
+
+
+def profile_path(models_dir="models"):
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, models_dir, PROFILE_FILE)
+
+
+def load_profile(models_dir="models"):
+    """Profile saved by the auto-tuner, or DEFAULT_PROFILE (also when it no longer applies here)."""
+    path = profile_path(models_dir)
+    if not os.path.exists(path):
+        return DEFAULT_PROFILE
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            profile = InferenceProfile(**json.load(f)["profile"])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[!] Ignoring inference profile '{path}': {e}")
+        return DEFAULT_PROFILE
+    if profile.backend not in DNN_BACKENDS or profile.target not in DNN_TARGETS:
+        print(f"[!] Ignoring inference profile '{path}': unknown backend / target")
+        return DEFAULT_PROFILE
+    if profile.engine == "onnxruntime" and not onnxruntime_available():
+        print("[!] Inference profile uses onnxruntime, which is not installed; using OpenCV DNN")
+        return profile._replace(engine="opencv")
+    return profile
+
+
+def save_profile(profile, results, models_dir="models"):
+    path = profile_path(models_dir)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "profile": profile._asdict(),
+            "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                        "cpus": os.cpu_count(), "opencv": cv2.__version__},
+            "results": results,
+        }, f, indent=2)
+    return path
+
+
+def candidate_profiles():
+    """Every (engine, backend, target, threads) combination that can run on this machine."""
+    cpus = os.cpu_count() or 1
+    threads = sorted({1, 2, 4, max(1, cpus // 2), cpus} & set(range(1, cpus + 1)))
+    pairs = []
+    for backend in ("opencv", "openvino", "cuda"):
+        available = set(cv2.dnn.getAvailableTargets(DNN_BACKENDS[backend]))
+        pairs += [(backend, target) for target, target_id in DNN_TARGETS.items() if target_id in available]
+    engines = ["opencv"] + (["onnxruntime"] if onnxruntime_available() else [])
+
+    profiles = []
+    for engine in engines:
+        for backend, target in pairs:
+            if engine == "onnxruntime" and (backend, target) != ("opencv", "cpu"):
+                continue  # only YuNet uses the DNN backend then, the CPU one is enough
+            profiles += [InferenceProfile(engine, backend, target, n) for n in threads]
+    return profiles
+
+
+def time_profile(profile, yunet_path, sface_path, frame, crops, repeat=20):
+    """
+    Mean ms of one YuNet detection on frame and one batched SFace pass over crops.
+    :return: (detect_ms, embed_ms, features)
+    """
+    from batch_embedder import BatchEmbedder
+    from face_models import FaceDetector, create_detector, create_recognizer
+
+    apply_threads(profile)
+    detector = FaceDetector(create_detector(yunet_path, profile))
+    embedder = BatchEmbedder(sface_path, create_recognizer(sface_path, profile), batch_size=len(crops),
+                             profile=profile)
+    for _ in range(2):
+        detector.detect(frame)
+        features = embedder.embed_crops(crops)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        detector.detect(frame)
+    detect_ms = (time.perf_counter() - start) * 1000 / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        embedder.embed_crops(crops)
+    embed_ms = (time.perf_counter() - start) * 1000 / repeat
+    return detect_ms, embed_ms, features
+
+
+def autotune(models_dir="models", image=None, faces=4, repeat=20):
+    """
+    Time every candidate profile and save the fastest (detect + embedding of `faces` faces).
+    Profiles whose embeddings drift from the default profile (e.g. fp16 targets) are rejected.
+    """
+    from face_models import model_paths
+
+    yunet_path, sface_path = model_paths(models_dir)
+    default_threads = cv2.getNumThreads()
+    frame = cv2.imread(image) if image else None
+    if frame is None:
+        frame = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    crop = cv2.resize(frame, (112, 112), interpolation=cv2.INTER_AREA)
+    crops = [crop] * faces
+
+    reference = None
+    results = []
+    print(f"{'engine':>11} {'backend':>8} {'target':>11} {'threads':>7} {'detect ms':>10} {'embed ms':>9} {'total':>8}")
+    for profile in [DEFAULT_PROFILE] + candidate_profiles():
+        try:
+            detect_ms, embed_ms, features = time_profile(profile, yunet_path, sface_path, frame, crops, repeat)
+        except Exception as e:
+            print(f"[!] {tuple(profile)} failed: {e}")
+            continue
+        finally:
+            cv2.setNumThreads(default_threads)
+        if reference is None:
+            reference = features
+        similarity = float(np.min(np.sum(normalize_rows(features) * normalize_rows(reference), axis=1)))
+        ok = similarity >= MIN_FEATURE_SIMILARITY
+        results.append({"profile": profile._asdict(), "detect_ms": round(detect_ms, 3), "embed_ms": round(embed_ms, 3),
+                        "feature_similarity": round(similarity, 5), "accepted": ok})
+        print(f"{profile.engine:>11} {profile.backend:>8} {profile.target:>11} {profile.threads:7d} "
+              f"{detect_ms:10.2f} {embed_ms:9.2f} {detect_ms + embed_ms:8.2f}" + ("" if ok else "  (features differ)"))
+
+    accepted = [r for r in results if r["accepted"]]
+    if not accepted:
+        print("[!] No profile could be timed.")
+        return None
+    best = min(accepted, key=lambda r: r["detect_ms"] + r["embed_ms"])
+    profile = InferenceProfile(**best["profile"])
+    path = save_profile(profile, results, models_dir)
+    baseline = results[0]["detect_ms"] + results[0]["embed_ms"]
+    print(f"[*] Fastest: {tuple(profile)} {best['detect_ms'] + best['embed_ms']:.2f} ms "
+          f"(default {baseline:.2f} ms), saved to {path}")
+    return profile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Select and auto-tune the YuNet / SFace inference backend")
+    parser.add_argument("--tune", action="store_true", help="Benchmark all combinations and save the fastest")
+    parser.add_argument("--show", action="store_true", help="Print the profile FaceRecognitionSystem will use")
+    parser.add_argument("--models", default="models")
+    parser.add_argument("--image", help="Frame used for timing (default: random 640x480)")
+    parser.add_argument("--faces", type=int, default=4, help="Faces embedded per timed frame")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.tune:
+        autotune(args.models, args.image, args.faces, args.repeat)
+    if args.show or not args.tune:
+        print(f"[*] Profile: {tuple(load_profile(args.models))} (onnxruntime "
+              f"{'available' if onnxruntime_available() else 'not installed'})")
+        print(f"    candidates on this machine: {len(candidate_profiles())}")
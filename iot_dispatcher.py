@@ -0,0 +1,251 @@
+"""
+IoT trigger dispatcher: sends /unlock requests to one or many devices (ESP32 etc.).
+
+- A bounded work queue served by a few worker threads, each with its own keep-alive
+  requests.Session, so triggers reuse open TCP connections instead of connecting every time
+- Retries with a per-attempt timeout inside a total time budget per trigger
+- Cooldowns per (identity, device) and per device, so two people arriving together are
+  not throttled as one
+- Results go to an on_result callback (in the GUI a Qt signal, which delivers them on the UI thread)
+
+A local stand-in for the ESP32 /unlock endpoint measures trigger latency end to end:
+    python iot_dispatcher.py --simulate --triggers 200
+    python iot_dispatcher.py --device 192.168.1.100 --triggers 5
+"""
+import argparse
+import queue
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+# ok: device answered 200; status: last HTTP status (None on connection errors); latency_ms: queue + send time
+TriggerResult = namedtuple("TriggerResult", ["identity", "device", "ok", "status", "attempts", "latency_ms", "error"])
+
+
+def device_url(device, path="/unlock"):
+    """'192.168.1.100' or 'http://host:port' -> full endpoint URL."""
+    base = device if device.startswith(("http://", "https://")) else f"http://{device}"
+    return base.rstrip("/") + path
+
+
+class IoTDispatcher:
+    def __init__(self, devices, path="/unlock", workers=2, queue_size=16, identity_cooldown=10.0,
+                 device_cooldown=0.0, timeout=3.0, retries=2, budget=5.0, on_result=None, metrics=None):
+        """
+        :param devices: Device hosts ('192.168.1.100', 'host:port') or base URLs
+        :param workers: Sender threads (each keeps its own keep-alive connections)
+        :param queue_size: Pending triggers; further triggers are dropped while the queue is full
+        :param identity_cooldown: Seconds before the same identity triggers the same device again
+        :param device_cooldown: Minimum seconds between triggers of one device (0 = off)
+        :param timeout: Seconds per attempt
+        :param retries: Extra attempts after a failure
+        :param budget: Total seconds per trigger across all attempts
+        :param on_result: Callable(TriggerResult), called on a sender thread
+        :param metrics: Optional metrics.Metrics for latency and counters
+        """
+        self.path = path
+        self.devices = list(devices)
+        self.identity_cooldown = identity_cooldown
+        self.device_cooldown = device_cooldown
+        self.timeout = timeout
+        self.retries = retries
+        self.budget = budget
+        self.on_result = on_result
+        self.metrics = metrics
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._last_identity = {}  # (identity, device) -> time
+        self._last_device = {}    # device -> time
+        self._local = threading.local()
+        self._threads = [threading.Thread(target=self._worker, name=f"iot-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def set_devices(self, devices):
+        with self._lock:
+            self.devices = list(devices)
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.inc(name)
+
+    def trigger(self, identity, devices=None, force=False):
+        """
+        Queue an unlock for identity on the given devices (default: all).
+        :param force: Ignore cooldowns (e.g. a manual test button)
+        :return: list of (device, state) with state "queued", "cooldown" or "queue_full"
+        """
+        now = time.monotonic()
+        states = []
+        with self._lock:
+            for device in (devices if devices is not None else self.devices):
+                key = (identity, device)
+                if not force and (now - self._last_identity.get(key, -1e9) < self.identity_cooldown
+                                  or now - self._last_device.get(device, -1e9) < self.device_cooldown):
+                    self._count("iot_cooldown_skipped")
+                    states.append((device, "cooldown"))
+                    continue
+                try:
+                    self.queue.put_nowait((identity, device, now))
+                except queue.Full:
+                    self._count("iot_dropped")
+                    states.append((device, "queue_full"))
+                    continue
+                self._last_identity[key] = now
+                self._last_device[device] = now
+                states.append((device, "queued"))
+        return states
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=2, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    def send(self, identity, device, queued_at=None):
+        """Send one trigger with retries inside the time budget. Returns a TriggerResult."""
+        queued_at = queued_at or time.monotonic()
+        deadline = time.monotonic() + self.budget
+        url = device_url(device, self.path)
+        status, error, attempts = None, None, 0
+        while attempts <= self.retries:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                error = error or "time budget exhausted"
+                break
+            attempts += 1
+            try:
+                response = self._session().get(url, params={"id": identity} if identity else None,
+                                               timeout=min(self.timeout, remaining))
+                status = response.status_code
+                if status == 200:
+                    error = None
+                    break
+                error = f"HTTP {status}"
+            except requests.RequestException as e:
+                status, error = None, str(e)
+            if attempts <= self.retries:
+                time.sleep(min(0.1 * 2 ** (attempts - 1), max(0.0, deadline - time.monotonic())))
+
+        latency = (time.monotonic() - queued_at) * 1000
+        result = TriggerResult(identity, device, status == 200 and error is None, status, attempts, latency, error)
+        if self.metrics is not None:
+            self.metrics.observe("iot_request", latency)
+            self._count("iot_sent" if result.ok else "iot_failed")
+        return result
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            result = self.send(*job)
+            if self.on_result:
+                try:
+                    self.on_result(result)
+                except Exception as e:
+                    print(f"[!] IoT result handler: {e}")
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+def serve_fake_device(host="127.0.0.1", port=0, delay_ms=0.0, fail_rate=0.0):
+    """
+    Stand-in for the ESP32 /unlock endpoint (HTTP/1.1 keep-alive) on a daemon thread.
+    :param delay_ms: Simulated processing time per request
+    :param fail_rate: Fraction of requests answered with HTTP 500
+    :return: (httpd, "host:port")
+    """
+    rng = np.random.default_rng()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if not self.path.startswith("/unlock"):
+                self.send_error(404)
+                return
+            if delay_ms:
+                time.sleep(delay_ms / 1000)
+            status, body = (500, b"Error") if rng.random() < fail_rate else (200, b"Unlocked")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="fake-device", daemon=True).start()
+    return httpd, f"{host}:{httpd.server_address[1]}"
+
+
+def measure(devices, triggers=100, workers=2):
+    """
+    End-to-end trigger latency (trigger() -> result callback), one trigger at a time, through the
+    dispatcher vs. a new connection per request (the old behaviour).
+    """
+    results = []
+    received = threading.Semaphore(0)
+
+    def collect(result):
+        results.append(result)
+        received.release()
+
+    dispatcher = IoTDispatcher(devices, workers=workers, identity_cooldown=0.0, on_result=collect)
+    for i in range(triggers):
+        states = dispatcher.trigger(f"person{i}")
+        for _ in states:
+            received.acquire(timeout=10)
+    dispatcher.stop()
+
+    baseline = []
+    for i in range(triggers):
+        start = time.perf_counter()
+        try:
+            requests.get(device_url(devices[i % len(devices)]), timeout=3)
+        except requests.RequestException:
+            pass
+        baseline.append((time.perf_counter() - start) * 1000)
+
+    latencies = np.array([r.latency_ms for r in results]) if results else np.zeros(1)
+    print(f"[*] Dispatcher: {sum(r.ok for r in results)}/{len(results)} ok, "
+          f"p50 {np.percentile(latencies, 50):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+    print(f"[*] New connection per request: p50 {np.percentile(baseline, 50):.2f} ms, "
+          f"p99 {np.percentile(baseline, 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IoT trigger dispatcher latency check")
+    parser.add_argument("--device", action="append", default=[], help="Device host or URL (repeatable)")
+    parser.add_argument("--simulate", action="store_true", help="Start a local stand-in /unlock device")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="Stand-in device processing time")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Stand-in device HTTP 500 rate")
+    parser.add_argument("--triggers", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    devices = list(args.device)
+    if args.simulate or not devices:
+        _, address = serve_fake_device(delay_ms=args.delay_ms, fail_rate=args.fail_rate)
+        print(f"[*] Stand-in device at http://{address}/unlock")
+        devices.append(address)
+    measure(devices, args.triggers, args.workers)
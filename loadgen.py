@@ -0,0 +1,71 @@
+"""
+Load generator for server.py: concurrent clients posting one image, reports p50/p99
+latency and requests per second.
+
+Usage:
+    python loadgen.py --image face.jpg --endpoint identify --concurrency 16 --duration 10
+"""
+import argparse
+import threading
+import time
+import numpy as np
+import requests
+
+
+def run_load(url, image_bytes, concurrency=8, duration=10.0, requests_per_client=None):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()  # keep-alive connection per client
+        sent = 0
+        while time.perf_counter() < deadline and (requests_per_client is None or sent < requests_per_client):
+            start = time.perf_counter()
+            try:
+                response = session.post(url, data=image_bytes, headers={"Content-Type": "image/jpeg"}, timeout=30)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+            sent += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - start
+
+    completed = len(latencies)
+    latencies = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        "requests": completed,
+        "errors": errors[0],
+        "rps": completed / wall if wall > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for the recognition HTTP service")
+    parser.add_argument("--image", required=True, help="JPEG/PNG posted with every request")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", default="identify", choices=["detect", "embed", "identify"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image_bytes = f.read()
+    url = f"{args.url.rstrip('/')}/{args.endpoint}"
+    print(f"[*] {args.concurrency} clients -> {url} for {args.duration:.0f} s")
+    report = run_load(url, image_bytes, args.concurrency, args.duration)
+    print(f"[*] {report['requests']} requests, {report['errors']} errors, {report['rps']:.1f} req/s, "
+          f"p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms")
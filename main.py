@@ -1,103 +1,450 @@
+import copy
 import cv2
 import numpy as np
 import os
 import shutil
+import threading
 from datetime import datetime
+from matching import ExactRows, GalleryMatcher
+from embedding_store import EmbeddingStore
+from face_models import (FaceDetector, model_paths, create_detector, create_recognizer, encode_image,
+                         is_aligned_crop_path)
+from batch_embedder import BatchEmbedder
+from ann_index import IVFIndex
+from sharding import ShardedMatcher
+from templates import TemplateGallery
+from metrics import Metrics
+from inference import apply_threads, load_profile
+import parallel_ingest
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def check_person_name(name):
+    """Raise ValueError unless name can be used as a person folder directly inside known_faces_dir."""
+    if not name or not name.strip():
+        raise ValueError("Name cannot be empty.")
+    if ("/" in name or "\\" in name or "\0" in name or ".." in name or name == "."
+            or os.path.isabs(name) or os.path.splitdrive(name)[0]):
+        raise ValueError(f"Invalid name '{name}': path separators and '..' are not allowed.")
 
 class FaceRecognitionSystem:
-    def __init__(self, known_faces_dir="known_faces", models_dir="models", tolerance=0.36):
+    def __init__(self, known_faces_dir="known_faces", models_dir="models", tolerance=0.36, cache_dir=".face_cache",
+                 workers=1, progress=parallel_ingest.print_progress, embed_batch_size=16,
+                 detection_max_side=None, detection_size=None, ann_index=False, ann_nprobe=8,
+                 ann_min_size=20000, template_mode=False, template_medoids=3, background=False,
+                 gallery_chunk_size=256, gallery_precision="float32", rerank=0,
+                 shards=0, inference=None, cache_read_only=False):
         """
         ระบบจดจำใบหน้า (On-device Face Recognition System using OpenCV YuNet + SFace)
         :param known_faces_dir: Folder containing subfolders of verified users
         :param models_dir: Folder containing onnx models
         :param tolerance: Cosine similarity threshold (lower is more strict, default for SFace is around 0.36)
+        :param cache_dir: Folder for the persistent embedding cache (None disables caching)
+        :param workers: Processes used to encode uncached gallery images (1 = serial, None = CPU count)
+        :param progress: Callable(done, total) reporting gallery encoding progress, or None
+        :param embed_batch_size: Max faces per SFace forward pass in recognize_faces (1 = one pass per face)
+        :param detection_max_side: Downscale frames to this longest side before YuNet (None = full resolution)
+        :param detection_size: Fixed (w, h) YuNet input size for frames (overrides detection_max_side)
+        :param ann_index: Use an approximate (IVF) index for large galleries
+        :param ann_nprobe: IVF cells scanned per query
+        :param ann_min_size: Gallery size below which the exact scan is used
+        :param template_mode: Match against per-identity templates (mean + medoids) instead of every photo
+        :param template_medoids: Medoids kept per identity in template mode
+        :param background: Return immediately and load models / gallery on a background thread
+            (see state, startup_progress, models_ready, ready). Frames give no results until models are loaded.
+        :param gallery_chunk_size: In background mode, publish the gallery after every this many encoded images
+        :param gallery_precision: Matcher storage of the gallery rows: "float32", "float16" or "int8"
+        :param rerank: With float16 / int8, re-score this many top rows per face in float32 (0 = off)
+        :param shards: Search galleries of ann_min_size+ rows on this many worker processes
+            (sharding.ShardedMatcher, 0 = in-process; cannot be combined with ann_index)
+        :param inference: inference.InferenceProfile (DNN backend / target, engine, threads);
+            None = the profile saved by `python inference.py --tune`, else OpenCV defaults
+        :param cache_read_only: Read the embedding cache but never write it, for extra processes
+            sharing cache_dir with the one that owns it
         """
         self.known_faces_dir = known_faces_dir
         self.tolerance = tolerance
-        self.known_encodings = []
         self.known_names = []
+        self.known_paths = []  # image file of each known encoding
+        if shards and ann_index:
+            raise ValueError("ann_index and shards cannot be combined")
+        if shards:
+            self.matcher = ShardedMatcher(shards=shards, min_rows=ann_min_size, precision=gallery_precision,
+                                          rerank=rerank)
+        else:
+            index = IVFIndex(nprobe=ann_nprobe, exact_threshold=ann_min_size) if ann_index else None
+            self.matcher = GalleryMatcher(index=index, precision=gallery_precision, rerank=rerank)
+        self.cache_dir = cache_dir
+        self.cache_read_only = cache_read_only
+        self.templates = TemplateGallery(template_medoids) if template_mode else None
+        # Photo embeddings are not kept beside the matcher rows (see known_encodings), except in
+        # template mode without an embedding cache to read them back from
+        self._encodings = [] if template_mode and not cache_dir else None
+        # Serializes gallery writers; recognition reads the matcher snapshot without locking
+        self.gallery_lock = threading.RLock()
         
-        # Initialize models
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        yunet_path = os.path.join(base_path, models_dir, "face_detection_yunet_2023mar.onnx")
-        sface_path = os.path.join(base_path, models_dir, "face_recognition_sface_2021dec.onnx")
-        
-        if not os.path.exists(yunet_path) or not os.path.exists(sface_path):
-            raise FileNotFoundError("Model files not found. Please run download_models.py first.")
-
-        # YuNet Face Detector
-        self.detector = cv2.FaceDetectorYN.create(
-            model=yunet_path,
-            config="",
-            input_size=(320, 320),
-            score_threshold=0.9,
-            nms_threshold=0.3,
-            top_k=5000
-        )
-        
-        # SFace Face Recognizer
-        self.recognizer = cv2.FaceRecognizerSF.create(
-            model=sface_path,
-            config=""
-        )
-        
-        # Load known faces on initialization
-        self.reload_faces()
+        self.workers = workers
+        self.progress = progress
+
+        # Per-stage latency histograms, counters and gauges (shared with worker clones)
+        self.metrics = Metrics()
+        self.metrics.set_gauge("gallery_embeddings", lambda: len(self.known_names))
+        self.metrics.set_gauge("gallery_rows", lambda: len(self.matcher))
+
+        # Startup state: loading_models -> warming_up -> loading_gallery -> ready (or error)
+        self.state = "loading_models"
+        self.startup_progress = (0, 0)
+        self.startup_error = None
+        self.models_ready = threading.Event()
+        self.ready = threading.Event()
+        self.detector = self.face_detector = self.recognizer = self.embedder = None
+        self.store = None
+        self._saved_centroids = None  # IVF cells last written to (or read from) the cache folder
+        self.inference = inference
+
+        model_args = (models_dir, detection_max_side, detection_size, embed_batch_size)
+        if background:
+            threading.Thread(target=self._startup, args=model_args + (gallery_chunk_size, False),
+                             name="face-startup", daemon=True).start()
+        else:
+            self._startup(*model_args)
+
+    def _startup(self, models_dir, detection_max_side, detection_size, embed_batch_size, chunk_size=None,
+                 raise_errors=True):
+        """Load models, warm them up, then load the known faces (progressively when chunk_size is set)."""
+        try:
+            self.yunet_path, self.sface_path = model_paths(models_dir)
+            self.inference = self.inference or load_profile(models_dir)
+            apply_threads(self.inference)
+            self.detector = create_detector(self.yunet_path, self.inference)
+            self.face_detector = FaceDetector(self.detector, max_side=detection_max_side, input_size=detection_size)
+            self.recognizer = create_recognizer(self.sface_path, self.inference)
+            self.embedder = BatchEmbedder(self.sface_path, self.recognizer, batch_size=embed_batch_size,
+                                          profile=self.inference)
+
+            # Persistent embedding cache, invalidated when either model file changes
+            if self.cache_dir:
+                self.store = EmbeddingStore(self.cache_dir, self.known_faces_dir, [self.yunet_path, self.sface_path],
+                                            read_only=self.cache_read_only)
+
+            self.state = "warming_up"
+            self.warm_up()
+            # State first: edits that see the models ready must also see the gallery loading
+            self.state = "loading_gallery"
+            self.models_ready.set()
+
+            with self.gallery_lock:
+                self.load_known_faces(chunk_size)
+            self.state = "ready"
+        except Exception as e:
+            self.state = "error"
+            self.startup_error = e
+            if raise_errors:
+                raise
+            print(f"[!] Startup failed: {e}")
+        finally:
+            self.ready.set()
+
+    def warm_up(self):
+        """One YuNet and one SFace inference so the first real frame does not pay first-inference cost."""
+        with self.metrics.timer("warm_up"):
+            self.face_detector.detect(np.zeros((480, 640, 3), dtype=np.uint8))
+            crop = np.zeros((112, 112, 3), dtype=np.uint8)
+            self.embedder.embed_crops([crop, crop])
+
+    def wait_ready(self, timeout=None):
+        """Block until background startup finished. Returns True when the system is ready."""
+        self.ready.wait(timeout)
+        return self.state == "ready"
+
+    def _edits_refused(self):
+        """
+        Why gallery edits from the UI are refused right now (None once startup finished), so they
+        fail fast instead of waiting on gallery_lock while background startup loads the gallery.
+        """
+        if self.ready.is_set():
+            return None
+        return "Models are still loading." if not self.models_ready.is_set() else "Gallery is still loading."
 
     def reload_faces(self):
         """Reloads all known faces from the directory."""
-        self.known_encodings = []
-        self.known_names = []
-        self.load_known_faces()
+        with self.gallery_lock:
+            self.load_known_faces()
+
+    @property
+    def known_encodings(self):
+        """
+        Per-photo (1, dim) float32 embeddings in known_paths order, read back on demand: the
+        normalized matcher rows (exact, or dequantized for a compact gallery without re-ranking),
+        in template mode the embedding cache. Keeping a separate list would double gallery memory.
+        """
+        if self._encodings is not None:
+            return self._encodings
+        if self.templates is None:
+            rows = self.matcher.rows()
+            return [rows[i:i + 1] for i in range(len(rows))]
+        return [self._cached_feature(path)[1] for path in self.known_paths]
+
+    def _identity_encodings(self, name):
+        """Photo embeddings of one identity (template updates)."""
+        if self._encodings is not None:
+            return [e for e, n in zip(self._encodings, self.known_names) if n == name]
+        features = [self._cached_feature(p)[1] for p, n in zip(self.known_paths, self.known_names) if n == name]
+        return [f for f in features if f is not None]
+
+    def _append_encodings(self, encodings):
+        if self._encodings is not None:
+            # New list instead of append, readers may be iterating the old one
+            self._encodings = self._encodings + list(encodings)
+
+    def _attach_exact_rows(self):
+        """Re-rank from the memory-mapped embedding cache instead of an in-RAM float32 copy."""
+        if self.store is None or self.templates is not None or not self.matcher.rerank:
+            return
+        found = self.store.rows(self.known_paths)
+        if found is not None:
+            self.matcher.set_exact(ExactRows(*found))
 
-    def load_known_faces(self):
-        """Load images from known_faces directory and encode them."""
+    def _ivf_centroids_path(self):
+        """IVF cells file next to the embedding cache; None without a loaded cache (no model hash)."""
+        if self.store is None or self.store.model_hash is None:
+            return None
+        return os.path.join(self.cache_dir, "ivf_centroids.npz")
+
+    def _load_ivf_centroids(self, path):
+        """Saved IVF cells, or None when missing, unreadable or trained with other models."""
+        try:
+            data = np.load(path)
+            centroids, model_hash = data["centroids"], str(data["model_hash"])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[!] Ignoring unreadable IVF cells: {e}")
+            return None
+        if model_hash != self.store.model_hash or centroids.ndim != 2 or centroids.shape[1] != self.matcher.dim:
+            print("[*] IVF cells were trained on other models, retraining")
+            return None
+        return centroids
+
+    def _rebuild_matcher(self, encodings):
+        """Rebuild the vectorized gallery matrix from the photo embeddings and known_names."""
+        index = self.matcher.index
+        centroids_path = self._ivf_centroids_path()
+        if index is not None and not index.is_trained and centroids_path and os.path.exists(centroids_path):
+            # Reuse the cells trained on a previous run instead of re-running k-means; build()
+            # still retrains them when the gallery has grown or shrunk far from their size
+            centroids = self._load_ivf_centroids(centroids_path)
+            if centroids is not None:
+                self.matcher.set_index_centroids(centroids)
+                self._saved_centroids = self.matcher.index.centroids
+
+        if self._encodings is not None:
+            self._encodings = list(encodings)
+        if self.templates is not None:
+            self.templates.build(encodings, self.known_names)
+            self.matcher.build(*self.templates.rows())
+        else:
+            self.matcher.build(encodings, self.known_names)
+        self._attach_exact_rows()
+
+        index = self.matcher.index
+        if (index is not None and index.is_trained and index.centroids is not self._saved_centroids
+                and centroids_path and not self.cache_read_only):
+            # Keyed by the model hash, so cells of replaced models are never reused
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.savez(centroids_path, centroids=index.centroids, model_hash=self.store.model_hash)
+            self._saved_centroids = index.centroids
+
+    def load_known_faces(self, chunk_size=None):
+        """
+        Load images from known_faces directory and encode them.
+        :param chunk_size: Publish the partial gallery after cached faces and every chunk_size
+            encoded images, so recognition can use it while the rest is encoded
+        """
         print(f"[*] Loading known faces from '{self.known_faces_dir}'...")
         
         if not os.path.exists(self.known_faces_dir):
             os.makedirs(self.known_faces_dir)
+            self.known_names, self.known_paths = [], []
+            self._rebuild_matcher([])
             return
 
-        for entry in os.listdir(self.known_faces_dir):
-            entry_path = os.path.join(self.known_faces_dir, entry)
+        images = self.list_gallery_images()
+        if self.store is not None:
+            cached = self.store.load()
+            print(f"[*] Embedding cache: {cached} entries")
+
+        # Serve unchanged images from the cache, collect the rest for encoding
+        features = {}
+        missing = []
+        for image_path, _ in images:
+            hit, feature = self._cached_feature(image_path)
+            if hit:
+                features[image_path] = feature
+            else:
+                missing.append(image_path)
+        if missing:
+            on_encoded = None
+            if chunk_size:
+                self._publish_partial(images, features)
+                person_names = dict(images)
+                encoded = [0]
+                chunk = []
+
+                def publish_chunk(image_path, feature):
+                    features[image_path] = feature
+                    encoded[0] += 1
+                    if feature is not None:
+                        chunk.append(image_path)
+                    if encoded[0] % chunk_size == 0:
+                        self._publish_partial(images, features, chunk, person_names)
+                        chunk.clear()
+                on_encoded = publish_chunk
+            features.update(self._encode_files(missing, on_encoded))
+
+        encodings, self.known_names, self.known_paths = self._merge_features(images, features)
+        features = None
+
+        if self.store is not None:
+            self.store.prune([path for path, _ in images])
+            self.store.save()
+
+        self._rebuild_matcher(encodings)
+        print(f"[*] Total known faces loaded: {len(self.known_names)} (from {len(set(self.known_names))} unique people)")
+
+    @staticmethod
+    def _merge_features(images, features):
+        """Merge in gallery order so the result does not depend on how images were encoded."""
+        encodings, names, paths = [], [], []
+        for image_path, person_name in images:
+            feature = features.get(image_path)
+            if feature is not None:
+                encodings.append(feature)
+                names.append(person_name)
+                paths.append(image_path)
+        return encodings, names, paths
+
+    def _publish_partial(self, images, features, new_paths=None, person_names=None):
+        """
+        Make the faces encoded so far searchable while the gallery loads: the cached faces first,
+        then only each newly encoded chunk is appended, so every publish costs its chunk. Plain
+        rows in encoding order; templates, exact rows and IVF cells are built for the full
+        gallery, in gallery order, at the end (_rebuild_matcher).
+        :param new_paths: Images encoded since the last publish (None: publish the cached faces)
+        :param person_names: Person name per image path (for new_paths)
+        """
+        if new_paths is None:
+            encodings, self.known_names, self.known_paths = self._merge_features(images, features)
+            self.matcher.build(encodings, self.known_names, train=False)
+            return
+        names = [person_names[path] for path in new_paths]
+        self.matcher.extend([features[path] for path in new_paths], names, train=False)
+        self.known_names.extend(names)
+        self.known_paths.extend(new_paths)
+
+    def list_gallery_images(self):
+        """Return sorted (image_path, person_name) pairs found in known_faces_dir."""
+        images = []
+        for entry in sorted(os.listdir(self.known_faces_dir)):
+            entry_path = self._gallery_path(entry)
             
             if os.path.isdir(entry_path):
                 person_name = entry
-                for image_name in os.listdir(entry_path):
-                    if image_name.lower().endswith((".jpg", ".jpeg", ".png")):
-                        self._process_image(os.path.join(entry_path, image_name), person_name)
+                for image_name in sorted(os.listdir(entry_path)):
+                    if image_name.lower().endswith(IMAGE_EXTENSIONS):
+                        images.append((self._gallery_path(entry, image_name), person_name))
             
-            elif os.path.isfile(entry_path) and entry.lower().endswith((".jpg", ".jpeg", ".png")):
+            elif os.path.isfile(entry_path) and entry.lower().endswith(IMAGE_EXTENSIONS):
                 person_name = os.path.splitext(entry)[0]
-                self._process_image(entry_path, person_name)
+                images.append((entry_path, person_name))
+        return images
 
-        print(f"[*] Total known faces loaded: {len(self.known_names)} (from {len(set(self.known_names))} unique people)")
+    def _gallery_path(self, *parts):
+        """Normalized path inside known_faces_dir, the form used in known_paths."""
+        return os.path.normpath(os.path.join(self.known_faces_dir, *parts))
 
-    def _process_image(self, image_path, name):
-        """Helper to encode a single image file."""
+    def _inside_gallery(self, path):
+        """True when path resolves (symlinks included) to a location inside known_faces_dir."""
+        root = os.path.realpath(self.known_faces_dir)
+        return os.path.commonpath([root, os.path.realpath(path)]) == root and os.path.realpath(path) != root
+
+    def _person_dir(self, name):
+        """Folder of a person in known_faces_dir. Raises ValueError for names that would leave it."""
+        check_person_name(name)
+        person_dir = self._gallery_path(name)
+        if not self._inside_gallery(person_dir):
+            raise ValueError(f"Invalid name '{name}': outside of the known faces folder.")
+        return person_dir
+
+    def person_name(self, image_path):
+        """Identity of a gallery image: its subfolder, or the file name for images at the top level."""
+        parts = os.path.relpath(image_path, self.known_faces_dir).split(os.sep)
+        return parts[0] if len(parts) > 1 else os.path.splitext(parts[0])[0]
+
+    def _cached_feature(self, image_path):
+        """Return (hit, feature) from the embedding cache."""
+        if self.store is None:
+            return False, None
+        try:
+            return self.store.get(image_path)
+        except OSError:
+            return False, None
+
+    def _encode_files(self, image_paths, on_result=None):
+        """
+        Encode image files (in parallel when workers > 1). Returns dict path -> feature or None.
+        :param on_result: Callable(image_path, feature) called as each readable image is encoded
+        """
+        workers = self.workers if self.workers is not None else parallel_ingest.default_workers()
+        if workers > 1 and len(image_paths) > 1:
+            print(f"[*] Encoding {len(image_paths)} images with {workers} worker processes...")
+            results = parallel_ingest.encode_images(image_paths, self.yunet_path, self.sface_path,
+                                                    workers=workers, progress=self._report_progress,
+                                                    on_result=on_result)
+        else:
+            results = {}
+            for done, image_path in enumerate(image_paths, 1):
+                readable, feature = self._process_image(image_path)
+                if readable:
+                    results[image_path] = feature
+                    if on_result:
+                        on_result(image_path, feature)
+                self._report_progress(done, len(image_paths))
+
+        if self.store is not None:
+            for image_path, feature in results.items():
+                try:
+                    self.store.put(image_path, feature)
+                except OSError:
+                    pass
+        return results
+
+    def _report_progress(self, done, total):
+        self.startup_progress = (done, total)
+        if self.progress:
+            self.progress(done, total)
+
+    def _process_image(self, image_path):
+        """Helper to encode a single image file. Returns (readable, feature or None)."""
         try:
             img = cv2.imread(image_path)
-            if img is None: return
+            if img is None: return False, None
             
-            # Update detector input size for high-res images
-            self.detector.setInputSize((img.shape[1], img.shape[0]))
-            _, faces = self.detector.detect(img)
-            
-            if faces is not None:
-                # Use the first face detected
-                face = faces[0]
-                feature = self.recognizer.feature(self.recognizer.alignCrop(img, face))
-                self.known_encodings.append(feature)
-                self.known_names.append(name)
+            return True, encode_image(self.face_detector, self.recognizer, img,
+                                      aligned=is_aligned_crop_path(image_path))
         except Exception as e:
             print(f"[!] Error loading {image_path}: {e}")
+            return False, None
 
     def register_new_face(self, frame, name):
         """Save the frame as a new known face for the given name."""
-        if not name:
-            return False, "Name cannot be empty."
+        try:
+            person_dir = self._person_dir(name)
+        except ValueError as e:
+            return False, str(e)
+        refused = self._edits_refused()
+        if refused:
+            return False, refused
 
-        person_dir = os.path.join(self.known_faces_dir, name)
         if not os.path.exists(person_dir):
             os.makedirs(person_dir)
 
@@ -110,68 +457,316 @@ class FaceRecognitionSystem:
         
         try:
             # Re-process to ensure we have features
-            self.detector.setInputSize((frame.shape[1], frame.shape[0]))
-            _, faces = self.detector.detect(frame)
+            faces = self.face_detector.detect(frame)
             
             if faces is None:
                 os.remove(image_path)
                 return False, "No face detected in the captured image."
 
             feature = self.recognizer.feature(self.recognizer.alignCrop(frame, faces[0]))
-            self.known_encodings.append(feature)
-            self.known_names.append(name)
+            with self.gallery_lock:
+                # New lists instead of append, readers may be iterating the old ones
+                self._append_encodings([feature])
+                self.known_names = self.known_names + [name]
+                self.known_paths = self.known_paths + [image_path]
+                if self.templates is not None:
+                    # Only this identity's templates are recomputed
+                    self.templates.add(feature, name)
+                    self.matcher.build(*self.templates.rows())
+                else:
+                    self.matcher.add(feature, name)
+                if self.store is not None:
+                    self.store.put(image_path, feature)
+                    self.store.save()
+                    self._attach_exact_rows()
             return True, f"Success! {name} registered."
         except Exception as e:
             return False, f"Error encoding face: {e}"
 
+    def detect_faces(self, frame):
+        """Run YuNet on a frame (at the configured detection scale). Returns the (N, 15) face array or None."""
+        if not self.models_ready.is_set():
+            return None  # background startup still loading the models
+        with self.metrics.timer("detect"):
+            return self.face_detector.detect(frame)
+
     def recognize_faces(self, frame):
         """Process a frame and return locations and names."""
-        # Update input size for current frame
-        h, w, _ = frame.shape
-        self.detector.setInputSize((w, h))
-        
-        _, faces = self.detector.detect(frame)
-        
+        return self.recognize_detected(frame, self.detect_faces(frame))
+
+    def recognize_tracked(self, frame, tracker):
+        """
+        Like recognize_faces, but only embeds and matches faces whose track needs it
+        (new track, refresh interval reached or large box change). Others reuse the track identity.
+        :param tracker: tracking.FaceTracker kept by the caller for this video stream
+        """
+        return self.recognize_detected(frame, self.detect_faces(frame), tracker)
+
+    def recognize_gated(self, frame, gate, tracker=None):
+        """
+        Like recognize_faces / recognize_tracked, but skips detection while the motion gate sees
+        a static scene and returns the previous results of that stream instead.
+        :param gate: motion_gate.MotionGate kept by the caller for this video stream
+        """
+        if not self.models_ready.is_set():
+            return [], []
+        version = self.matcher.version
+        if gate.gallery_version != version:
+            # Reused names may refer to removed or renamed people
+            gate.reset()
+            gate.gallery_version = version
+        with self.metrics.timer("motion_gate"):
+            run = gate.should_detect(frame)
+        if not run:
+            self.metrics.inc("detections_skipped")
+            return gate.results
+        results = self.recognize_detected(frame, self.detect_faces(frame), tracker)
+        gate.update_results(results)
+        return results
+
+    def recognize_detected(self, frame, faces, tracker=None):
+        """Embed and match faces already found by detect_faces. Returns (face_locations, face_names)."""
+        # One gallery snapshot per frame, enrollment on another thread swaps in a new one
+        snapshot = self.matcher.snapshot
+        if tracker is not None:
+            if tracker.gallery_version != snapshot.version:
+                # Identities held by tracks may refer to removed or renamed people
+                tracker.reset()
+                tracker.gallery_version = snapshot.version
+            assignments = tracker.update(faces)
+            if faces is None:
+                return [], []
+
+            stale = [i for i, (_, needs) in enumerate(assignments) if needs]
+            if stale:
+                with self.metrics.timer("embed"):
+                    features = self.embedder.embed_faces(frame, faces[stale])
+                for i, match in zip(stale, self.identify(features, snapshot=snapshot)):
+                    tracker.assign(assignments[i][0], match)
+            return self._format_results(faces, [track.name for track, _ in assignments])
+
+        if faces is None:
+            return [], []
+
+        # SFace features for every face in one batch, then one vectorized match against the gallery
+        with self.metrics.timer("embed"):
+            features = self.embedder.embed_faces(frame, faces)
+        return self._format_results(faces, [m.name for m in self.identify(features, snapshot=snapshot)])
+
+    def recognize_batch(self, frames):
+        """
+        Recognize several queued frames, sharing SFace batches and one gallery match across them.
+        :return: list of (face_locations, face_names), one per frame
+        """
+        if not self.models_ready.is_set():
+            return [([], []) for _ in frames]
+        faces_per_frame = [self.detect_faces(frame) for frame in frames]
+        with self.metrics.timer("embed"):
+            features = self.embedder.embed_frames(frames, faces_per_frame)
+        matches = self.identify(np.vstack(features)) if features else []
+
+        results = []
+        start = 0
+        for faces in faces_per_frame:
+            count = len(faces) if faces is not None else 0
+            results.append(self._format_results(faces, [m.name for m in matches[start:start + count]]))
+            start += count
+        return results
+
+    def _format_results(self, faces, names):
         face_locations = []
         face_names = []
-        
-        if faces is not None:
-            for face in faces:
-                # SFace matching
-                feature = self.recognizer.feature(self.recognizer.alignCrop(frame, face))
-                
-                name = "Unknown"
-                max_score = -1
-                best_match_idx = -1
-                
-                for i, known_feature in enumerate(self.known_encodings):
-                    # SFace match returns a similarity score (higher is more similar)
-                    score = self.recognizer.match(feature, known_feature, cv2.FaceRecognizerSF_FR_COSINE)
-                    
-                    if score > self.tolerance and score > max_score:
-                        max_score = score
-                        best_match_idx = i
-                
-                if best_match_idx != -1:
-                    name = self.known_names[best_match_idx]
-                
-                # Convert YuNet box to (top, right, bottom, left) for consistency with old code
-                # YuNet box: [x, y, w, h, ...]
-                x, y, w_box, h_box = map(int, face[:4])
-                face_locations.append((y, x + w_box, y + h_box, x))
-                face_names.append(name)
+        if faces is None:
+            return face_locations, face_names
+
+        for face, name in zip(faces, names):
+            # Convert YuNet box to (top, right, bottom, left) for consistency with old code
+            # YuNet box: [x, y, w, h, ...]
+            x, y, w_box, h_box = map(int, face[:4])
+            face_locations.append((y, x + w_box, y + h_box, x))
+            face_names.append(name)
                 
         return face_locations, face_names
 
+    def identify(self, features, top_k=1, snapshot=None):
+        """
+        Match SFace features against the known faces gallery.
+        :param features: list of (1, 128) features or a (num_faces, 128) array
+        :param top_k: number of candidate identities to return per face
+        :param snapshot: matching.GallerySnapshot taken by the caller (default: the current one)
+        :return: list of matching.FaceMatch (name, score, index, margin, candidates)
+        """
+        with self.metrics.timer("match"):
+            return self.matcher.match(features, self.tolerance, top_k=top_k, snapshot=snapshot)
+
+    def worker_clone(self):
+        """
+        Copy for another recognition thread: own YuNet/SFace instances (OpenCV models are not
+        thread-safe), but the same gallery (matcher, known faces, cache) as this system.
+        Enroll / delete through the original system; clones see its changes via the matcher snapshot.
+        Waits for the models when the system is still starting in the background and raises
+        RuntimeError when startup failed before they were loaded.
+        """
+        # Startup sets ready in any case, so a failed startup cannot leave this waiting forever
+        while not self.models_ready.wait(0.1):
+            if self.ready.is_set():
+                raise RuntimeError(f"Models failed to load: {self.startup_error}")
+        clone = copy.copy(self)
+        clone.detector = create_detector(self.yunet_path, self.inference)
+        clone.face_detector = FaceDetector(clone.detector, max_side=self.face_detector.max_side,
+                                           input_size=self.face_detector.input_size)
+        clone.recognizer = create_recognizer(self.sface_path, self.inference)
+        clone.embedder = BatchEmbedder(self.sface_path, clone.recognizer, batch_size=self.embedder.batch_size,
+                                       profile=self.inference)
+        return clone
+
+    def close(self):
+        """
+        Release the matcher's worker processes and shared gallery files (sharded search) and
+        compact the embedding cache (edits only append to it).
+        Close the original system, not a worker_clone() (clones share its matcher).
+        """
+        close = getattr(self.matcher, "close", None)
+        if close is not None:
+            close()
+        if self.store is not None and self.ready.is_set():
+            with self.gallery_lock:
+                self.store.compact()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
     def get_registered_users(self):
         return sorted(list(set(self.known_names)))
 
+    def add_images(self, image_paths, encoder=None):
+        """
+        Add gallery images that are not loaded yet, without reloading the rest of the gallery.
+        :param image_paths: Image files inside known_faces_dir
+        :param encoder: System whose models encode the images (e.g. a worker_clone() when another
+            thread is recognizing with this system's models); default: this system
+        :return: number of faces added
+        """
+        encoder = encoder or self
+        with self.gallery_lock:
+            known = set(self.known_paths)
+            new = [p for p in dict.fromkeys(os.path.normpath(p) for p in image_paths) if p not in known]
+            outside = [p for p in new if not self._inside_gallery(p)]
+            if outside:
+                print(f"[!] Ignoring {len(outside)} images outside '{self.known_faces_dir}'")
+                new = [p for p in new if p not in set(outside)]
+            features, missing = {}, []
+            for image_path in new:
+                hit, feature = self._cached_feature(image_path)
+                if hit:
+                    features[image_path] = feature
+                elif os.path.isfile(image_path):
+                    missing.append(image_path)
+            if missing:
+                features.update(encoder._encode_files(missing))
+            if self.store is not None:
+                self.store.save()
+
+            added = [p for p in new if features.get(p) is not None]
+            if not added:
+                return 0
+            encodings = [features[p] for p in added]
+            names = [self.person_name(p) for p in added]
+            self._append_encodings(encodings)
+            self.known_names = self.known_names + names
+            self.known_paths = self.known_paths + added
+            if self.templates is not None:
+                for feature, name in zip(encodings, names):
+                    self.templates.add(feature, name)
+                self.matcher.build(*self.templates.rows())
+            else:
+                self.matcher.extend(encodings, names)
+                self._attach_exact_rows()
+            return len(added)
+
+    def remove_images(self, image_paths):
+        """
+        Drop gallery images (files or whole person folders) from memory and the embedding cache.
+        The files themselves are not touched. Returns the number of faces removed.
+        """
+        paths = [os.path.normpath(p) for p in image_paths]
+        prefixes = tuple(p + os.sep for p in paths)
+        with self.gallery_lock:
+            if self.store is not None:
+                self.store.remove(paths)
+                self.store.save()
+            dropped = set(paths)
+            rows = [i for i, p in enumerate(self.known_paths) if p in dropped or p.startswith(prefixes)]
+            if not rows:
+                return 0
+
+            keep = np.ones(len(self.known_paths), dtype=bool)
+            keep[rows] = False
+            changed = {self.known_names[i] for i in rows}
+            if self._encodings is not None:
+                self._encodings = [e for e, k in zip(self._encodings, keep) if k]
+            self.known_names = [n for n, k in zip(self.known_names, keep) if k]
+            self.known_paths = [p for p, k in zip(self.known_paths, keep) if k]
+            if self.templates is not None:
+                # Only the identities that lost photos are recomputed
+                for name in changed:
+                    self.templates.update(name, self._identity_encodings(name))
+                self.matcher.build(*self.templates.rows())
+            else:
+                self.matcher.remove(rows)
+                self._attach_exact_rows()
+            return len(rows)
+
+    def rename_user(self, old_name, new_name):
+        """Rename a person's folder and relabel their embeddings (nothing is re-encoded)."""
+        try:
+            old_dir, new_dir = self._person_dir(old_name), self._person_dir(new_name)
+        except ValueError as e:
+            return False, str(e)
+        refused = self._edits_refused()
+        if refused:
+            return False, refused
+        with self.gallery_lock:
+            if not os.path.isdir(old_dir):
+                return False, f"{old_name} not found."
+            if os.path.exists(new_dir):
+                return False, f"{new_name} already exists."
+            os.rename(old_dir, new_dir)
+
+            prefix = old_dir + os.sep
+            self.known_paths = [os.path.join(new_dir, p[len(prefix):]) if p.startswith(prefix) else p
+                                for p in self.known_paths]
+            self.known_names = [new_name if n == old_name else n for n in self.known_names]
+            if self.templates is not None:
+                self.templates.rename(old_name, new_name)
+                self.matcher.build(*self.templates.rows())
+            else:
+                self.matcher.rename(old_name, new_name)
+            if self.store is not None:
+                self.store.move(old_dir, new_dir)
+                self.store.save()
+                self._attach_exact_rows()
+            return True, f"{old_name} renamed to {new_name}."
+
     def delete_user(self, name):
-        person_dir = os.path.join(self.known_faces_dir, name)
-        if os.path.exists(person_dir):
-            shutil.rmtree(person_dir)
-            self.reload_faces()
-            return True
+        try:
+            person_dir = self._person_dir(name)
+        except ValueError as e:
+            print(f"[!] {e}")
+            return False
+        refused = self._edits_refused()
+        if refused:
+            print(f"[!] Cannot delete {name}: {refused}")
+            return False
+        with self.gallery_lock:
+            if os.path.exists(person_dir):
+                shutil.rmtree(person_dir)
+                # Drop only this person's rows instead of reloading the whole gallery
+                self.remove_images([person_dir])
+                return True
         return False
 
 def run_legacy_cli_mode():
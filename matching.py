@@ -0,0 +1,441 @@
+import threading
+import numpy as np
+from collections import namedtuple
+
+# Result for one query face.
+# name: best matching identity ("Unknown" if the best score is not above tolerance)
+# score: best cosine score over the whole gallery
+# index: gallery row of the best score (-1 if the gallery is empty)
+# margin: best identity score minus runner-up identity score (None if there is no runner-up)
+# candidates: top-k (name, score) pairs, one per identity, best first
+FaceMatch = namedtuple("FaceMatch", ["name", "score", "index", "margin", "candidates"])
+
+# Immutable gallery state published by GalleryMatcher. Writers build a new snapshot and
+# swap it in; readers take one reference per frame and never see a half-updated gallery.
+# matrix: read-only normalized (N, dim) rows in the matcher precision (float32, float16 or int8 codes)
+# labels: tuple of N names; identities: sorted unique names; label_ids: row -> identity number
+# order / starts: column order grouping rows by identity and the group starts (per-identity max)
+# index: ann_index.IVFIndex over the rows or None (not modified after publishing)
+# version: increases with every published change
+# scales: per-row float32 scales of int8 codes (None otherwise)
+# exact: float32 rows for re-ranking quantized scores: an in-RAM array, an ExactRows view of the
+#        memory-mapped embedding cache, or None without re-ranking
+# row_ids: increasing index id of each row (None without an index). Ids do not shift when rows
+#          are removed, so a delete only drops its own ids from the index
+GallerySnapshot = namedtuple("GallerySnapshot", ["matrix", "labels", "identities", "label_ids",
+                                                 "order", "starts", "index", "version", "scales", "exact",
+                                                 "row_ids"])
+
+PRECISIONS = ("float32", "float16", "int8")
+# Stored rows widened to float32 per block while scoring (bounds the temporary copy)
+SCORE_BLOCK = 2048
+
+
+def normalize_rows(features):
+    """L2-normalize each row (same normalization FaceRecognizerSF.match applies)."""
+    features = np.asarray(features, dtype=np.float32)
+    if features.ndim == 1:
+        features = features.reshape(1, -1)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return features / norms
+
+
+def quantize_rows(rows, precision):
+    """
+    Normalized float32 rows -> (stored rows, per-row scales).
+    int8 is symmetric scalar quantization with one scale per row (max |value| maps to 127).
+    """
+    if precision == "float32":
+        return rows, None
+    if precision == "float16":
+        return rows.astype(np.float16), None
+    scales = np.abs(rows).max(axis=1) / 127.0 if len(rows) else np.empty(0, dtype=np.float32)
+    scales[scales == 0] = 1.0
+    codes = np.rint(rows / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_rows(matrix, scales=None):
+    """Stored rows -> float32 rows (no copy for float32)."""
+    rows = np.asarray(matrix, dtype=np.float32)
+    if scales is not None:
+        rows = rows * scales[:, None]
+    return rows
+
+
+def quantized_scores(queries, matrix, scales=None, block=SCORE_BLOCK):
+    """
+    Scores (num_queries, N) of normalized float32 queries against stored rows.
+    NumPy has no BLAS path for float16 / int8 products, so compact rows are widened to
+    float32 one block at a time and multiplied with BLAS; the int8 scales are applied last.
+    """
+    if matrix.dtype == np.float32:
+        return queries @ matrix.T
+    out = np.empty((len(matrix), len(queries)), dtype=np.float32)
+    buffer = np.empty((min(block, len(matrix)), matrix.shape[1]), dtype=np.float32)
+    for start in range(0, len(matrix), block):
+        rows = buffer[:min(block, len(matrix) - start)]
+        np.copyto(rows, matrix[start:start + block], casting="unsafe")
+        np.matmul(rows, queries.T, out=out[start:start + len(rows)])
+    if scales is not None:
+        out *= scales[:, None]
+    return out.T
+
+
+class ExactRows:
+    """
+    Float32 re-ranking rows read on demand from a memory-mapped matrix (the embedding cache)
+    instead of an in-RAM copy; only the rows a query re-ranks are paged in.
+    ids[i] is the source row of gallery row i. Rows added since the source was written are
+    held in `extra` and referenced by ids -1, -2, ...
+    """
+
+    def __init__(self, source, ids, extra=None):
+        self.source = source
+        self.ids = _frozen(np.array(ids, dtype=np.int64))
+        self.extra = extra if extra is not None else np.empty((0, source.shape[1]), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Memory held in RAM (the source pages are file-backed)."""
+        return self.ids.nbytes + self.extra.nbytes
+
+    def __getitem__(self, rows):
+        """Normalized float32 rows for an array of gallery row numbers (any shape)."""
+        rows = np.asarray(rows)
+        ids = self.ids[rows.ravel()]
+        out = np.empty((len(ids), self.source.shape[1]), dtype=np.float32)
+        stored = ids >= 0
+        out[stored] = self.source[ids[stored]]
+        out[~stored] = self.extra[-ids[~stored] - 1]
+        return normalize_rows(out).reshape(rows.shape + (out.shape[1],))
+
+    def append(self, rows):
+        """New view with normalized float32 rows appended (kept in RAM until the source is rewritten)."""
+        ids = -np.arange(len(self.extra), len(self.extra) + len(rows), dtype=np.int64) - 1
+        return ExactRows(self.source, np.concatenate([self.ids, ids]), np.vstack([self.extra, rows]))
+
+    def take(self, keep):
+        """New view with only the kept gallery rows (boolean mask or row numbers)."""
+        return ExactRows(self.source, self.ids[keep], self.extra)
+
+
+def _top_indices(values, k):
+    """Indices of the k largest values, best first."""
+    if k < len(values):
+        part = np.argpartition(-values, k - 1)[:k]
+        return part[np.argsort(-values[part], kind="stable")]
+    return np.argsort(-values, kind="stable")
+
+
+class GalleryMatcher:
+    """
+    Vectorized cosine matcher for the known faces gallery.
+    The gallery is kept as one contiguous, pre-normalized matrix so all faces
+    in a frame are scored with a single matrix product instead of one
+    FaceRecognizerSF.match call per (face, known embedding) pair.
+    With an ANN index (ann_index.IVFIndex) large galleries only score the candidate rows
+    returned by the index; small galleries keep the exact scan.
+    Updates are copy-on-write (see GallerySnapshot): match() needs no lock and may run on
+    several threads while build() / add() run on another.
+    The exact scan can store the rows as float16 or int8 (with per-row scales) to cut
+    memory and bandwidth; the top `rerank` rows per query are then re-scored in float32.
+    """
+
+    def __init__(self, dim=128, index=None, candidates=64, precision="float32", rerank=0):
+        """
+        :param index: Optional ann_index.IVFIndex over the gallery rows
+        :param candidates: Rows fetched from the index per query before the per-identity reduction
+        :param precision: Storage of the gallery rows: "float32", "float16" or "int8"
+        :param rerank: Rows per query re-scored with float32 rows (0 = off). The rows are an in-RAM
+            float32 copy unless set_exact() attaches memory-mapped rows (see ExactRows)
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+        self.dim = dim
+        self.candidates = candidates
+        self.precision = precision
+        self.rerank = rerank if precision != "float32" else 0
+        self._write_lock = threading.Lock()
+        empty = np.empty(0, dtype=np.int64)
+        matrix, scales, exact = self._encode(np.empty((0, dim), dtype=np.float32))
+        self.snapshot = GallerySnapshot(_frozen(matrix), (), (), empty, empty, empty, index, 0,
+                                        _frozen(scales) if scales is not None else None,
+                                        _frozen(exact) if exact is not None else None,
+                                        empty if index is not None else None)
+
+    def __len__(self):
+        return len(self.snapshot.labels)
+
+    # Read-only views of the current snapshot
+    @property
+    def matrix(self):
+        return self.snapshot.matrix
+
+    @property
+    def labels(self):
+        return self.snapshot.labels
+
+    @property
+    def identities(self):
+        return self.snapshot.identities
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def nbytes(self):
+        """Memory of the stored rows, scales and re-ranking copy (index not included)."""
+        snap = self.snapshot
+        return sum(a.nbytes for a in (snap.matrix, snap.scales, snap.exact) if a is not None)
+
+    def _encode(self, rows):
+        """Normalized float32 rows -> (stored rows, scales, exact rows) for this precision."""
+        matrix, scales = quantize_rows(rows, self.precision)
+        return matrix, scales, rows if self.rerank else None
+
+    def rows(self, snapshot=None):
+        """Normalized float32 gallery rows of a snapshot (dequantized when no exact rows are kept)."""
+        snap = snapshot or self.snapshot
+        return _float_rows(snap.matrix, snap.scales, snap.exact)
+
+    def build(self, encodings, names, train=True):
+        """
+        Replace the gallery with the given embeddings (list of (1, dim) arrays) and names.
+        :param train: (Re)train the index cells when needed (see _maybe_train); False for
+            partial galleries, whose cells would not fit the full gallery
+        """
+        if len(encodings):
+            rows = normalize_rows(np.vstack([np.asarray(e, dtype=np.float32).reshape(1, -1) for e in encodings]))
+        else:
+            rows = np.empty((0, self.dim), dtype=np.float32)
+        with self._write_lock:
+            index = self.snapshot.index
+            row_ids = None
+            if index is not None:
+                index = index.copy()
+                index.clear()
+                row_ids = np.arange(len(rows))
+                if len(rows):
+                    index.add(row_ids, rows)
+                    if train:
+                        _maybe_train(index, rows)
+            self._publish(*self._encode(rows), tuple(names), index, row_ids)
+
+    def add(self, encoding, name):
+        """Append a single embedding to the gallery."""
+        self.extend([encoding], [name])
+
+    def extend(self, encodings, names, train=True):
+        """Append embeddings to the gallery; the index is updated incrementally (see build for train)."""
+        if not len(encodings):
+            return
+        rows = normalize_rows(np.vstack([np.asarray(e, dtype=np.float32).reshape(1, -1) for e in encodings]))
+        with self._write_lock:
+            current = self.snapshot
+            matrix, scales, exact = self._encode(rows)
+            matrix, scales = self._append_rows(current, matrix, scales)
+            if isinstance(current.exact, ExactRows):
+                exact = current.exact.append(rows)
+            elif exact is not None:
+                exact = np.vstack([current.exact, exact])
+            index, row_ids = current.index, None
+            if index is not None:
+                index = index.copy()
+                next_id = int(current.row_ids[-1]) + 1 if len(current.row_ids) else 0
+                new_ids = np.arange(next_id, next_id + len(rows))
+                index.add(new_ids, rows)
+                row_ids = np.concatenate([current.row_ids, new_ids])
+                if train:
+                    _maybe_train(index, matrix, scales)
+            self._publish(matrix, scales, exact, current.labels + tuple(names), index, row_ids)
+
+    def _append_rows(self, current, matrix, scales):
+        """Stored rows and scales of the current snapshot followed by the new ones."""
+        return (np.vstack([current.matrix, matrix]),
+                np.concatenate([current.scales, scales]) if scales is not None else None)
+
+    def remove(self, rows):
+        """Drop gallery rows (row numbers of the current snapshot)."""
+        with self._write_lock:
+            current = self.snapshot
+            keep = np.ones(len(current.labels), dtype=bool)
+            keep[np.asarray(list(rows), dtype=np.int64)] = False
+            if keep.all():
+                return
+            matrix = current.matrix[keep]
+            scales = current.scales[keep] if current.scales is not None else None
+            exact = current.exact
+            if exact is not None:
+                exact = exact.take(keep) if isinstance(exact, ExactRows) else exact[keep]
+            labels = tuple(label for label, kept in zip(current.labels, keep) if kept)
+            index, row_ids = current.index, None
+            if index is not None:
+                # Only the removed ids leave the index; the other rows keep theirs
+                index = index.copy()
+                index.remove(current.row_ids[~keep])
+                row_ids = current.row_ids[keep]
+            self._publish(matrix, scales, exact, labels, index, row_ids)
+
+    def rename(self, old_name, new_name):
+        """Relabel an identity; embeddings and index are shared with the previous snapshot."""
+        with self._write_lock:
+            current = self.snapshot
+            labels = tuple(new_name if label == old_name else label for label in current.labels)
+            self._publish(current.matrix, current.scales, current.exact, labels, current.index, current.row_ids)
+
+    def set_exact(self, exact):
+        """
+        Publish the current rows with other float32 re-ranking rows for the same gallery rows,
+        e.g. an ExactRows view of the embedding cache replacing the in-RAM copy.
+        """
+        with self._write_lock:
+            current = self.snapshot
+            if not self.rerank or len(exact) != len(current.labels):
+                return False
+            self._publish(current.matrix, current.scales, exact, current.labels, current.index, current.row_ids)
+            return True
+
+    def set_index_centroids(self, centroids):
+        """Publish the current rows with pre-trained IVF cells (e.g. loaded from disk)."""
+        with self._write_lock:
+            current = self.snapshot
+            if current.index is None:
+                return
+            index = current.index.copy()
+            index.set_centroids(centroids)
+            self._publish(current.matrix, current.scales, current.exact, current.labels, index, current.row_ids)
+
+    def _publish(self, matrix, scales, exact, labels, index, row_ids):
+        """Build the derived arrays for new rows and swap the snapshot in (caller holds the write lock)."""
+        identities = tuple(sorted(set(labels)))
+        lookup = {name: i for i, name in enumerate(identities)}
+        label_ids = np.array([lookup[n] for n in labels], dtype=np.int64)
+
+        # Column order grouping rows by identity, used for the per-identity max
+        order = np.argsort(label_ids, kind="stable")
+        sorted_ids = label_ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if len(sorted_ids) else sorted_ids
+
+        if exact is not None and not isinstance(exact, ExactRows):
+            exact = _frozen(np.ascontiguousarray(exact))
+        self.snapshot = GallerySnapshot(_frozen(np.ascontiguousarray(matrix)), labels, identities,
+                                        _frozen(label_ids), _frozen(order), _frozen(starts), index,
+                                        self.snapshot.version + 1,
+                                        _frozen(scales) if scales is not None else None, exact,
+                                        _frozen(row_ids) if row_ids is not None else None)
+
+    def scores(self, features, snapshot=None):
+        """Cosine scores of shape (num_faces, gallery_size), in the stored precision (no re-ranking)."""
+        snapshot = snapshot or self.snapshot
+        return quantized_scores(normalize_rows(features), snapshot.matrix, snapshot.scales)
+
+    def match(self, features, tolerance, top_k=1, snapshot=None):
+        """
+        Match every query embedding against the gallery.
+        :param features: (num_faces, dim) array or list of (1, dim) SFace features
+        :param tolerance: cosine threshold, a match needs score > tolerance
+        :param top_k: number of identities returned in FaceMatch.candidates
+        :param snapshot: GallerySnapshot to match against (default: the current one)
+        :return: list of FaceMatch, one per query
+        """
+        snap = snapshot or self.snapshot
+        if isinstance(features, (list, tuple)):
+            if not features:
+                return []
+            features = np.vstack([np.asarray(f, dtype=np.float32).reshape(1, -1) for f in features])
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.dim)
+        if not len(features):
+            return []
+        if not len(snap.labels):
+            return [FaceMatch("Unknown", -1.0, -1, None, []) for _ in range(len(features))]
+
+        if _use_index(snap.index):
+            return self._match_index(snap, features, tolerance, top_k)
+        return self._match_exact(snap, features, tolerance, top_k)
+
+    def _match_exact(self, snap, features, tolerance, top_k):
+        """Exact scan: every gallery row is scored, then reduced per identity."""
+        scores = self.scores(features, snap)
+        if snap.exact is not None:
+            self._rerank(snap, features, scores)
+        best_idx = np.argmax(scores, axis=1)  # first maximum, same tie-break as the old loop
+        per_identity = np.maximum.reduceat(scores[:, snap.order], snap.starts, axis=1)
+
+        k = max(1, min(top_k, per_identity.shape[1]))
+        results = []
+        for row, idx in enumerate(best_idx):
+            best_score = float(scores[row, idx])
+            ranked = _top_indices(per_identity[row], max(k, 2))
+            candidates = [(snap.identities[i], float(per_identity[row, i])) for i in ranked[:k]]
+            margin = None
+            if len(ranked) > 1:
+                margin = float(per_identity[row, ranked[0]] - per_identity[row, ranked[1]])
+            name = snap.labels[idx] if best_score > tolerance else "Unknown"
+            results.append(FaceMatch(name, best_score, int(idx), margin, candidates))
+        return results
+
+    def _rerank(self, snap, features, scores):
+        """Replace the quantized scores of the top rerank rows per query with float32 scores (in place)."""
+        k = min(self.rerank, scores.shape[1])
+        rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        exact = np.einsum("qd,qkd->qk", normalize_rows(features), snap.exact[rows])
+        np.put_along_axis(scores, rows, exact, axis=1)
+
+    def _match_index(self, snap, features, tolerance, top_k):
+        """Approximate match: per-identity reduction over the candidate rows returned by the index."""
+        cand_scores, cand_ids = snap.index.search(features, max(self.candidates, top_k))
+        # row_ids is increasing, so the row of an id is its position (id -1 = no candidate)
+        cand_rows = np.where(cand_ids >= 0, np.searchsorted(snap.row_ids, cand_ids), -1)
+        return self._match_candidates(snap, cand_scores, cand_rows, tolerance, top_k)
+
+    def _match_candidates(self, snap, cand_scores, cand_rows, tolerance, top_k):
+        """FaceMatch per query from (num_queries, k) candidate scores / rows sorted best first (row -1 = none)."""
+        results = []
+        for scores, rows in zip(cand_scores, cand_rows):
+            valid = rows >= 0
+            scores, rows = scores[valid], rows[valid]
+            if not len(rows):
+                results.append(FaceMatch("Unknown", -1.0, -1, None, []))
+                continue
+
+            # Candidates come sorted best first, so the first row of each identity is its best
+            per_identity = {}
+            for score, row in zip(scores, rows):
+                per_identity.setdefault(snap.labels[row], float(score))
+            ranked = list(per_identity.items())
+            best_score, best_row = float(scores[0]), int(rows[0])
+            margin = ranked[0][1] - ranked[1][1] if len(ranked) > 1 else None
+            name = snap.labels[best_row] if best_score > tolerance else "Unknown"
+            results.append(FaceMatch(name, best_score, best_row, margin, ranked[:max(1, top_k)]))
+        return results
+
+
+def _frozen(array):
+    array.flags.writeable = False
+    return array
+
+
+def _float_rows(matrix, scales, exact):
+    if isinstance(exact, ExactRows):
+        return exact[np.arange(len(exact))]
+    return exact if exact is not None else dequantize_rows(matrix, scales)
+
+
+def _maybe_train(index, matrix, scales=None):
+    """Train the cells once the index is large enough, and again when the gallery outgrew them."""
+    if len(index) >= index.exact_threshold and (not index.is_trained or index.is_stale()):
+        index.train(dequantize_rows(matrix, scales))
+
+
+def _use_index(index):
+    return index is not None and index.is_trained and len(index) >= index.exact_threshold
@@ -0,0 +1,160 @@
+"""
+Lightweight in-process metrics: per-stage latency histograms, counters and gauges.
+Readable from Python (Metrics.snapshot) or as Prometheus text (Metrics.prometheus_text,
+optionally served over HTTP with start_metrics_server).
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Latency buckets in milliseconds
+DEFAULT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram:
+    """Cumulative bucket histogram plus a window of recent values for percentiles."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1000):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            i = 0
+            while i < len(self.buckets) and value > self.buckets[i]:
+                i += 1
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            self.recent.append(value)
+
+    def summary(self):
+        with self._lock:
+            recent = np.array(self.recent) if self.recent else None
+            return {
+                "count": self.count,
+                "mean_ms": self.sum / self.count if self.count else 0.0,
+                "p50_ms": float(np.percentile(recent, 50)) if recent is not None else 0.0,
+                "p95_ms": float(np.percentile(recent, 95)) if recent is not None else 0.0,
+                "last_ms": float(recent[-1]) if recent is not None else 0.0,
+            }
+
+
+class Metrics:
+    """Registry of stage histograms (ms), counters and gauges (values or callables)."""
+
+    def __init__(self, prefix="face"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, ms):
+        hist = self.histograms.get(stage)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(stage, Histogram())
+        hist.observe(ms)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """value may be a number or a callable evaluated on read."""
+        with self._lock:
+            self.gauges[name] = value
+
+    def _gauge_values(self):
+        values = {}
+        for name, value in list(self.gauges.items()):
+            try:
+                values[name] = float(value() if callable(value) else value)
+            except Exception:
+                continue
+        return values
+
+    def snapshot(self):
+        """Plain dict with stage latency summaries, counters and gauges."""
+        return {
+            "stages": {name: hist.summary() for name, hist in list(self.histograms.items())},
+            "counters": dict(self.counters),
+            "gauges": self._gauge_values(),
+        }
+
+    def prometheus_text(self):
+        metric = f"{self.prefix}_stage_latency_ms"
+        lines = [f"# TYPE {metric} histogram"] if self.histograms else []
+        for name, hist in sorted(self.histograms.items()):
+            cumulative = 0
+            with hist._lock:
+                counts, total, count = list(hist.counts), hist.sum, hist.count
+            for bound, n in zip(hist.buckets, counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {total}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+            lines.append(f"{self.prefix}_{name}_total {value}")
+        for name, value in sorted(self._gauge_values().items()):
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(metrics, port=9100, host="127.0.0.1"):
+    """Serve Prometheus text at http://host:port/metrics from a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-server", daemon=True).start()
+    return httpd
+
+
+class FpsCounter:
+    """Frames per second over a sliding window of timestamps."""
+
+    def __init__(self, window=30):
+        self.times = deque(maxlen=window)
+
+    def tick(self):
+        self.times.append(time.perf_counter())
+
+    @property
+    def fps(self):
+        if len(self.times) < 2:
+            return 0.0
+        span = self.times[-1] - self.times[0]
+        return (len(self.times) - 1) / span if span > 0 else 0.0
@@ -0,0 +1,175 @@
+"""
+Motion gate in front of face detection.
+
+Each frame is reduced to a small blurred grayscale image and compared with the image of the
+last frame that was actually detected. If less than `sensitivity` of the pixels (inside the
+optional regions of interest) changed, detection is skipped and the previous results are
+reused. Detection still runs at least every `max_skip` seconds, so a person standing still
+is re-checked and slow lighting changes do not keep stale results forever.
+
+Usage (how many detections a recording would avoid):
+    python motion_gate.py corridor.mp4 --sensitivity 0.01 --max-skip 2
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+
+
+def parse_roi(text):
+    """'x,y,w,h' (pixels of the full frame) -> tuple of ints."""
+    values = [int(v) for v in text.split(",")]
+    if len(values) != 4:
+        raise ValueError(f"ROI must be x,y,w,h, got '{text}'")
+    return tuple(values)
+
+
+class MotionGate:
+    """
+    Decides per frame whether detection needs to run. Keep one gate per video stream,
+    like tracking.FaceTracker; it also holds the last results of that stream.
+    """
+
+    def __init__(self, sensitivity=0.01, pixel_threshold=25, max_skip=2.0, width=160, rois=None):
+        """
+        :param sensitivity: Fraction of (ROI) pixels that must change to count as motion
+        :param pixel_threshold: Gray level difference for a pixel to count as changed
+        :param max_skip: Max seconds between two detections, even without motion (None = no limit)
+        :param width: Width of the downscaled comparison image
+        :param rois: Optional list of (x, y, w, h) in full-frame pixels; motion elsewhere is ignored
+        """
+        self.sensitivity = sensitivity
+        self.pixel_threshold = pixel_threshold
+        self.max_skip = max_skip
+        self.width = width
+        self.rois = list(rois or [])
+        self.results = ([], [])
+        self.gallery_version = None  # results are only reused for the gallery they were matched against
+        self.motion = 0.0        # changed fraction of the last checked frame
+        self.frames = 0
+        self.detections = 0
+        self.skipped = 0
+        self._reference = None   # small image of the last detected frame
+        self._mask = None
+        self._frame_shape = None
+        self._last_detect = None
+
+    def _small(self, frame):
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.width / w)
+        small = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def _build_mask(self, frame_shape, small_shape):
+        if not self.rois:
+            return None
+        sy, sx = small_shape[0] / frame_shape[0], small_shape[1] / frame_shape[1]
+        mask = np.zeros(small_shape, dtype=bool)
+        for x, y, w, h in self.rois:
+            mask[int(y * sy):int(np.ceil((y + h) * sy)), int(x * sx):int(np.ceil((x + w) * sx))] = True
+        return mask
+
+    def changed_fraction(self, small):
+        diff = cv2.absdiff(small, self._reference) > self.pixel_threshold
+        if self._mask is not None:
+            return float(diff[self._mask].mean()) if self._mask.any() else 0.0
+        return float(diff.mean())
+
+    def should_detect(self, frame, now=None):
+        """
+        Check one frame. Returns True when detection should run; the caller then stores the
+        new results with update_results(). Otherwise self.results are still valid.
+        :param now: Timestamp in seconds (default: time.monotonic(); pass video time for files)
+        """
+        now = time.monotonic() if now is None else now
+        self.frames += 1
+        small = self._small(frame)
+        if self._reference is None or frame.shape[:2] != self._frame_shape:
+            self._frame_shape = frame.shape[:2]
+            self._mask = self._build_mask(self._frame_shape, small.shape)
+            self.motion = 1.0
+        else:
+            self.motion = self.changed_fraction(small)
+
+        if self.motion < self.sensitivity and (self.max_skip is None or now - self._last_detect < self.max_skip):
+            self.skipped += 1
+            return False
+        self._reference = small
+        self._last_detect = now
+        self.detections += 1
+        return True
+
+    def update_results(self, results):
+        self.results = results
+
+    def reset(self):
+        """Force detection on the next frame (e.g. after the gallery changed)."""
+        self._reference = None
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "detections": self.detections,
+            "skipped": self.skipped,
+            "skip_rate": self.skipped / self.frames if self.frames else 0.0,
+            "motion": self.motion,
+        }
+
+
+def replay(video_path, gate, detect=None):
+    """
+    Run a gate over a video file using its own timestamps.
+    :param detect: Optional callable(frame) run whenever the gate lets a frame through
+    :return: (gate stats, seconds spent in the gate, seconds spent in detect)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video '{video_path}'")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    gate_time = detect_time = 0.0
+    index = 0
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok: break
+            start = time.perf_counter()
+            run = gate.should_detect(frame, now=index / fps)
+            gate_time += time.perf_counter() - start
+            if run and detect is not None:
+                start = time.perf_counter()
+                detect(frame)
+                detect_time += time.perf_counter() - start
+            index += 1
+    finally:
+        cap.release()
+    return gate.stats(), gate_time, detect_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how many detections the motion gate avoids on a video")
+    parser.add_argument("video")
+    parser.add_argument("--sensitivity", type=float, default=0.01, help="Changed pixel fraction that counts as motion")
+    parser.add_argument("--pixel-threshold", type=int, default=25)
+    parser.add_argument("--max-skip", type=float, default=2.0, help="Max seconds between detections (0 = no limit)")
+    parser.add_argument("--roi", action="append", type=parse_roi, default=[], help="x,y,w,h (repeatable)")
+    parser.add_argument("--detect", action="store_true", help="Also run YuNet on gated frames to time it")
+    parser.add_argument("--models", default="models")
+    args = parser.parse_args()
+
+    detect = None
+    if args.detect:
+        from face_models import FaceDetector, create_detector, model_paths
+        detect = FaceDetector(create_detector(model_paths(args.models)[0])).detect
+    gate = MotionGate(args.sensitivity, args.pixel_threshold, args.max_skip or None, rois=args.roi)
+    stats, gate_time, detect_time = replay(args.video, gate, detect)
+    frames = max(stats["frames"], 1)
+    print(f"[*] {stats['frames']} frames: {stats['detections']} detections, {stats['skipped']} skipped "
+          f"({stats['skip_rate']:.0%} avoided)")
+    print(f"    gate {gate_time / frames * 1000:.2f} ms/frame")
+    if detect is not None and stats["detections"]:
+        per_detect = detect_time / stats["detections"]
+        print(f"    detect {per_detect * 1000:.2f} ms/frame when run; "
+              f"{(gate_time + detect_time) / frames * 1000:.2f} ms/frame gated vs "
+              f"{per_detect * 1000:.2f} ms/frame ungated")
@@ -0,0 +1,215 @@
+"""
+Multi-camera scheduler: N camera / file streams share one gallery and a fixed pool
+of detector/recognizer workers.
+
+Each stream keeps only its latest frame (older ones are counted as dropped), is capped
+to its own frame rate, and has at most one frame in flight so its tracker stays
+consistent. Free workers pick the next stream round-robin ("fair") or by priority.
+
+Usage:
+    python multi_camera.py --source 0 --source 1 --workers 2 --max-fps 10
+    python multi_camera.py --source door_a.mp4 --source door_b.mp4 --policy priority --priority 1 0
+"""
+import argparse
+import threading
+import time
+from collections import deque
+import numpy as np
+from pipeline import FrameResult, open_source
+from tracking import FaceTracker
+
+SCHEDULING = ("fair", "priority")
+
+
+class StreamState:
+    def __init__(self, stream_id, source, priority=0, max_fps=None, tracking=True, latency_window=500):
+        self.id = stream_id
+        self.source = source
+        self.priority = priority
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.tracker = FaceTracker() if tracking else None
+
+        self.pending = None        # (seq, capture time, frame), latest frame only
+        self.in_flight = False
+        self.finished = False
+        self.last_accept = 0.0
+        self.last_served = 0.0
+
+        self.captured = 0
+        self.skipped = 0           # over the frame-rate cap
+        self.dropped = 0           # replaced by a newer frame before a worker was free
+        self.processed = 0
+        self.latencies = deque(maxlen=latency_window)
+        self.started = time.perf_counter()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            "stream": self.id,
+            "captured": self.captured,
+            "processed": self.processed,
+            "skipped_fps_cap": self.skipped,
+            "dropped": self.dropped,
+            "fps": self.processed / elapsed if elapsed > 0 else 0.0,
+            "latency_p50_ms": float(np.percentile(latencies, 50)),
+            "latency_p95_ms": float(np.percentile(latencies, 95)),
+        }
+
+
+class MultiStreamScheduler:
+    """Shares one FaceRecognitionSystem gallery between several streams and a worker pool."""
+
+    def __init__(self, system, workers=2, scheduling="fair", on_result=None):
+        """
+        :param system: FaceRecognitionSystem holding the shared gallery
+        :param workers: Recognition worker threads, each with its own YuNet/SFace models
+        :param scheduling: "fair" (round-robin) or "priority" (higher stream priority first)
+        :param on_result: Callable(stream_id, FrameResult)
+        """
+        if scheduling not in SCHEDULING:
+            raise ValueError(f"Unknown scheduling '{scheduling}', expected one of {SCHEDULING}")
+        self.system = system
+        self.scheduling = scheduling
+        self.on_result = on_result
+        self.streams = {}
+        self._workers = [system] + [system.worker_clone() for _ in range(max(1, workers) - 1)]
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def add_stream(self, stream_id, source, priority=0, max_fps=None, tracking=True):
+        """
+        :param source: Iterable of frames (see pipeline.open_source)
+        :param max_fps: Frames per second accepted from this stream (None = unlimited)
+        """
+        with self._cond:
+            self.streams[stream_id] = StreamState(stream_id, source, priority, max_fps, tracking)
+
+    # --- Capture side ---
+    def _capture(self, stream):
+        try:
+            for seq, frame in enumerate(stream.source):
+                if self._stop.is_set(): break
+                now = time.perf_counter()
+                stream.captured += 1
+                if now - stream.last_accept < stream.min_interval:
+                    stream.skipped += 1
+                    continue
+                with self._cond:
+                    if stream.pending is not None:
+                        stream.dropped += 1
+                    stream.pending = (seq, now, frame)
+                    stream.last_accept = now
+                    self._cond.notify()
+        finally:
+            with self._cond:
+                stream.finished = True
+                self._cond.notify_all()
+
+    # --- Worker side ---
+    def _ready(self):
+        return [s for s in self.streams.values() if s.pending is not None and not s.in_flight]
+
+    def _pick(self, ready):
+        if self.scheduling == "priority":
+            return min(ready, key=lambda s: (-s.priority, s.last_served))
+        return min(ready, key=lambda s: s.last_served)
+
+    def _all_done(self):
+        return all(s.finished and s.pending is None and not s.in_flight for s in self.streams.values())
+
+    def _worker(self, system):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._ready() or self._stop.is_set() or self._all_done())
+                ready = self._ready()
+                if not ready:
+                    return
+                stream = self._pick(ready)
+                seq, captured_at, frame = stream.pending
+                stream.pending = None
+                stream.in_flight = True
+                stream.last_served = time.perf_counter()
+
+            try:
+                locations, names = system.recognize_detected(frame, system.detect_faces(frame), stream.tracker)
+                result = FrameResult(seq, captured_at, frame, locations, names)
+                if self.on_result:
+                    self.on_result(stream.id, result)
+            except Exception as e:
+                print(f"[!] Stream {stream.id}: {e}")
+            finally:
+                with self._cond:
+                    stream.in_flight = False
+                    stream.processed += 1
+                    stream.latencies.append((time.perf_counter() - captured_at) * 1000)
+                    self._cond.notify_all()
+
+    def start(self):
+        for stream in self.streams.values():
+            thread = threading.Thread(target=self._capture, args=(stream,), name=f"capture-{stream.id}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        for i, system in enumerate(self._workers):
+            thread = threading.Thread(target=self._worker, args=(system,), name=f"recognition-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run(self):
+        """Blocking run until every source is exhausted (Ctrl+C stops)."""
+        self.start()
+        try:
+            while any(t.is_alive() for t in self._threads):
+                self.join(0.2)
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+        return self.stats()
+
+    def stats(self):
+        """Per-stream counters, throughput and end-to-end latency (capture -> result)."""
+        return [s.stats() for s in self.streams.values()]
+
+
+def print_stats(stats):
+    print(f"{'stream':>12} {'captured':>9} {'processed':>10} {'fps-cap':>8} {'dropped':>8} {'fps':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8}")
+    for row in stats:
+        print(f"{str(row['stream']):>12} {row['captured']:9d} {row['processed']:10d} {row['skipped_fps_cap']:8d} "
+              f"{row['dropped']:8d} {row['fps']:7.1f} {row['latency_p50_ms']:8.1f} {row['latency_p95_ms']:8.1f}")
+
+
+if __name__ == "__main__":
+    from main import FaceRecognitionSystem
+
+    parser = argparse.ArgumentParser(description="Several cameras sharing one gallery and a worker pool")
+    parser.add_argument("--source", action="append", required=True, help="Camera index, video file or image folder")
+    parser.add_argument("--priority", type=int, nargs="*", default=[], help="Priority per source (priority scheduling)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--policy", choices=SCHEDULING, default="fair")
+    parser.add_argument("--max-fps", type=float, default=None, help="Frame-rate cap per stream")
+    parser.add_argument("--known-faces", default="known_faces")
+    args = parser.parse_args()
+
+    def print_result(stream_id, result):
+        known = [n for n in result.names if n != "Unknown"]
+        if known:
+            print(f"[*] {stream_id} frame {result.seq}: {', '.join(known)}")
+
+    system = FaceRecognitionSystem(known_faces_dir=args.known_faces)
+    scheduler = MultiStreamScheduler(system, args.workers, args.policy, on_result=print_result)
+    for i, spec in enumerate(args.source):
+        priority = args.priority[i] if i < len(args.priority) else 0
+        scheduler.add_stream(spec, open_source(spec), priority=priority, max_fps=args.max_fps)
+    print_stats(scheduler.run())
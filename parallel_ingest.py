@@ -0,0 +1,68 @@
+import cv2
+import os
+from concurrent.futures import ProcessPoolExecutor
+from face_models import FaceDetector, create_detector, create_recognizer, encode_image, is_aligned_crop_path
+
+# Per-process models, created once by the pool initializer
+_detector = None
+_recognizer = None
+
+
+def _init_worker(yunet_path, sface_path):
+    global _detector, _recognizer
+    # One OpenCV thread per process, the pool already provides the parallelism
+    cv2.setNumThreads(1)
+    _detector = FaceDetector(create_detector(yunet_path))
+    _recognizer = create_recognizer(sface_path)
+
+
+def _encode_file(image_path):
+    """Worker task: returns (image_path, readable, feature or None)."""
+    try:
+        img = cv2.imread(image_path)
+        if img is None:
+            return image_path, False, None
+        return image_path, True, encode_image(_detector, _recognizer, img, aligned=is_aligned_crop_path(image_path))
+    except Exception as e:
+        print(f"[!] Error loading {image_path}: {e}")
+        return image_path, False, None
+
+
+def default_workers():
+    return max(1, os.cpu_count() or 1)
+
+
+def print_progress(done, total):
+    """Default progress reporter: prints roughly every 10%."""
+    step = max(1, total // 10)
+    if done == total or done % step == 0:
+        print(f"[*] Encoded {done}/{total} images")
+
+
+def encode_images(image_paths, yunet_path, sface_path, workers=None, progress=print_progress, chunksize=None,
+                  on_result=None):
+    """
+    Encode gallery images on a process pool. Each worker builds its own YuNet/SFace pair once.
+    :param image_paths: Image files to encode
+    :param workers: Number of processes (default: CPU count)
+    :param progress: Callable(done, total) or None
+    :param on_result: Callable(image_path, feature) called for each readable image as it completes
+    :return: dict image_path -> feature (None if no face). Unreadable files are left out.
+    """
+    total = len(image_paths)
+    workers = max(1, min(workers or default_workers(), total))
+    if chunksize is None:
+        chunksize = max(1, min(32, total // (workers * 8)))
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(yunet_path, sface_path)) as pool:
+        # map() keeps input order, so merging into the gallery stays deterministic
+        for done, (image_path, readable, feature) in enumerate(pool.map(_encode_file, image_paths, chunksize=chunksize), 1):
+            if readable:
+                results[image_path] = feature
+                if on_result:
+                    on_result(image_path, feature)
+            if progress:
+                progress(done, total)
+    return results
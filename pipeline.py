@@ -0,0 +1,333 @@
+"""
+Headless streaming recognition pipeline (no display required).
+
+    capture -> detect -> embed/match -> sinks
+
+Stages run in their own threads, connected by bounded queues with an explicit
+backpressure policy ("block", "drop_oldest" or "drop_newest").
+
+Usage:
+    python pipeline.py --source 0                       # camera index
+    python pipeline.py --source entrance.mp4 --jsonl results.jsonl
+    python pipeline.py --source photos/ --policy block
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+import cv2
+
+POLICIES = ("block", "drop_oldest", "drop_newest")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+FrameItem = namedtuple("FrameItem", ["seq", "timestamp", "frame", "faces"])
+FrameResult = namedtuple("FrameResult", ["seq", "timestamp", "frame", "locations", "names"])
+
+
+class BoundedQueue:
+    """Thread-safe bounded queue with a backpressure policy and a drop counter."""
+
+    def __init__(self, maxsize=4, policy="drop_oldest"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}', expected one of {POLICIES}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self._items = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def put(self, item):
+        """Returns False if the item (or an older one) had to be dropped."""
+        with self._cond:
+            if self._closed:
+                return False
+            accepted = True
+            if len(self._items) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                if self.policy == "drop_oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                    accepted = False
+                else:
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return accepted
+
+    def get(self, timeout=None):
+        """Next item, or None once the queue is closed and empty (or on timeout)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """No more puts; consumers drain what is left and then get None."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+# --- Sources ---
+def camera_source(index=0):
+    cap = cv2.VideoCapture(index)
+    if not cap.isOpened():
+        raise IOError(f"Could not open camera {index}")
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret: break
+            yield frame
+    finally:
+        cap.release()
+
+
+def video_source(path, stride=1):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video '{path}'")
+    index = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret: break
+            if index % stride == 0:
+                yield frame
+            index += 1
+    finally:
+        cap.release()
+
+
+def image_dir_source(path):
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                frame = cv2.imread(os.path.join(root, name))
+                if frame is not None:
+                    yield frame
+
+
+def open_source(spec):
+    """Camera index ("0"), image folder, or video file."""
+    if isinstance(spec, int) or str(spec).isdigit():
+        return camera_source(int(spec))
+    if os.path.isdir(spec):
+        return image_dir_source(spec)
+    return video_source(spec)
+
+
+# --- Sinks ---
+def print_sink(result):
+    known = [n for n in result.names if n != "Unknown"]
+    if result.names:
+        print(f"[*] frame {result.seq}: {len(result.names)} face(s) {', '.join(known) if known else ''}")
+
+
+class JsonLinesSink:
+    """Writes one JSON line per processed frame."""
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def __call__(self, result):
+        record = {
+            "seq": result.seq,
+            "timestamp": result.timestamp,
+            "faces": [{"box": list(loc), "name": name} for loc, name in zip(result.locations, result.names)],
+        }
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def as_dict(self, queue=None):
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return {
+            "stage": self.name,
+            "processed": self.processed,
+            "fps": self.processed / elapsed if elapsed > 0 else 0.0,
+            "busy_ms": 1000 * self.busy / self.processed if self.processed else 0.0,
+            "dropped": queue.dropped if queue is not None else 0,
+            "queue_depth": len(queue) if queue is not None else 0,
+        }
+
+
+class Pipeline:
+    """
+    Library-level streaming pipeline around a FaceRecognitionSystem.
+    Stage queues use the same backpressure policy (override per queue with `policies`).
+    """
+
+    def __init__(self, system, source, sinks=(print_sink,), queue_size=4, policy="drop_oldest",
+                 policies=None, tracker=None):
+        """
+        :param system: FaceRecognitionSystem
+        :param source: Iterable of BGR frames (see open_source)
+        :param sinks: Callables receiving FrameResult
+        :param policy: Backpressure policy for all queues
+        :param policies: Optional dict {"detect"|"embed"|"sink": policy}
+        :param tracker: Optional tracking.FaceTracker to reuse identities between frames
+        """
+        self.system = system
+        self.source = source
+        self.sinks = list(sinks)
+        self.tracker = tracker
+        policies = policies or {}
+        self.queues = {name: BoundedQueue(queue_size, policies.get(name, policy))
+                       for name in ("detect", "embed", "sink")}
+        self.stats = {name: StageStats(name) for name in ("capture", "detect", "embed", "sink")}
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _timed(self, stage):
+        stats = self.stats[stage]
+        stats.started = stats.started or time.perf_counter()
+        return stats
+
+    def _capture(self):
+        stats = self._timed("capture")
+        try:
+            for seq, frame in enumerate(self.source):
+                if self._stop.is_set(): break
+                stats.processed += 1
+                self.queues["detect"].put(FrameItem(seq, time.time(), frame, None))
+        finally:
+            stats.finished = time.perf_counter()
+            self.queues["detect"].close()
+
+    def _detect(self):
+        stats = self._timed("detect")
+        while True:
+            item = self.queues["detect"].get()
+            if item is None: break
+            start = time.perf_counter()
+            faces = self.system.detect_faces(item.frame)
+            stats.busy += time.perf_counter() - start
+            stats.processed += 1
+            self.queues["embed"].put(item._replace(faces=faces))
+        stats.finished = time.perf_counter()
+        self.queues["embed"].close()
+
+    def _embed(self):
+        stats = self._timed("embed")
+        while True:
+            item = self.queues["embed"].get()
+            if item is None: break
+            start = time.perf_counter()
+            locations, names = self.system.recognize_detected(item.frame, item.faces, self.tracker)
+            result = FrameResult(item.seq, item.timestamp, item.frame, locations, names)
+            stats.busy += time.perf_counter() - start
+            stats.processed += 1
+            self.queues["sink"].put(result)
+        stats.finished = time.perf_counter()
+        self.queues["sink"].close()
+
+    def _sink(self):
+        stats = self._timed("sink")
+        while True:
+            result = self.queues["sink"].get()
+            if result is None: break
+            start = time.perf_counter()
+            for sink in self.sinks:
+                try:
+                    sink(result)
+                except Exception as e:
+                    print(f"[!] Sink error: {e}")
+            stats.busy += time.perf_counter() - start
+            stats.processed += 1
+        stats.finished = time.perf_counter()
+
+    def start(self):
+        for target in (self._capture, self._detect, self._embed, self._sink):
+            thread = threading.Thread(target=target, name=f"pipeline-{target.__name__[1:]}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stop capturing; frames already queued are still processed."""
+        self._stop.set()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run(self):
+        """Blocking run until the source is exhausted (Ctrl+C stops capture)."""
+        self.start()
+        try:
+            while any(t.is_alive() for t in self._threads):
+                self.join(0.2)
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+        return self.report()
+
+    def report(self):
+        """Per-stage throughput, busy time per frame, drops and queue depth."""
+        inputs = {"capture": None, "detect": self.queues["detect"], "embed": self.queues["embed"],
+                  "sink": self.queues["sink"]}
+        return [self.stats[name].as_dict(inputs[name]) for name in ("capture", "detect", "embed", "sink")]
+
+
+def print_report(report):
+    print(f"{'stage':>8} {'frames':>7} {'fps':>8} {'busy ms':>8} {'dropped':>8} {'queue':>6}")
+    for row in report:
+        print(f"{row['stage']:>8} {row['processed']:7d} {row['fps']:8.1f} {row['busy_ms']:8.2f} "
+              f"{row['dropped']:8d} {row['queue_depth']:6d}")
+
+
+if __name__ == "__main__":
+    from main import FaceRecognitionSystem
+    from tracking import FaceTracker
+
+    parser = argparse.ArgumentParser(description="Headless face recognition pipeline")
+    parser.add_argument("--source", default="0", help="Camera index, video file or image folder")
+    parser.add_argument("--known-faces", default="known_faces")
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--policy", choices=POLICIES, default=None,
+                        help="Backpressure policy (default: drop_oldest for cameras, block for files)")
+    parser.add_argument("--jsonl", help="Write per-frame results as JSON lines")
+    parser.add_argument("--track", action="store_true", help="Reuse identities between frames")
+    parser.add_argument("--quiet", action="store_true", help="Do not print per-frame results")
+    args = parser.parse_args()
+
+    policy = args.policy or ("drop_oldest" if args.source.isdigit() else "block")
+    sinks = [] if args.quiet else [print_sink]
+    json_sink = JsonLinesSink(args.jsonl) if args.jsonl else None
+    if json_sink:
+        sinks.append(json_sink)
+
+    system = FaceRecognitionSystem(known_faces_dir=args.known_faces)
+    pipeline = Pipeline(system, open_source(args.source), sinks, args.queue_size, policy,
+                        tracker=FaceTracker() if args.track else None)
+    print_report(pipeline.run())
+    if json_sink:
+        json_sink.close()
@@ -0,0 +1,154 @@
+"""
+Accuracy vs. memory of the compact gallery precisions (see GalleryMatcher precision / rerank).
+
+Every configuration matches the same held-out photos and impostors as the float32 gallery
+and reports memory, time per query, the largest best-score error against float32 and how
+many accept / reject decisions at `tolerance` (and identities) changed.
+
+Memory is reported twice: the matcher's own arrays, and the private memory a fresh process
+gains by holding the gallery the way FaceRecognitionSystem does (matcher rows only, re-ranking
+rows read from the memory-mapped embedding cache) and matching the queries.
+
+    python quantization.py                          # synthetic gallery
+    python quantization.py --known-faces known_faces --tolerance 0.36
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matching import ExactRows, GalleryMatcher, normalize_rows
+from templates import split_holdout
+
+CONFIGS = (("float32", 0), ("float16", 0), ("int8", 0), ("float16", 16), ("int8", 16))
+
+
+def private_memory_mb():
+    """
+    Private (anonymous) resident memory of this process in MB. Pages of memory-mapped files,
+    such as embedding cache rows read for re-ranking, are reclaimable and not counted.
+    Falls back to peak RSS where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            _, resident, shared = (int(v) for v in f.read().split()[:3])
+        return (resident - shared) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    except ImportError:
+        return float("nan")
+
+
+def _build(cache_path, labels, precision, rerank):
+    """Matcher as FaceRecognitionSystem holds it: stored rows, re-ranking rows memory-mapped from the cache."""
+    rows = np.load(cache_path)
+    matcher = GalleryMatcher(dim=rows.shape[1], precision=precision, rerank=rerank)
+    matcher.build(rows, labels)
+    del rows
+    matcher.set_exact(ExactRows(np.load(cache_path, mmap_mode="r"), np.arange(len(labels))))
+    return matcher
+
+
+def _private_memory(task):
+    """Worker: private memory (MB) a fresh process gains by building one configuration and matching."""
+    cache_path, labels, queries, precision, rerank, tolerance = task
+    before = private_memory_mb()
+    matcher = _build(cache_path, labels, precision, rerank)
+    matcher.match(queries, tolerance)
+    return private_memory_mb() - before
+
+
+def compare(embeddings, labels, tolerance=0.36, impostors=None, configs=CONFIGS, holdout=0.2, max_queries=1000,
+            repeat=5):
+    """
+    Print one row per (precision, rerank) configuration.
+    :param impostors: Optional (M, dim) embeddings of people who are not enrolled
+    :param max_queries: Held-out photos used as queries (sampled; the rest stays out of the gallery)
+    """
+    embeddings = normalize_rows(embeddings)
+    labels = np.asarray(labels)
+    enrolled, query = split_holdout(labels, holdout)
+    held_out = np.flatnonzero(query)
+    if len(held_out) > max_queries:
+        query = np.zeros_like(query)
+        query[np.random.default_rng(0).choice(held_out, max_queries, replace=False)] = True
+    queries, truth = embeddings[query], list(labels[query])
+    if impostors is not None and len(impostors):
+        queries = np.vstack([queries, normalize_rows(impostors)])
+        truth += ["Unknown"] * len(impostors)
+    if not len(queries):
+        print("[!] Not enough photos per identity to hold out queries.")
+        return
+
+    print(f"[*] {enrolled.sum()} enrolled embeddings, {len(queries)} queries "
+          f"({len(queries) - query.sum()} impostors), tolerance {tolerance}")
+    # The enrolled rows play the embedding cache
+    cache_dir = tempfile.mkdtemp(prefix="quantization_")
+    cache_path = os.path.join(cache_dir, "embeddings.npy")
+    np.save(cache_path, embeddings[enrolled])
+    gallery_labels = list(labels[enrolled])
+    try:
+        # Whole-process memory, one fresh process per configuration
+        context = multiprocessing.get_context("spawn")
+        process_mb = []
+        for precision, rerank in configs:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                process_mb.append(pool.submit(_private_memory, (cache_path, gallery_labels, queries, precision,
+                                                                rerank, tolerance)).result())
+
+        print(f"{'precision':>9} {'rerank':>6} {'MB':>8} {'proc MB':>8} {'ms/query':>9} {'accuracy':>9} "
+              f"{'max err':>8} {'flipped':>8} {'changed id':>10}")
+        reference = None
+        for (precision, rerank), proc_mb in zip(configs, process_mb):
+            matcher = _build(cache_path, gallery_labels, precision, rerank)
+            matcher.match(queries[:1], tolerance)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                results = matcher.match(queries, tolerance)
+            elapsed = (time.perf_counter() - start) / repeat
+            matcher_mb = matcher.nbytes / 1e6
+            del matcher  # releases the memory map of the cache file
+
+            scores = np.array([r.score for r in results])
+            names = [r.name for r in results]
+            if reference is None:
+                reference = (scores, names)
+            accepted, ref_accepted = scores > tolerance, reference[0] > tolerance
+            accuracy = np.mean([str(n) == str(t) for n, t in zip(names, truth)])
+            print(f"{precision:>9} {rerank:6d} {matcher_mb:8.2f} {proc_mb:8.1f} {elapsed * 1000 / len(queries):9.4f} "
+                  f"{accuracy:9.3f} {np.abs(scores - reference[0]).max():8.5f} {int((accepted != ref_accepted).sum()):8d} "
+                  f"{sum(a != b for a, b in zip(names, reference[1])):10d}")
+    finally:
+        os.remove(cache_path)
+        os.rmdir(cache_dir)
+    print("    MB: matcher arrays in RAM; proc MB: private memory a process gains holding and matching "
+          "the gallery (re-ranking reads the memory-mapped cache)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy vs memory of float16 / int8 galleries against float32")
+    parser.add_argument("--known-faces", help="Gallery folder (default: synthetic gallery)")
+    parser.add_argument("--size", type=int, default=100000, help="Synthetic gallery embeddings")
+    parser.add_argument("--identities", type=int, default=20000)
+    parser.add_argument("--impostors", type=int, default=200, help="Synthetic queries of unenrolled people")
+    parser.add_argument("--queries", type=int, default=1000, help="Max held-out photos used as queries")
+    parser.add_argument("--tolerance", type=float, default=0.36)
+    parser.add_argument("--rerank", type=int, default=16, help="Rows re-scored in float32 for the rerank rows")
+    args = parser.parse_args()
+
+    configs = [(p, r and args.rerank) for p, r in CONFIGS]
+    impostors = None
+    if args.known_faces:
+        from main import FaceRecognitionSystem
+        system = FaceRecognitionSystem(known_faces_dir=args.known_faces)
+        embeddings, labels = np.vstack(system.known_encodings), system.known_names
+    else:
+        from ann_index import synthetic_gallery
+        embeddings, labels, _ = synthetic_gallery(args.size, identities=args.identities)
+        impostors, _, _ = synthetic_gallery(args.impostors, identities=args.impostors, seed=1)
+    compare(embeddings, labels, args.tolerance, impostors, configs, max_queries=args.queries)
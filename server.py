@@ -0,0 +1,246 @@
+"""
+Local recognition HTTP service.
+
+Models load once and stay warm. Concurrent requests are grouped into micro-batches
+(max batch size / max wait) and run on a single model thread: YuNet per image, then one
+SFace batch and one gallery match for all faces of the batch.
+
+Endpoints (POST a JPEG/PNG as the raw body, or JSON {"image": "<base64>"}):
+    /detect    -> faces with box, landmarks and detection score
+    /embed     -> faces with their 128-d SFace embedding
+    /identify  -> faces with name, score and top candidates
+    /enroll?name=<name>  (or JSON "name") -> registers the first face
+    GET /health
+
+Usage:
+    python server.py --port 8000 --max-batch 16 --max-wait-ms 5
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import cv2
+import numpy as np
+from main import check_person_name
+
+ENDPOINTS = ("detect", "embed", "identify", "enroll")
+
+
+class MicroBatcher:
+    """
+    Collects submitted jobs into batches of up to max_batch, waiting at most max_wait_ms
+    after the first job, and hands each batch to process_batch on one worker thread.
+    """
+
+    def __init__(self, process_batch, max_batch=16, max_wait_ms=5.0):
+        self.process_batch = process_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._jobs = []
+        self._cond = threading.Condition()
+        self._running = True
+        self.batches = 0
+        self.jobs = 0
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        future = Future()
+        with self._cond:
+            self._jobs.append((job, future))
+            self._cond.notify()
+        return future
+
+    def _take_batch(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._jobs or not self._running)
+            if not self._jobs:
+                return []
+            deadline = time.perf_counter() + self.max_wait
+            while len(self._jobs) < self.max_batch and self._running:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0: break
+                self._cond.wait(remaining)
+            batch = self._jobs[:self.max_batch]
+            del self._jobs[:self.max_batch]
+            return batch
+
+    def _loop(self):
+        while self._running:
+            batch = self._take_batch()
+            if not batch: continue
+            self.batches += 1
+            self.jobs += len(batch)
+            try:
+                results = self.process_batch([job for job, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
+
+
+class RecognitionService:
+    """Runs detect / embed / identify / enroll jobs in micro-batches against one FaceRecognitionSystem."""
+
+    def __init__(self, system, max_batch=16, max_wait_ms=5.0):
+        self.system = system
+        self.batcher = MicroBatcher(self._process_batch, max_batch, max_wait_ms)
+
+    def call(self, kind, image, name=None, timeout=30):
+        if kind not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{kind}'")
+        return self.batcher.submit((kind, image, name)).result(timeout)
+
+    def _process_batch(self, jobs):
+        system = self.system
+        results = [None] * len(jobs)
+
+        # Enrollment mutates the gallery, run it first so the rest of the batch sees it
+        for i, (kind, image, name) in enumerate(jobs):
+            if kind == "enroll":
+                success, message = system.register_new_face(image, name)
+                results[i] = {"success": success, "message": message}
+
+        pending = [i for i, (kind, _, _) in enumerate(jobs) if kind != "enroll"]
+        faces = {i: system.detect_faces(jobs[i][1]) for i in pending}
+
+        # One SFace batch for every face of every embed / identify request
+        needs_features = [i for i in pending if jobs[i][0] in ("embed", "identify")]
+        features = {}
+        if needs_features:
+            per_image = system.embedder.embed_frames([jobs[i][1] for i in needs_features],
+                                                     [faces[i] for i in needs_features])
+            features = dict(zip(needs_features, per_image))
+
+        # One gallery match for every identify request
+        identify = [i for i in pending if jobs[i][0] == "identify"]
+        matches = {}
+        if identify:
+            all_matches = system.identify(np.vstack([features[i] for i in identify]), top_k=3)
+            start = 0
+            for i in identify:
+                matches[i] = all_matches[start:start + len(features[i])]
+                start += len(features[i])
+
+        for i in pending:
+            kind = jobs[i][0]
+            records = [_face_record(face) for face in (faces[i] if faces[i] is not None else [])]
+            if kind == "embed":
+                for record, feature in zip(records, features[i]):
+                    record["embedding"] = [round(float(v), 6) for v in feature]
+            elif kind == "identify":
+                for record, match in zip(records, matches[i]):
+                    record.update({"name": match.name, "score": match.score, "margin": match.margin,
+                                   "candidates": [{"name": n, "score": s} for n, s in match.candidates]})
+            results[i] = {"faces": records}
+        return results
+
+
+def _face_record(face):
+    x, y, w, h = (float(v) for v in face[:4])
+    return {
+        "box": [x, y, w, h],
+        "landmarks": [[float(face[j]), float(face[j + 1])] for j in range(4, 14, 2)],
+        "score": float(face[14]),
+    }
+
+
+def decode_image(data):
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive for clients that reuse connections
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/health":
+                self._send(200, {"status": "ok", "gallery": len(service.system.known_names),
+                                 "batches": service.batcher.batches, "jobs": service.batcher.jobs})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            kind = url.path.strip("/")
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if kind not in ENDPOINTS:
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                name = parse_qs(url.query).get("name", [None])[0]
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    payload = json.loads(body)
+                    data = base64.b64decode(payload["image"])
+                    name = payload.get("name", name)
+                else:
+                    data = body
+                if kind == "enroll":
+                    # Names become folders in known_faces/, reject anything that would leave it
+                    check_person_name(name)
+                self._send(200, service.call(kind, decode_image(data), name))
+            except (ValueError, KeyError) as e:
+                self._send(400, {"error": str(e)})
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(system, host="127.0.0.1", port=8000, max_batch=16, max_wait_ms=5.0):
+    service = RecognitionService(system, max_batch, max_wait_ms)
+    httpd = ThreadingHTTPServer((host, port), make_handler(service))
+    httpd.daemon_threads = True
+    return httpd, service
+
+
+if __name__ == "__main__":
+    from main import FaceRecognitionSystem
+
+    parser = argparse.ArgumentParser(description="Local face recognition HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--known-faces", default="known_faces")
+    args = parser.parse_args()
+
+    system = FaceRecognitionSystem(known_faces_dir=args.known_faces)
+    httpd, service = serve(system, args.host, args.port, args.max_batch, args.max_wait_ms)
+    print(f"[*] Serving on http://{args.host}:{args.port} (max batch {args.max_batch}, max wait {args.max_wait_ms} ms)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.batcher.stop()
+        system.close()
@@ -0,0 +1,274 @@
+"""
+Sharded gallery search across local worker processes (scatter-gather top-k).
+
+The gallery rows live in a preallocated memory-mapped .npy file in shared memory (/dev/shm
+when available). The snapshot rows in this process are read-only views of the first rows of
+that file, and the worker processes map the same file, so the embeddings exist once no matter
+how many workers search them. Enrolling appends the new rows behind the published ones (rows
+a snapshot can see are never written again), and every query carries the row count of its
+snapshot; only removals, template rebuilds and a full file start a new file (generation).
+A query is broadcast to all shards (equal contiguous row ranges), each worker returns its
+top-k rows and the merged candidates are reduced per identity into the same FaceMatch
+results as GalleryMatcher.
+
+Shards are re-split over the new row count on every enroll / delete, so they stay balanced
+as the gallery grows or shrinks. Galleries below min_rows are searched in-process.
+
+Benchmark (latency and agreement with the single-process exact scan):
+    python sharding.py --size 500000 --shards 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from matching import GalleryMatcher, normalize_rows, quantized_scores
+import parallel_ingest
+
+# Per-process mapped gallery files: path -> (generation, array)
+_mapped = {}
+
+
+def _map(path, generation):
+    """Map a gallery file; mappings of generations older than the newest one seen are dropped."""
+    entry = _mapped.get(path)
+    if entry is None:
+        entry = _mapped[path] = (generation, np.load(path, mmap_mode="r"))
+    newest = max(g for g, _ in _mapped.values())
+    for stale in [p for p, (g, _) in _mapped.items() if g < newest]:
+        # The owner published a newer generation, so this file is (being) removed there
+        del _mapped[stale]
+    return entry[1]
+
+
+def _search_shard(task):
+    """
+    Worker task: (matrix_path, scales_path, generation, start, end, queries, k) -> (scores, rows),
+    both (Q, k) best first.
+    """
+    matrix_path, scales_path, generation, start, end, queries, k = task
+    matrix = _map(matrix_path, generation)[start:end]
+    scales = _map(scales_path, generation)[start:end] if scales_path else None
+    scores = quantized_scores(queries, matrix, scales)
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(top, order, axis=1) + start
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class _Segment:
+    """
+    One generation of shared gallery files, preallocated for `capacity` rows (unused rows of a
+    tmpfs file take no memory). Rows are only ever appended behind `length`.
+    """
+
+    def __init__(self, directory, generation, capacity, dim, dtype, scaled):
+        self.generation = generation
+        self.capacity = capacity
+        self.length = 0
+        self.matrix_path = os.path.join(directory, f"g{generation}_matrix.npy")
+        self.scales_path = os.path.join(directory, f"g{generation}_scales.npy") if scaled else None
+        self._matrix = np.lib.format.open_memmap(self.matrix_path, mode="w+", dtype=dtype, shape=(capacity, dim))
+        self._scales = None
+        if scaled:
+            self._scales = np.lib.format.open_memmap(self.scales_path, mode="w+", dtype=np.float32,
+                                                     shape=(capacity,))
+        # Snapshots get slices of these read-only maps; a file disappears with the last of them
+        # (workers drop their mapping once they see a newer generation)
+        self.matrix = np.load(self.matrix_path, mmap_mode="r")
+        weakref.finalize(self.matrix, _remove_file, self.matrix_path)
+        self.scales = None
+        if scaled:
+            self.scales = np.load(self.scales_path, mmap_mode="r")
+            weakref.finalize(self.scales, _remove_file, self.scales_path)
+
+    def fits(self, matrix, scales):
+        return (len(matrix) <= self.capacity - self.length and matrix.dtype == self._matrix.dtype
+                and (scales is None) == (self._scales is None))
+
+    def append(self, matrix, scales):
+        """Write rows behind the published ones; returns read-only (matrix, scales) views of all rows."""
+        end = self.length + len(matrix)
+        self._matrix[self.length:end] = matrix
+        if scales is not None:
+            self._scales[self.length:end] = scales
+        self.length = end
+        return self.matrix[:end], (self.scales[:end] if scales is not None else None)
+
+    @property
+    def paths(self):
+        return self.matrix_path, self.scales_path, self.generation
+
+
+class ShardedMatcher(GalleryMatcher):
+    """
+    GalleryMatcher whose exact scan runs on a pool of worker processes.
+    Same interface and copy-on-write snapshots; the ANN index is not used in this mode.
+    """
+
+    def __init__(self, dim=128, shards=None, min_rows=20000, candidates=64, precision="float32", rerank=0):
+        """
+        :param shards: Worker processes, one gallery shard each (default: CPU count)
+        :param min_rows: Galleries smaller than this are searched in this process
+        :param candidates: Rows returned per shard and query before the per-identity reduction
+        """
+        self.shards = max(1, shards or parallel_ingest.default_workers())
+        self.min_rows = min_rows
+        self._dir = tempfile.mkdtemp(prefix="face_shards_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        self._paths = {}  # snapshot version -> (matrix_path, scales_path, generation)
+        self._segment = None  # generation new rows are appended to
+        self._generation = 0
+        self._appended = None  # rows extend() wrote into the segment, published next
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._dir, True)
+        super().__init__(dim, None, candidates, precision, rerank)
+
+    def _new_segment(self, matrix, scales):
+        """Start a new generation holding these rows, with room to append half as many again."""
+        self._generation += 1
+        capacity = len(matrix) + max(len(matrix) // 2, 1024)
+        self._segment = _Segment(self._dir, self._generation, capacity, matrix.shape[1], matrix.dtype,
+                                 scales is not None)
+        return self._segment.append(matrix, scales)
+
+    def _append_rows(self, current, matrix, scales):
+        segment = self._segment
+        if (segment is not None and self._paths.get(current.version, (None,) * 3)[2] == segment.generation
+                and len(current.matrix) == segment.length and segment.fits(matrix, scales)):
+            # Behind the rows of the current snapshot: nothing already published is rewritten
+            matrix, scales = segment.append(matrix, scales)
+            self._appended = matrix
+            return matrix, scales
+        return super()._append_rows(current, matrix, scales)
+
+    def _publish(self, matrix, scales, exact, labels, index, row_ids):
+        current = self.snapshot
+        paths = None
+        if matrix is current.matrix and current.version in self._paths:
+            # Rows unchanged (e.g. a rename): the new snapshot shares the files of the current one
+            paths = self._paths[current.version]
+        elif matrix is self._appended:
+            paths = self._segment.paths
+        elif len(matrix) >= self.min_rows:
+            matrix, scales = self._new_segment(np.ascontiguousarray(matrix),
+                                               np.ascontiguousarray(scales) if scales is not None else None)
+            paths = self._segment.paths
+        else:
+            self._segment = None  # searched in-process; the files go with the last sharded snapshot
+        self._appended = None
+        super()._publish(matrix, scales, exact, labels, index, row_ids)
+        if paths is not None:
+            version = self.snapshot.version
+            self._paths[version] = paths
+            weakref.finalize(self.snapshot.matrix, self._paths.pop, version, None)
+
+    def start(self):
+        """Start the worker processes now instead of on the first sharded query."""
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: workers must not inherit the threads (camera, Qt, OpenCV) of this process
+                self._pool = ProcessPoolExecutor(max_workers=self.shards,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+                for future in [self._pool.submit(os.getpid) for _ in range(self.shards)]:
+                    future.result()
+        return self
+
+    def close(self):
+        """Stop the worker processes and remove the shared gallery files."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        self._segment = None
+        self._finalizer()
+
+    def shard_bounds(self, rows):
+        """Row ranges of the shards for a gallery of this many rows."""
+        bounds = np.linspace(0, rows, min(self.shards, max(rows, 1)) + 1).astype(np.int64)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def search(self, snap, features, k):
+        """Scatter the queries to all shards and merge their top-k. Returns (scores, rows), (Q, k) best first."""
+        matrix_path, scales_path, generation = self._paths[snap.version]
+        queries = normalize_rows(features)
+        self.start()
+        futures = [self._pool.submit(_search_shard, (matrix_path, scales_path, generation, start, end, queries, k))
+                   for start, end in self.shard_bounds(len(snap.labels))]
+        parts = [future.result() for future in futures]
+        scores = np.concatenate([p[0] for p in parts], axis=1)
+        rows = np.concatenate([p[1] for p in parts], axis=1)
+        if snap.exact is not None:
+            scores = np.einsum("qd,qkd->qk", queries, snap.exact[rows])
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+    def _match_exact(self, snap, features, tolerance, top_k):
+        if snap.version not in self._paths:
+            return super()._match_exact(snap, features, tolerance, top_k)
+        try:
+            cand_scores, cand_rows = self.search(snap, features, max(self.candidates, top_k))
+        except (OSError, KeyError, BrokenProcessPool) as e:
+            # Snapshot file already released (a very old snapshot) or a worker died
+            print(f"[!] Sharded search failed, scanning locally: {e!r}")
+            if isinstance(e, BrokenProcessPool):
+                with self._pool_lock:
+                    self._pool = None  # restarted on the next query
+            return super()._match_exact(snap, features, tolerance, top_k)
+        return self._match_candidates(snap, cand_scores, cand_rows, tolerance, top_k)
+
+
+def run_benchmark(size, shard_counts, faces=4, repeat=20, precision="float32", seed=0):
+    from ann_index import synthetic_gallery
+    gallery, labels, centres = synthetic_gallery(size, seed=seed)
+    labels = [str(label) for label in labels]
+    rng = np.random.default_rng(seed + 1)
+    queries = normalize_rows(centres[rng.integers(0, len(centres), faces)]
+                             + 0.35 * rng.normal(size=(faces, gallery.shape[1])).astype(np.float32))
+
+    single = GalleryMatcher(dim=gallery.shape[1], precision=precision)
+    single.build(list(gallery), labels)
+    expected = single.match(queries, 0.36)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        single.match(queries, 0.36)
+    baseline = (time.perf_counter() - start) / repeat * 1000
+    print(f"[*] Gallery {size}, {faces} faces per query, {precision}, {os.cpu_count()} CPUs")
+    print(f"    single process: {baseline:8.2f} ms")
+
+    for shards in shard_counts:
+        matcher = ShardedMatcher(dim=gallery.shape[1], shards=shards, min_rows=0, precision=precision)
+        matcher.build(list(gallery), labels)
+        matcher.start()
+        results = matcher.match(queries, 0.36)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            matcher.match(queries, 0.36)
+        elapsed = (time.perf_counter() - start) / repeat * 1000
+        same = all(r.name == e.name and abs(r.score - e.score) < 1e-5 for r, e in zip(results, expected))
+        print(f"    {shards:2d} shards:      {elapsed:8.2f} ms   same (name, score) as single process: {same}")
+        matcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded gallery search latency vs the single-process scan")
+    parser.add_argument("--size", type=int, default=500000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--faces", type=int, default=4)
+    parser.add_argument("--precision", choices=("float32", "float16", "int8"), default="float32")
+    args = parser.parse_args()
+    run_benchmark(args.size, args.shards, args.faces, precision=args.precision)
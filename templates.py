@@ -0,0 +1,158 @@
+"""
+Compact per-identity templates.
+Each identity is stored as its normalized mean embedding plus a few k-medoids instead of
+one row per enrolled photo, so matching cost and memory grow with people, not photos.
+
+Accuracy / speed report (templates vs per-photo matching):
+    python templates.py                          # synthetic gallery
+    python templates.py --known-faces known_faces
+"""
+import argparse
+import time
+import numpy as np
+from matching import GalleryMatcher, normalize_rows
+
+
+def k_medoids(vectors, k, iterations=10):
+    """Cosine k-medoids on normalized vectors. Returns the medoid rows."""
+    n = len(vectors)
+    if n <= k:
+        return vectors.copy()
+    sims = vectors @ vectors.T
+
+    # Farthest-point initialisation, starting from the most central photo
+    medoids = [int(np.argmax(sims.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmin(sims[:, medoids].max(axis=1))))
+
+    for _ in range(iterations):
+        assign = np.argmax(sims[:, medoids], axis=1)
+        updated = []
+        for c in range(k):
+            members = np.flatnonzero(assign == c)
+            if not len(members):
+                updated.append(medoids[c])
+                continue
+            within = sims[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[np.argmax(within)]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return vectors[medoids]
+
+
+def build_templates(vectors, medoids=3):
+    """Template rows of one identity: normalized mean + up to `medoids` medoids."""
+    vectors = normalize_rows(vectors)
+    mean = normalize_rows(vectors.mean(axis=0, keepdims=True))
+    if medoids <= 0 or len(vectors) == 1:
+        return mean
+    return np.vstack([mean, k_medoids(vectors, medoids)])
+
+
+class TemplateGallery:
+    """Per-identity photo embeddings and their templates, updated one identity at a time."""
+
+    def __init__(self, medoids=3):
+        self.medoids = medoids
+        self.members = {}    # name -> list of normalized (dim,) embeddings
+        self.templates = {}  # name -> (m, dim) template rows
+
+    def build(self, encodings, names):
+        self.members = {}
+        for encoding, name in zip(encodings, names):
+            self.members.setdefault(name, []).append(normalize_rows(encoding)[0])
+        self.templates = {name: build_templates(np.vstack(rows), self.medoids) for name, rows in self.members.items()}
+
+    def add(self, encoding, name):
+        """Add one photo embedding and recompute only that identity's templates."""
+        self.members.setdefault(name, []).append(normalize_rows(encoding)[0])
+        self.templates[name] = build_templates(np.vstack(self.members[name]), self.medoids)
+
+    def remove(self, name):
+        self.members.pop(name, None)
+        self.templates.pop(name, None)
+
+    def update(self, name, encodings):
+        """Replace one identity's photo embeddings (removes the identity when empty)."""
+        if not len(encodings):
+            self.remove(name)
+            return
+        self.members[name] = [normalize_rows(e)[0] for e in encodings]
+        self.templates[name] = build_templates(np.vstack(self.members[name]), self.medoids)
+
+    def rename(self, old_name, new_name):
+        if old_name in self.members:
+            self.members[new_name] = self.members.pop(old_name)
+            self.templates[new_name] = self.templates.pop(old_name)
+
+    def rows(self):
+        """(encodings, names) of all template rows, in a stable identity order."""
+        encodings = []
+        names = []
+        for name in sorted(self.templates):
+            for row in self.templates[name]:
+                encodings.append(row.reshape(1, -1))
+                names.append(name)
+        return encodings, names
+
+
+def split_holdout(labels, holdout=0.2, seed=0):
+    """Per identity, hold out a fraction of photos (identities with one photo stay enrolled)."""
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    query = np.zeros(len(labels), dtype=bool)
+    for name in np.unique(labels):
+        idx = np.flatnonzero(labels == name)
+        n_query = int(len(idx) * holdout)
+        if len(idx) > 1 and n_query:
+            query[rng.choice(idx, n_query, replace=False)] = True
+    return ~query, query
+
+
+def compare(embeddings, labels, tolerance=0.36, medoids=3, holdout=0.2, repeat=5):
+    """Print accuracy / latency / size of per-photo vs template matching on held-out photos."""
+    embeddings = normalize_rows(embeddings)
+    labels = np.asarray(labels)
+    enrolled, query = split_holdout(labels, holdout)
+    queries, truth = embeddings[query], labels[query]
+    if not len(queries):
+        print("[!] Not enough photos per identity to hold out queries.")
+        return
+
+    photos = GalleryMatcher(dim=embeddings.shape[1])
+    photos.build(list(embeddings[enrolled]), list(labels[enrolled]))
+    templates = TemplateGallery(medoids)
+    templates.build(list(embeddings[enrolled]), list(labels[enrolled]))
+    compact = GalleryMatcher(dim=embeddings.shape[1])
+    compact.build(*templates.rows())
+
+    print(f"[*] {len(np.unique(labels))} identities, {enrolled.sum()} enrolled photos, {len(queries)} queries")
+    print(f"{'mode':>10} {'rows':>8} {'MB':>8} {'accuracy':>9} {'ms/query':>9}")
+    for mode, matcher in (("photos", photos), ("templates", compact)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results = matcher.match(queries, tolerance)
+        elapsed = (time.perf_counter() - start) / repeat
+        accuracy = np.mean([r.name == t for r, t in zip(results, truth)])
+        print(f"{mode:>10} {len(matcher):8d} {matcher.matrix.nbytes / 1e6:8.2f} {accuracy:9.3f} "
+              f"{elapsed * 1000 / len(queries):9.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-photo vs per-identity template matching")
+    parser.add_argument("--known-faces", help="Gallery folder (default: synthetic gallery)")
+    parser.add_argument("--identities", type=int, default=1000)
+    parser.add_argument("--photos", type=int, default=30, help="Photos per synthetic identity")
+    parser.add_argument("--medoids", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.36)
+    args = parser.parse_args()
+
+    if args.known_faces:
+        from main import FaceRecognitionSystem
+        system = FaceRecognitionSystem(known_faces_dir=args.known_faces)
+        embeddings, labels = np.vstack(system.known_encodings), system.known_names
+    else:
+        from ann_index import synthetic_gallery
+        embeddings, labels, _ = synthetic_gallery(args.identities * args.photos, identities=args.identities)
+    compare(embeddings, labels, args.tolerance, args.medoids)
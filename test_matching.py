@@ -0,0 +1,329 @@
+"""
+Tests of the gallery hot path: vectorized matching against FaceRecognizerSF.match, compact
+precisions, the embedding cache, the IVF index and the small pipeline helpers.
+
+    python -m pytest -q
+"""
+import os
+import threading
+import cv2
+import numpy as np
+import pytest
+from ann_index import IVFIndex, synthetic_gallery
+from embedding_store import EmbeddingStore
+from enroll import claim_path
+from face_models import SFACE_FILE
+from frame_ring import FrameRing
+from matching import ExactRows, GalleryMatcher, normalize_rows, quantize_rows, quantized_scores
+from pipeline import BoundedQueue
+from video_index import merge_intervals, split_segments
+
+TOLERANCE = 0.36
+
+
+def _tiny_onnx(path):
+    """Smallest network FaceRecognizerSF loads; match() never runs it."""
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper
+    graph = helper.make_graph([helper.make_node("Flatten", ["data"], ["fc1"], axis=1)], "sface",
+                              [helper.make_tensor_value_info("data", TensorProto.FLOAT, [1, 3, 112, 112])],
+                              [helper.make_tensor_value_info("fc1", TensorProto.FLOAT, [1, 3 * 112 * 112])])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 11)])
+    model.ir_version = 7
+    onnx.save(model, path)
+
+
+@pytest.fixture(scope="module")
+def recognizer(tmp_path_factory):
+    path = os.path.join("models", SFACE_FILE)
+    if not os.path.isfile(path):
+        path = str(tmp_path_factory.mktemp("models") / "sface.onnx")
+        _tiny_onnx(path)
+    return cv2.FaceRecognizerSF.create(path, "")
+
+
+@pytest.fixture(scope="module")
+def gallery():
+    """(rows, labels, queries): clustered embeddings and noisy queries of enrolled people."""
+    rows, labels, centres = synthetic_gallery(400, identities=40)
+    rng = np.random.default_rng(1)
+    queries = normalize_rows(centres[rng.integers(0, 40, 12)] + 0.6 * rng.normal(size=(12, 128)))
+    return rows, [f"person{label}" for label in labels], queries
+
+
+def legacy_match(recognizer, query, rows, names, tolerance):
+    """The original per-pair loop of FaceRecognitionSystem: best score above tolerance wins."""
+    best_name, best_score = "Unknown", -1.0
+    max_score = -1.0
+    for row, name in zip(rows, names):
+        score = recognizer.match(query.reshape(1, -1), row.reshape(1, -1), cv2.FaceRecognizerSF_FR_COSINE)
+        best_score = max(best_score, score)
+        if score > tolerance and score > max_score:
+            max_score, best_name = score, name
+    return best_name, best_score
+
+
+def test_match_agrees_with_face_recognizer_sf_at_tolerance(recognizer, gallery):
+    rows, names, queries = gallery
+    matcher = GalleryMatcher()
+    matcher.build(list(rows), names)
+    for query in queries:
+        _, best = legacy_match(recognizer, query, rows, names, TOLERANCE)
+        # Just below and just above the best score: accepted, then rejected
+        for tolerance in (best - 1e-4, best + 1e-4):
+            expected_name, expected_score = legacy_match(recognizer, query, rows, names, tolerance)
+            result = matcher.match(query, tolerance)[0]
+            assert result.name == expected_name
+            assert result.score == pytest.approx(expected_score, abs=1e-5)
+
+
+@pytest.mark.parametrize("precision", ["float16", "int8"])
+def test_quantized_score_error_is_bounded(gallery, precision):
+    rows, _, queries = gallery
+    codes, scales = quantize_rows(rows, precision)
+    error = np.abs(quantized_scores(queries, codes, scales) - queries @ rows.T)
+    if precision == "int8":
+        # Every code is off by at most half a step: |q . (v - v')| <= scale / 2 * sum |q|
+        bound = 0.5 * scales[None, :] * np.abs(queries).sum(axis=1, keepdims=True)
+    else:
+        bound = 2.0 ** -11 * (np.abs(queries) @ np.abs(rows).T)
+    assert np.all(error <= bound + 1e-6)
+
+
+@pytest.mark.parametrize("exact", ["ram", "memmap"])
+def test_rerank_restores_float32_results(gallery, tmp_path, exact):
+    rows, names, queries = gallery
+    reference = GalleryMatcher()
+    reference.build(list(rows), names)
+    matcher = GalleryMatcher(precision="int8", rerank=16)
+    matcher.build(list(rows), names)
+    if exact == "memmap":
+        np.save(tmp_path / "rows.npy", rows)
+        assert matcher.set_exact(ExactRows(np.load(tmp_path / "rows.npy", mmap_mode="r"), np.arange(len(rows))))
+    for result, expected in zip(matcher.match(queries, TOLERANCE), reference.match(queries, TOLERANCE)):
+        assert result.name == expected.name
+        assert result.score == pytest.approx(expected.score, abs=1e-6)
+
+
+def test_snapshot_is_unchanged_by_later_updates(gallery):
+    rows, names, queries = gallery
+    matcher = GalleryMatcher()
+    matcher.build(list(rows[:200]), names[:200])
+    snapshot = matcher.snapshot
+    before = matcher.match(queries, TOLERANCE, snapshot=snapshot)
+    matcher.extend(list(rows[200:]), names[200:])
+    matcher.remove(range(50))
+    matcher.rename(names[100], "renamed")
+    assert matcher.match(queries, TOLERANCE, snapshot=snapshot) == before
+    rebuilt = GalleryMatcher()
+    rebuilt.build(list(rows[50:]), ["renamed" if n == names[100] else n for n in names[50:]])
+    assert matcher.match(queries, TOLERANCE) == rebuilt.match(queries, TOLERANCE)
+
+
+def test_ivf_recall():
+    rows, _, _ = synthetic_gallery(20000, identities=2000)
+    rng = np.random.default_rng(2)
+    queries = normalize_rows(rows[rng.integers(0, len(rows), 200)] + 0.1 * rng.normal(size=(200, 128)))
+    exact = np.argmax(queries @ rows.T, axis=1)
+    index = IVFIndex(exact_threshold=0)
+    index.add(np.arange(len(rows)), rows)
+    index.train(rows)
+
+    recall = {}
+    for nprobe in (4, 16, len(index.centroids)):
+        index.nprobe = nprobe
+        _, ids = index.search(queries, k=1)
+        recall[nprobe] = np.mean(ids[:, 0] == exact)
+    assert recall[4] <= recall[16]
+    assert recall[16] >= 0.95
+    assert recall[len(index.centroids)] == 1.0  # every cell scanned: exact
+
+
+def test_ivf_cells_follow_the_gallery_size():
+    rows, labels, _ = synthetic_gallery(80000, identities=8000)
+    labels = [str(label) for label in labels]
+    matcher = GalleryMatcher(index=IVFIndex(exact_threshold=1000))
+    matcher.build(list(rows[:5000]), labels[:5000], train=False)
+    assert not matcher.index.is_trained  # partial galleries are never trained on
+    matcher.build(list(rows[:5000]), labels[:5000])
+    small = len(matcher.index.centroids)
+    assert small == int(np.sqrt(5000))
+
+    matcher.extend(list(rows[5000:12000]), labels[5000:12000])
+    assert len(matcher.index.centroids) == small  # within 2x of sqrt(N): cells kept
+    matcher.build(list(rows), labels)
+    assert len(matcher.index.centroids) == int(np.sqrt(80000))
+
+
+def test_ivf_matcher_edits_keep_row_mapping(gallery):
+    rows, queries = synthetic_gallery(3000, identities=300)[0], gallery[2]
+    names = [f"p{i % 300}" for i in range(len(rows))]
+    index = IVFIndex(exact_threshold=100)
+    matcher, reference = GalleryMatcher(index=index), GalleryMatcher()
+    for m in (matcher, reference):
+        m.build(list(rows[:2000]), names[:2000])
+        m.remove(range(0, 2000, 3))
+        m.extend(list(rows[2000:]), names[2000:])
+        m.remove([5, 1500])
+    matcher.index.nprobe = len(matcher.index.centroids)  # every cell: must equal the exact scan
+    assert len(matcher.index) == len(matcher) == len(reference)
+    for result, expected in zip(matcher.match(queries, TOLERANCE), reference.match(queries, TOLERANCE)):
+        assert (result.name, result.index) == (expected.name, expected.index)
+        assert result.score == pytest.approx(expected.score, abs=1e-5)
+
+
+def _store(tmp_path, **kwargs):
+    model = tmp_path / "model.onnx"
+    if not model.exists():
+        model.write_bytes(b"model v1")
+    return EmbeddingStore(str(tmp_path / "cache"), str(tmp_path / "known"), [str(model)], **kwargs)
+
+
+@pytest.fixture
+def photos(tmp_path):
+    person = tmp_path / "known" / "alice"
+    person.mkdir(parents=True)
+    paths = []
+    for i in range(3):
+        path = person / f"{i}.jpg"
+        path.write_bytes(b"jpeg" * (i + 1))
+        paths.append(str(path))
+    return paths
+
+
+def test_embedding_store_round_trip_and_invalidation(tmp_path, photos):
+    features = normalize_rows(np.random.default_rng(0).normal(size=(3, 128)))
+    store = _store(tmp_path)
+    assert store.load() == 0
+    for path, feature in zip(photos, features):
+        store.put(path, feature)
+    store.put(photos[2], None)  # no face
+    store.save()
+
+    store = _store(tmp_path)
+    assert store.load() == 3
+    hit, feature = store.get(photos[0])
+    assert hit and np.allclose(feature, features[0])
+    assert store.get(photos[2]) == (True, None)
+    matrix, ids = store.rows(photos[:2])
+    assert np.allclose(np.asarray(matrix)[ids], features[:2])
+    assert store.rows(photos) is None  # photos[2] has no row
+
+    # A changed image is encoded again, the others stay cached
+    with open(photos[1], "ab") as f:
+        f.write(b"more")
+    assert store.get(photos[1]) == (False, None)
+    assert store.get(photos[0])[0]
+
+    # A changed model invalidates everything
+    (tmp_path / "model.onnx").write_bytes(b"model v2, retrained")
+    store = _store(tmp_path)
+    assert store.load() == 0
+    assert store.get(photos[0]) == (False, None)
+
+
+def test_embedding_store_edits_append_until_compacted(tmp_path, photos):
+    features = normalize_rows(np.random.default_rng(1).normal(size=(3, 128)))
+    store = _store(tmp_path)
+    store.load()
+    store.put(photos[0], features[0])
+    store.save()
+    index_path = tmp_path / "cache" / "index.json"
+    index_bytes = index_path.read_bytes()
+
+    # Later edits append rows / journal lines; index.json and the generation stay as they are
+    store.put(photos[1], features[1])
+    store.save()
+    store.move(photos[0], photos[2])
+    store.remove([photos[1]])
+    store.save()
+    assert index_path.read_bytes() == index_bytes
+    assert sorted(os.listdir(tmp_path / "cache")) == ["embeddings-1.f32", "index.json", "journal-1.jsonl"]
+
+    store = _store(tmp_path)
+    assert store.load() == 1
+    assert store.get(photos[1]) == (False, None)
+    assert not store.get(photos[0])[0]
+    # move() keeps the size/mtime of the original image, so stat the image it was cached for
+    assert np.allclose(store.get(photos[2], os.stat(photos[0]))[1], features[0])
+
+    store.compact()
+    assert sorted(os.listdir(tmp_path / "cache")) == ["embeddings-2.f32", "index.json"]
+    store = _store(tmp_path)
+    assert store.load() == 1
+    matrix, ids = store.rows([photos[2]])
+    assert len(matrix) == 1 and np.allclose(np.asarray(matrix)[ids], features[:1])
+
+
+def test_embedding_store_read_only_never_writes(tmp_path, photos):
+    store = _store(tmp_path, read_only=True)
+    store.load()
+    store.put(photos[0], np.ones((1, 128), dtype=np.float32))
+    store.save()
+    assert not (tmp_path / "cache").exists()
+    assert store.get(photos[0])[0]  # pending entries still serve this process
+
+
+@pytest.mark.parametrize("policy, kept, accepted", [
+    ("drop_oldest", [2, 3], [True, True, False, False]),
+    ("drop_newest", [0, 1], [True, True, False, False]),
+])
+def test_bounded_queue_drop_policies(policy, kept, accepted):
+    q = BoundedQueue(maxsize=2, policy=policy)
+    assert [q.put(i) for i in range(4)] == accepted
+    assert q.dropped == 2
+    q.close()
+    assert [q.get(), q.get(), q.get()] == kept + [None]
+
+
+def test_bounded_queue_block_waits_for_room():
+    q = BoundedQueue(maxsize=1, policy="block")
+    q.put(0)
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (q.put(1), done.set()))
+    thread.start()
+    assert not done.wait(0.1)
+    assert q.get() == 0
+    assert done.wait(2)
+    assert q.get() == 1
+    thread.join()
+
+
+def test_frame_ring_detects_overwritten_frames():
+    ring = FrameRing((4, 4, 3), slots=2, lock=threading.Lock())
+    try:
+        frames = [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(4)]
+        seqs = [ring.write(frame, timestamp=float(i)) for i, frame in enumerate(frames)]
+        assert ring.read(seqs[0]) is None  # lapped: its slot holds frame 2 now
+        frame, timestamp = ring.read(seqs[3])
+        assert np.array_equal(frame, frames[3]) and timestamp == 3.0
+        assert ring.claim_latest() == seqs[3]
+        assert ring.claim_latest() == 0
+        assert ring.read_latest(after=seqs[3]) is None
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_split_segments_cover_every_frame_on_stride_boundaries():
+    segments = split_segments(1000, 3, 5)
+    assert segments[0][0] == 0 and segments[-1][1] == 1000
+    assert all(end == start for (_, end), (start, _) in zip(segments, segments[1:]))
+    assert all(start % 5 == 0 for start, _ in segments)
+    assert split_segments(0, 4, 5) == [(0, float("inf"))]
+
+
+def test_merge_intervals_joins_gaps_up_to_max_gap():
+    detections = [(0, [("bob", 0.5, None)]), (10, [("bob", 0.7, None)]), (100, [("bob", 0.6, None)]),
+                  (10, [("bob", 0.4, None), ("eve", 0.9, None)])]
+    intervals = merge_intervals(detections, fps=10, max_gap=1.0)
+    assert [(i["name"], i["start_frame"], i["end_frame"], i["hits"], i["best_score"]) for i in intervals] == [
+        ("bob", 0, 10, 2, 0.7), ("eve", 10, 10, 1, 0.9), ("bob", 100, 100, 1, 0.6)]
+    assert [i["name"] for i in merge_intervals(detections, fps=10, min_hits=2)] == ["bob"]
+
+
+def test_claim_path_never_reuses_a_file(tmp_path):
+    first = claim_path(str(tmp_path), "alice_20260101_000000_0000")
+    second = claim_path(str(tmp_path), "alice_20260101_000000_0000")
+    assert first != second and os.path.exists(first) and os.path.exists(second)
+    assert second.endswith("_0000_1.aligned.png")
@@ -0,0 +1,136 @@
+import numpy as np
+
+
+def box_iou(a, b):
+    """IoU between two boxes in YuNet (x, y, w, h) format."""
+    ax2, ay2 = a[0] + a[2], a[1] + a[3]
+    bx2, by2 = b[0] + b[2], b[1] + b[3]
+    iw = max(0.0, min(ax2, bx2) - max(a[0], b[0]))
+    ih = max(0.0, min(ay2, by2) - max(a[1], b[1]))
+    inter = iw * ih
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return float(inter / union) if union > 0 else 0.0
+
+
+def landmark_distance(a, b):
+    """Mean distance between the 5 YuNet landmarks, relative to the box diagonal of a."""
+    diag = float(np.hypot(a[2], a[3])) or 1.0
+    la = np.asarray(a[4:14], dtype=np.float32).reshape(5, 2)
+    lb = np.asarray(b[4:14], dtype=np.float32).reshape(5, 2)
+    return float(np.linalg.norm(la - lb, axis=1).mean()) / diag
+
+
+class Track:
+    """One face followed across frames, with the identity from its last SFace embedding."""
+
+    def __init__(self, track_id, face):
+        self.id = track_id
+        self.face = face
+        self.name = "Unknown"
+        self.score = -1.0
+        self.embedded_face = None   # detection used for the last embedding
+        self.frames_since_embed = 0
+        self.missed = 0
+        self.hits = 1
+
+
+class FaceTracker:
+    """
+    Lightweight multi-face tracker on top of YuNet detections.
+    Detections are associated with existing tracks by IoU (or landmark distance for fast
+    motion); a face is only re-embedded when its track is new, the refresh interval has
+    passed, or its box changed too much since the last embedding.
+    """
+
+    def __init__(self, iou_threshold=0.3, landmark_threshold=0.15, refresh_interval=15,
+                 max_box_change=0.5, max_missed=5):
+        """
+        :param iou_threshold: Min IoU to associate a detection with a track
+        :param landmark_threshold: Max relative landmark distance to associate when IoU is too low
+        :param refresh_interval: Re-embed a track every n frames (0 = never refresh)
+        :param max_box_change: Re-embed when IoU with the last embedded box drops below 1 - this
+        :param max_missed: Frames a track survives without a matching detection
+        """
+        self.iou_threshold = iou_threshold
+        self.landmark_threshold = landmark_threshold
+        self.refresh_interval = refresh_interval
+        self.max_box_change = max_box_change
+        self.max_missed = max_missed
+        self.tracks = []
+        self._next_id = 1
+        self.embeds = 0
+        self.reuses = 0
+        # Gallery snapshot version the track identities were matched against
+        self.gallery_version = None
+
+    def reset(self):
+        self.tracks = []
+
+    def _associate(self, faces):
+        """Greedy association, best IoU first. Returns dict face index -> track."""
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for fi, face in enumerate(faces):
+                iou = box_iou(track.face, face)
+                if iou >= self.iou_threshold or landmark_distance(track.face, face) <= self.landmark_threshold:
+                    pairs.append((iou, ti, fi))
+        pairs.sort(key=lambda p: -p[0])
+
+        assigned = {}
+        used_tracks = set()
+        for _, ti, fi in pairs:
+            if ti in used_tracks or fi in assigned: continue
+            assigned[fi] = self.tracks[ti]
+            used_tracks.add(ti)
+        return assigned
+
+    def _needs_embedding(self, track):
+        if track.embedded_face is None:
+            return True
+        if self.refresh_interval and track.frames_since_embed >= self.refresh_interval:
+            return True
+        return box_iou(track.embedded_face, track.face) < 1.0 - self.max_box_change
+
+    def update(self, faces):
+        """
+        Update tracks with the detections of a new frame.
+        :param faces: YuNet (N, 15) array or None
+        :return: list of (track, needs_embedding), one per detection
+        """
+        faces = [] if faces is None else faces
+        assigned = self._associate(faces)
+
+        matched = set()
+        results = []
+        for fi, face in enumerate(faces):
+            track = assigned.get(fi)
+            if track is None:
+                track = Track(self._next_id, face)
+                self._next_id += 1
+                self.tracks.append(track)
+            else:
+                track.face = face
+                track.frames_since_embed += 1
+                track.hits += 1
+            track.missed = 0
+            matched.add(track.id)
+
+            needs = self._needs_embedding(track)
+            if needs:
+                self.embeds += 1
+            else:
+                self.reuses += 1
+            results.append((track, needs))
+
+        for track in self.tracks:
+            if track.id not in matched:
+                track.missed += 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+        return results
+
+    def assign(self, track, match):
+        """Store the identity of a freshly embedded track (match is a matching.FaceMatch)."""
+        track.name = match.name
+        track.score = match.score
+        track.embedded_face = track.face
+        track.frames_since_embed = 0
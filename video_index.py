@@ -0,0 +1,210 @@
+"""
+Offline video indexing: when did enrolled people appear in a recording?
+
+The video is split into segments that worker processes decode independently (seek to the
+segment start, grab() skipped frames without decoding them, recognize every stride-th frame).
+Per-frame matches are merged into time-coded appearance intervals per identity and written
+as JSON and/or CSV.
+
+Usage:
+    python video_index.py entrance.mp4 --stride 5 --workers 8 --json entrance.json --csv entrance.csv
+"""
+import argparse
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import parallel_ingest
+
+# Per-process FaceRecognitionSystem, created once by the pool initializer
+_system = None
+
+
+def _init_worker(system_kwargs):
+    global _system
+    from main import FaceRecognitionSystem
+    _system = FaceRecognitionSystem(progress=None, **dict(system_kwargs, cache_read_only=True))
+    # One OpenCV thread per process (also over a tuned inference profile), the pool already provides the parallelism
+    cv2.setNumThreads(1)
+
+
+def _index_segment(task):
+    """Worker task: (video_path, start, end, stride) -> list of (frame_index, [(name, score, box)])."""
+    video_path, start, end, stride = task
+    cap = cv2.VideoCapture(video_path)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    detections = []
+    index = start
+    try:
+        while index < end:
+            if index % stride:
+                # Skipped frames are only demuxed, not decoded
+                if not cap.grab(): break
+                index += 1
+                continue
+            ok, frame = cap.read()
+            if not ok: break
+            faces = _system.detect_faces(frame)
+            if faces is not None:
+                features = _system.embedder.embed_faces(frame, faces)
+                matches = _system.identify(features)
+                hits = [(m.name, m.score, [int(v) for v in face[:4]])
+                        for m, face in zip(matches, faces) if m.name != "Unknown"]
+                if hits:
+                    detections.append((index, hits))
+            index += 1
+    finally:
+        cap.release()
+    return detections
+
+
+def split_segments(frame_count, segments, stride):
+    """[start, end) frame ranges of roughly equal size, starting on stride boundaries."""
+    if frame_count <= 0:
+        return [(0, float("inf"))]
+    segments = max(1, min(segments, frame_count // max(stride, 1) or 1))
+    size = -(-frame_count // segments)
+    size += -size % stride
+    return [(start, min(start + size, frame_count)) for start in range(0, frame_count, size)]
+
+
+def merge_intervals(detections, fps, max_gap=1.0, min_hits=1):
+    """
+    Merge per-frame matches into appearance intervals per identity.
+    :param detections: list of (frame_index, [(name, score, box)])
+    :param max_gap: Seconds without a match that still continue the same interval
+    :param min_hits: Matched frames an interval needs to be reported
+    :return: list of dicts (name, start, end, start_frame, end_frame, hits, best_score), by start time
+    """
+    per_identity = {}
+    for frame_index, hits in sorted(detections):
+        for name, score, _ in hits:
+            per_identity.setdefault(name, {})
+            best = per_identity[name].get(frame_index, -1.0)
+            per_identity[name][frame_index] = max(best, score)
+
+    intervals = []
+    for name, frames in per_identity.items():
+        current = None
+        for frame_index in sorted(frames):
+            score = frames[frame_index]
+            if current is not None and (frame_index - current["end_frame"]) / fps <= max_gap:
+                current["end_frame"] = frame_index
+                current["hits"] += 1
+                current["best_score"] = max(current["best_score"], score)
+                continue
+            if current is not None:
+                intervals.append(current)
+            current = {"name": name, "start_frame": frame_index, "end_frame": frame_index,
+                       "hits": 1, "best_score": score}
+        if current is not None:
+            intervals.append(current)
+
+    intervals = [i for i in intervals if i["hits"] >= min_hits]
+    for interval in intervals:
+        interval["start"] = round(interval["start_frame"] / fps, 3)
+        interval["end"] = round(interval["end_frame"] / fps, 3)
+        interval["best_score"] = round(interval["best_score"], 4)
+    return sorted(intervals, key=lambda i: (i["start"], i["name"]))
+
+
+def timecode(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+
+def index_video(video_path, system_kwargs=None, stride=5, workers=None, segments=None, max_gap=1.0, min_hits=1):
+    """
+    Index a video file with a pool of FaceRecognitionSystem workers.
+    :param system_kwargs: FaceRecognitionSystem arguments for the workers (gallery folder, cache, tolerance...);
+        the workers open the embedding cache read-only, this process updates it before they start
+    :param stride: Recognize every n-th frame
+    :param segments: Number of video segments (default: 2 per worker)
+    :return: dict with video metadata and the appearance intervals
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video '{video_path}'")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    workers = max(1, workers or parallel_ingest.default_workers())
+    ranges = split_segments(frame_count, segments or workers * 2, stride)
+    tasks = [(video_path, start, end, stride) for start, end in ranges]
+    print(f"[*] {video_path}: {frame_count} frames at {fps:.1f} fps, {len(tasks)} segments, "
+          f"stride {stride}, {workers} workers")
+
+    # Encode new gallery photos and write the embedding cache once, here, instead of in every worker
+    from main import FaceRecognitionSystem
+    with FaceRecognitionSystem(**dict(system_kwargs or {}, background=False)):
+        pass
+
+    started = time.perf_counter()
+    detections = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                             initargs=(system_kwargs or {},)) as pool:
+        for done, segment in enumerate(pool.map(_index_segment, tasks), 1):
+            detections.extend(segment)
+            print(f"[*] Segment {done}/{len(tasks)} done")
+    elapsed = time.perf_counter() - started
+
+    duration = frame_count / fps if frame_count > 0 else 0.0
+    intervals = merge_intervals(detections, fps, max_gap, min_hits)
+    print(f"[*] Indexed {duration:.0f} s of video in {elapsed:.1f} s "
+          f"({duration / elapsed if elapsed else 0:.1f}x real time), {len(intervals)} appearances")
+    return {
+        "video": video_path,
+        "fps": fps,
+        "frames": frame_count,
+        "duration": round(duration, 3),
+        "stride": stride,
+        "elapsed": round(elapsed, 3),
+        "intervals": intervals,
+    }
+
+
+def write_json(index, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+
+
+def write_csv(index, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "start", "end", "start_s", "end_s", "hits", "best_score"])
+        for i in index["intervals"]:
+            writer.writerow([i["name"], timecode(i["start"]), timecode(i["end"]), i["start"], i["end"],
+                             i["hits"], i["best_score"]])
+
+
+if __name__ == "__main__":
+    from main import FaceRecognitionSystem
+
+    parser = argparse.ArgumentParser(description="Index a video file into per-person appearance intervals")
+    parser.add_argument("video")
+    parser.add_argument("--stride", type=int, default=5, help="Recognize every n-th frame")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--segments", type=int, default=None, help="Video segments (default 2 per worker)")
+    parser.add_argument("--max-gap", type=float, default=1.0, help="Seconds without a match inside one interval")
+    parser.add_argument("--min-hits", type=int, default=1, help="Matched frames needed per interval")
+    parser.add_argument("--known-faces", default="known_faces")
+    parser.add_argument("--detection-max-side", type=int, default=None)
+    parser.add_argument("--json", help="Write the index as JSON")
+    parser.add_argument("--csv", help="Write the intervals as CSV")
+    args = parser.parse_args()
+
+    system_kwargs = {"known_faces_dir": args.known_faces, "detection_max_side": args.detection_max_side}
+    # Encode the gallery once here, the workers then start from the embedding cache
+    FaceRecognitionSystem(**system_kwargs)
+    index = index_video(args.video, system_kwargs, args.stride, args.workers, args.segments,
+                        args.max_gap, args.min_hits)
+    if args.json:
+        write_json(index, args.json)
+    if args.csv:
+        write_csv(index, args.csv)
+    for i in index["intervals"]:
+        print(f"    {i['name']:<20} {timecode(i['start'])} - {timecode(i['end'])}  ({i['hits']} frames)")